@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# Aligns the texts of two files by uttid, like the Kaldi tool align-text,
+# so that miscue annotations can be scored without Kaldi.
+# The output is the same: uttid ref hyp ; ref hyp ; ...
+# with <eps> for the insertions and deletions, and the same alignment is
+# chosen among equally good ones.
+import sys
+
+# The labels of the annotation which are attached to the next word, e.g. [CORRECT]the
+key_labels = ["[CORRECT]", "[REP]", "[SKIP]", "[JUMP]"]
+
+def attachLabels(tokens):
+    """ Joins each key label with the word that follows it, e.g.
+    [CORRECT] the [SKIP] cat <SPOKEN_NOISE> -> [CORRECT]the [SKIP]cat <SPOKEN_NOISE> """
+    attached = []
+    label = None
+    for token in tokens:
+        if label is not None:
+            attached.append(label + token)
+            label = None
+        elif token in key_labels:
+            label = token
+        else:
+            attached.append(token)
+    if label is not None:
+        attached.append(label)
+    return attached
+
+def bandedEditDistances(ref, hyp, band):
+    """ The edit distance table of ref and hyp, for the cells within band of the
+    diagonal; the others are left out, as if they cost more than band.
+    Returns a list of (first column, costs) for each row. """
+    n, m = len(ref), len(hyp)
+    over = band + 1
+    rows = [(0, list(range(min(m, band) + 1)))]
+    for i in range(1, n + 1):
+        prev_lo, prev = rows[-1]
+        prev_hi = prev_lo + len(prev) - 1
+        lo, hi = max(0, i - band), min(m, i + band)
+        ref_word = ref[i-1]
+        row = []
+        left = over
+        for j in range(lo, hi + 1):
+            if j == 0:
+                cost = i
+            else:
+                diag = prev[j-1-prev_lo] if j - 1 >= prev_lo else over
+                up = prev[j-prev_lo] if j <= prev_hi else over
+                cost = diag + (ref_word != hyp[j-1])
+                if up + 1 < cost:
+                    cost = up + 1
+                if left + 1 < cost:
+                    cost = left + 1
+            row.append(cost)
+            left = cost
+        rows.append((lo, row))
+    return rows
+
+def levenshteinAlignment(ref, hyp, eps="<eps>"):
+    """ Returns the alignment of ref and hyp with the fewest edits as a list of
+    (ref, hyp) pairs, with eps for the missing side, and the number of edits.
+    Where several alignments have as few edits, the backtrace picks, from the end,
+    a match or a substitution first, then a deletion, then an insertion, like
+    Kaldi's LevenshteinAlignment.
+    Only the cells within a band of the diagonal are computed; any alignment with
+    d edits is within d of the diagonal, so a band is widened until the distance
+    fits in it, which is at once for similar sequences. """
+    # The backtrace matches the common suffix first in any case:
+    suffix = 0
+    while suffix < min(len(ref), len(hyp)) and ref[-1-suffix] == hyp[-1-suffix]:
+        suffix += 1
+    n, m = len(ref) - suffix, len(hyp) - suffix
+    band = max(abs(n - m), 8)
+    while True:
+        rows = bandedEditDistances(ref[:n], hyp[:m], band)
+        distance = rows[n][1][m-rows[n][0]]
+        if distance <= band or band >= max(n, m):
+            break
+        band *= 2
+    over = band + 1
+    def cost(i, j):
+        lo, row = rows[i]
+        return row[j-lo] if lo <= j < lo + len(row) else over
+    alignment = [(ref[k], hyp[k - len(ref) + len(hyp)]) for k in range(len(ref) - 1, n - 1, -1)]
+    i, j = n, m
+    while i > 0 or j > 0:
+        if j == 0:
+            alignment.append((ref[i-1], eps))
+            i -= 1
+        elif i == 0:
+            alignment.append((eps, hyp[j-1]))
+            j -= 1
+        elif cost(i-1, j-1) + (ref[i-1] != hyp[j-1]) == cost(i, j):
+            alignment.append((ref[i-1], hyp[j-1]))
+            i -= 1
+            j -= 1
+        elif cost(i-1, j) + 1 == cost(i, j):
+            alignment.append((ref[i-1], eps))
+            i -= 1
+        else:
+            alignment.append((eps, hyp[j-1]))
+            j -= 1
+    alignment.reverse()
+    return alignment, distance
+
+def readTexts(filepath, attach_labels=False):
+    """ Reads a Kaldi style text file into a dict of uttid to tokens """
+    texts = {}
+    with open(filepath, encoding="utf-8") as fi:
+        for line in fi:
+            linesplit = line.split()
+            if linesplit:
+                texts[linesplit[0]] = attachLabels(linesplit[1:]) if attach_labels else linesplit[1:]
+    return texts
+
+def formatAlignment(uttid, alignment):
+    return " ".join([uttid] + [" ; ".join(ref + " " + hyp for ref, hyp in alignment)]) if alignment else uttid
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="""
+        Aligns the texts in ref-text and hyp-text with the same uttid, in the order
+        of hyp-text, like Kaldi's align-text, e.g. to score with compute_far_frr.py""")
+    parser.add_argument("--special-symbol", default="<eps>", help=
+            "The symbol for the missing side of insertions and deletions")
+    parser.add_argument("--attach-labels", action="store_true", help=
+            "Join the key labels with the next word first, e.g. [CORRECT] the -> [CORRECT]the")
+    parser.add_argument("ref_text")
+    parser.add_argument("hyp_text")
+    args = parser.parse_args()
+    refs = readTexts(args.ref_text, args.attach_labels)
+    num_missing = 0
+    with open(args.hyp_text, encoding="utf-8") as fi:
+        for line in fi:
+            linesplit = line.split()
+            if not linesplit:
+                continue
+            uttid = linesplit[0]
+            if uttid not in refs:
+                num_missing += 1
+                continue
+            hyp = attachLabels(linesplit[1:]) if args.attach_labels else linesplit[1:]
+            alignment, _ = levenshteinAlignment(refs[uttid], hyp, args.special_symbol)
+            print(formatAlignment(uttid, alignment))
+    if num_missing:
+        print("No reference text for", num_missing, "utterances", file=sys.stderr)
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+# Annotates the miscues of a whole hypothesis text in one process.
+# Does what make_annotation_fsts.sh and annotate_miscues.sh do together, without
+# fstcompile/fstcompose/fstproject/fstprint: for each utterance, the annotation
+# transducer of its prompt (see make_miscue_annotation_transducer.py) is built in
+# memory, and the best (Viterbi) path that reads the hypothesis words gives the key,
+# e.g. [CORRECT] the [SKIP] cat [CORRECT] sat
+# The transducers of recent prompts are kept, so repeated prompts are built once.
+import collections
+import heapq
+import itertools
+import math
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import prompt_lmfst
+import make_miscue_annotation_transducer as annotation
+
+def readText(filepath):
+    """ Reads a Kaldi style text file, returns a list of (uttid, words) in the file order """
+    texts = []
+    with open(filepath, encoding="utf-8") as fi:
+        for line in fi:
+            linesplit = line.strip().split()
+            if linesplit:
+                texts.append((linesplit[0], linesplit[1:]))
+    return texts
+
+class AnnotationGraph(object):
+    ## The annotation transducer of one prompt, prepared for the search.
+    ## The chains of states that only have one epsilon input arc (e.g. the state
+    ## after [CORRECT] which outputs the word) are folded into the arc that leads
+    ## to them, so each arc outputs a tuple of labels. What is left are the word
+    ## boundary states, with the arcs of each indexed by input label.
+    def __init__(self, start, arcs, epsilon_arcs, finals):
+        self.start = start
+        self.arcs = arcs #state -> {in_label: [(to_state, out_labels, weight)]}
+        self.epsilon_arcs = epsilon_arcs #state -> [(to_state, out_labels, weight)]
+        self.finals = finals #state -> weight
+
+    @classmethod
+    def fromFST(cls, fst, epsilon):
+        """ From any normalised PromptLMFST, e.g. from buildAnnotationFST """
+        def chainArc(state):
+            leaves = fst.states[state]
+            if state != start and len(leaves) == 1 and isinstance(leaves[0], prompt_lmfst.Arc) \
+                    and leaves[0].in_label == epsilon:
+                return leaves[0]
+            return None
+        start = fst.words[0].start
+        arcs, epsilon_arcs, finals = {}, {}, {}
+        for state, leaves in fst.states.items():
+            if chainArc(state) is not None:
+                continue
+            for leaf in leaves:
+                if isinstance(leaf, prompt_lmfst.FinalState):
+                    finals[state] = min(leaf.weight, finals.get(state, leaf.weight))
+                    continue
+                out_labels = [leaf.out_label]
+                weight = leaf.weight
+                to_state = leaf.to_state
+                followed = set()
+                while chainArc(to_state) is not None and to_state not in followed:
+                    followed.add(to_state)
+                    chain_arc = chainArc(to_state)
+                    out_labels.append(chain_arc.out_label)
+                    weight += chain_arc.weight
+                    to_state = chain_arc.to_state
+                arc = (to_state, tuple(label for label in out_labels if label != epsilon), weight)
+                if leaf.in_label == epsilon:
+                    epsilon_arcs.setdefault(state, []).append(arc)
+                else:
+                    arcs.setdefault(state, {}).setdefault(leaf.in_label, []).append(arc)
+        return cls(start, arcs, epsilon_arcs, finals)
+
+    @classmethod
+    def build(cls, prompt_tokenised, homophones, truncations=None, special_labels=annotation.special_labels):
+        """ Builds the same graph as fromFST(buildAnnotationFST(...)), straight from the
+        recipes of make_miscue_annotation_transducer.py, in the same order, so that the
+        same homophone arcs are left out. State i is the start of word i, and state N
+        the end of the last word. This is many times faster than building the FST. """
+        words = prompt_tokenised
+        N = len(words)
+        labels = special_labels
+        leaves = [[] for _ in range(N + 1)] #(in_label, to_state, out_labels, relative weight), None for final
+        classes = [set() for _ in range(N + 1)]
+        class_ids = {label: homophones.classID(label) for label in set(words) | {labels["Rubbish"]}}
+        def addArc(state, in_label, to_state, out_labels, weight):
+            # Like PromptLMFST.addArc, does not add arcs with a homophone of an existing arc
+            class_id = class_ids[in_label] if in_label in class_ids else homophones.classID(in_label)
+            if class_id is not None:
+                if class_id in classes[state]:
+                    return
+                classes[state].add(class_id)
+            leaves[state].append((in_label, to_state, out_labels, weight))
+        #addCorrectPaths:
+        for i, word in enumerate(words):
+            addArc(i, word, i + 1, (labels["Correct"], word), 1.0)
+        leaves[N].append((None, None, None, 1.0))
+        #addRubbishPaths:
+        for i in range(N - 1):
+            addArc(i, labels["Rubbish"], i, (labels["Rubbish"],), 0.5)
+        addArc(N - 1, labels["Rubbish"], N - 1, (labels["Rubbish"],), 0.5)
+        addArc(N, labels["Rubbish"], N, (labels["Rubbish"],), 0.5)
+        #addSkipPaths:
+        for i in range(N - 1):
+            addArc(i, words[i+1], i + 2, (labels["Skip"], words[i], labels["Correct"], words[i+1]), 0.5)
+        #addRepeatPaths:
+        for i in range(N):
+            addArc(i + 1, words[i], i + 1, (labels["Repeat"], words[i]), 0.5)
+        #addPrematureEnds:
+        for i in range(N):
+            leaves[i].append((None, None, None, 1.0))
+        #addJumpsBackward:
+        for i in range(N):
+            for n in range(1, i):
+                addArc(i, words[i-1-n], i - n, (labels["Jump"], words[i-1-n]), 0.5)
+        for n in range(N - 1):
+            addArc(N, words[N-2-n], N - 1 - n, (labels["Jump"], words[N-2-n]), 0.5)
+        #addJumpsForward:
+        for i in range(N):
+            for n in range(1, N - i):
+                addArc(i, words[i+n], i + n + 1, (labels["Jump"], words[i+n]), 0.5)
+        #addTruncations:
+        if truncations is not None:
+            for i, word in enumerate(words):
+                truncation_entry = labels["Truncation"] + word
+                if truncation_entry in truncations:
+                    addArc(i, truncation_entry, i, (truncation_entry,), 1.0)
+        #convertRelativeProbs:
+        arcs, finals = {}, {}
+        for state, state_leaves in enumerate(leaves):
+            total_weight = sum(leaf[3] for leaf in state_leaves)
+            for in_label, to_state, out_labels, weight in state_leaves:
+                weight = -math.log(weight / total_weight)
+                if in_label is None:
+                    finals[state] = min(weight, finals.get(state, weight))
+                else:
+                    arcs.setdefault(state, {}).setdefault(in_label, []).append((to_state, out_labels, weight))
+        return cls(0, arcs, {}, finals)
+
+    def bestPath(self, hyp):
+        """ Returns the output labels of the lowest cost path that reads the hypothesis
+        words, or None if there is no such path.
+        Dijkstra over the states of the composition with the hypothesis acceptor, which are
+        (state, number of words read). The weights are negative log probabilities. """
+        start = (self.start, 0)
+        end = None #The super final state
+        costs = {start: 0.}
+        backpointers = {}
+        order = itertools.count() #Equal costs are popped in the order they were found
+        heap = [(0., next(order), start)]
+        while heap:
+            cost, _, node = heapq.heappop(heap)
+            if node is end:
+                break
+            if cost > costs[node]:
+                continue
+            state, position = node
+            successors = [(to_state, position, out_labels, weight)
+                    for to_state, out_labels, weight in self.epsilon_arcs.get(state, ())]
+            if position < len(hyp):
+                successors.extend((to_state, position + 1, out_labels, weight)
+                        for to_state, out_labels, weight in self.arcs.get(state, {}).get(hyp[position], ()))
+            elif state in self.finals:
+                successors.append((end, None, (), self.finals[state]))
+            for to_state, to_position, out_labels, weight in successors:
+                to_node = end if to_state is end else (to_state, to_position)
+                if cost + weight < costs.get(to_node, float("inf")):
+                    costs[to_node] = cost + weight
+                    backpointers[to_node] = (node, out_labels)
+                    heapq.heappush(heap, (cost + weight, next(order), to_node))
+        if end not in backpointers:
+            return None
+        labels = []
+        node = end
+        while node != start:
+            node, out_labels = backpointers[node]
+            labels.extend(reversed(out_labels))
+        return labels[::-1]
+
+class MiscueAnnotator(object):
+    ## Builds the annotation graphs of prompts, keeping the max_size most recently used.
+    def __init__(self, homophones, truncations=None, special_labels=annotation.special_labels, max_size=1000):
+        self.homophones = homophones
+        self.truncations = truncations
+        self.special_labels = special_labels
+        self.max_size = max_size
+        self.graphs = collections.OrderedDict()
+
+    def graph(self, prompt_tokenised):
+        key = tuple(prompt_tokenised)
+        if key in self.graphs:
+            self.graphs.move_to_end(key)
+        else:
+            self.graphs[key] = AnnotationGraph.build(prompt_tokenised, self.homophones, self.truncations,
+                    self.special_labels)
+            if len(self.graphs) > self.max_size:
+                self.graphs.popitem(last=False)
+        return self.graphs[key]
+
+    def annotate(self, prompt_tokenised, hyp_tokenised):
+        return self.graph(prompt_tokenised).bestPath(hyp_tokenised)
+
+def annotationJobs(prompts, hyps):
+    """ Yields (uttid, prompt, hyp) for the hypotheses that have words, like annotate_miscues.sh.
+    Hypotheses without a prompt are reported and left out. """
+    for uttid, hyp in hyps:
+        if not hyp:
+            continue
+        if uttid not in prompts:
+            print("No prompt for", uttid, file=sys.stderr)
+            continue
+        yield uttid, prompts[uttid], hyp
+
+# Each worker process has its own annotator
+_worker_annotator = None
+
+def _initWorker(homophones, truncations, special_labels):
+    global _worker_annotator
+    _worker_annotator = MiscueAnnotator(homophones, truncations, special_labels)
+
+def _annotateJob(job):
+    uttid, prompt, hyp = job
+    return uttid, _worker_annotator.annotate(prompt, hyp)
+
+def annotateAll(jobs, homophones, truncations=None, special_labels=annotation.special_labels, num_jobs=1):
+    """ Yields (uttid, key labels or None) for each (uttid, prompt, hyp) in order,
+    in num_jobs processes if num_jobs > 1 """
+    if num_jobs > 1:
+        import multiprocessing
+        with multiprocessing.Pool(num_jobs, _initWorker, (homophones, truncations, special_labels)) as pool:
+            for result in pool.imap(_annotateJob, jobs, chunksize=64):
+                yield result
+    else:
+        annotator = MiscueAnnotator(homophones, truncations, special_labels)
+        for uttid, prompt, hyp in jobs:
+            yield uttid, annotator.annotate(prompt, hyp)
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="""
+        Prints the annotation of miscues for each hypothesis, like annotate_miscues.sh,
+        but in one process, without the annotation FSTs.""")
+    parser.add_argument("langdir", help="The lang dir from prepare_extended_lang.sh, "
+            "for the rubbish and truncation labels, homophones.txt and truncations.txt")
+    parser.add_argument("reftext", help="The prompts, a Kaldi style text file")
+    parser.add_argument("hyptext", help="The hypotheses, a Kaldi style text file")
+    parser.add_argument("--jobs", type=int, default=1, help="Number of processes")
+    args = parser.parse_args()
+
+    special_labels = dict(annotation.special_labels)
+    with open(os.path.join(args.langdir, "rubbish"), encoding="utf-8") as fi:
+        special_labels["Rubbish"] = fi.read().strip()
+    with open(os.path.join(args.langdir, "truncation_symbol"), encoding="utf-8") as fi:
+        special_labels["Truncation"] = fi.read().strip()
+    homophones = prompt_lmfst.readHomophones(os.path.join(args.langdir, "homophones.txt"))
+    truncations = annotation.readTruncations(os.path.join(args.langdir, "truncations.txt"))
+    prompts = dict(readText(args.reftext))
+    jobs = annotationJobs(prompts, readText(args.hyptext))
+    num_failed = 0
+    for uttid, labels in annotateAll(jobs, homophones, truncations, special_labels, args.jobs):
+        if labels is None:
+            # Like an empty composition in annotate_miscues.sh
+            print("No path through the annotation FST for", uttid, file=sys.stderr)
+            num_failed += 1
+            labels = []
+        print(" ".join([uttid] + labels))
+    if num_failed:
+        print(num_failed, "hypotheses could not be annotated", file=sys.stderr)
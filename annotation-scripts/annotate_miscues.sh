@@ -18,6 +18,27 @@ hyptext="$2"
 
 wordstxt="$fstdir/words.txt"
 
+#The archive entries, ark_path:offset by uttid. Directories made before
+#the archive have one $uttid.key.fst file for each utterance instead.
+declare -A keyentries
+if [ -f "$fstdir/keys.scp" ]; then
+  while read uttid entry; do
+    keyentries[$uttid]="$entry"
+  done < "$fstdir/keys.scp"
+fi
+
+keyfst() {
+  #Prints the key FST of an utterance.
+  #In the archive, the FST starts after the "\0B" binary marker at the offset;
+  #tail seeks there and OpenFst stops reading at the end of the FST.
+  if [ -f "$fstdir/keys.scp" ]; then
+    local entry="${keyentries[$1]}"
+    tail -c +$(( ${entry##*:} + 3 )) "${entry%:*}"
+  else
+    cat "$fstdir/$1.key.fst"
+  fi
+}
+
 while read hypline; do
   uttid=$(echo "$hypline" | cut -d " " -f 1 )
   if [ "$hypline" = "$uttid" ]; then
@@ -26,10 +47,10 @@ while read hypline; do
   hyp=$(echo "$hypline" | cut -d " " -f 2- )
   echo -n "$uttid " 
   echo "$hyp" |\
-    miscue-tolerant-lm-fst/utt2fst.py |\
+    miscue-tolerant-lm-fst/annotation-scripts/utt2fst.py |\
     fstcompile --isymbols="$wordstxt" --osymbols="$wordstxt" |\
-    fstcompose - "$fstdir/$uttid.key.fst" |\
+    fstcompose - <(keyfst "$uttid") |\
     fstproject --project_output |\
     fstprint --isymbols="$wordstxt" --osymbols="$wordstxt" |\
-    miscue-tolerant-lm-fst/fst2utt.py
+    miscue-tolerant-lm-fst/annotation-scripts/fst2utt.py
 done < "$hyptext"
@@ -1,81 +1,271 @@
-#!/usr/bin/env python2
-from __future__ import division, print_function
-
-
+#!/usr/bin/env python3
+# Computes the miscue detection false acceptance rate and false rejection rate
+# from alignments of annotated references and hypotheses, overall, per miscue
+# label and per bucket of utterances.
+# The alignment files (or the hypotheses, which align_text.py then aligns)
+# are read line by line, in chunks of about --chunk-size bytes,
+# so the memory use does not grow with the files, and the chunks can be
+# scored in parallel (--jobs). The tallies of the chunks are summed.
 import sys
+import os
+import functools
+import json
+import re
 from collections import Counter
-import argparse
-parser = argparse.ArgumentParser(description = """
-This script computes miscue detection false acceptance rate and
-false rejection rate for a decoded output
-The input is an alignment file for annotated miscues, with miscue labels
-attached to the words, from align-text Kaldi tool""")
-parser.add_argument("--verbose", action="store_const", const=True, default=False)
-parser.add_argument("align_file", )
-args = parser.parse_args()
+import align_text
+
 labels = {"correct": "[CORRECT]",
         "jump": "[JUMP]",
         "eps": "<eps>",
         "skip": "[SKIP]"}
 
-with open(args.align_file, "r") as fi:
-    correctcorrect = Counter() 
-    correctmiscue = Counter()
-    missed = Counter()
-    hallucinated = Counter()
-    false_accept = Counter() 
-    false_reject = Counter()
-    wrong_miscue = Counter()
-    alignment = fi.readline().strip().split(";")
-    while alignment[0]:
-        first = alignment.pop(0)
-        uttid, ref, hyp = first.split()
-        alignment.insert(0, " ".join([ref,hyp]))
-        for pos in alignment:
-            ref, hyp = pos.split()
-            if ref == hyp:
-                if ref.startswith(labels["correct"]):
-                    correctcorrect[ref] += 1
-                else:
-                    correctmiscue[ref] += 1
-                if args.verbose:
-                    print("Correct:", ref, hyp)
-            elif ref.startswith(labels["jump"]) and hyp.startswith(labels["correct"]) and ref.split("]")[1] == hyp.split("]")[1]:
-                correctcorrect[ref] += 1
-                if args.verbose:
-                    print("Correct with jump:", ref, hyp)
-            elif hyp.startswith(labels["jump"]) and ref.startswith(labels["correct"]) and ref.split("]")[1] == hyp.split("]")[1]:
-                correctcorrect[ref] += 1
-                if args.verbose:
-                    print("Correct with jump:", ref, hyp)
-            elif hyp == labels["eps"]:
-                if ref.startswith(labels["skip"]):
-                    pass #non-action
-                else:
-                    missed[ref] += 1
-                    if args.verbose:
-                        print("Missed:", ref, hyp)
-            elif ref.startswith(labels["correct"]):
-                false_reject[ref] += 1
-                if args.verbose:
-                    print("False reject:", ref, hyp)
-            elif not hyp.startswith(labels["correct"]):
-                if ref == labels["eps"] and hyp.startswith(labels["skip"]):
-                    pass #non-action
-                elif ref == labels["eps"]:
-                    hallucinated[hyp] += 1 
-                    if args.verbose:
-                        print("Hallucinated:", ref, hyp)
-                else:
-                    wrong_miscue[ref] += 1
-                    if args.verbose:
-                        print("Wrong miscue:", ref, hyp)
-            else:
-                false_accept[ref] += 1
-                if args.verbose:
-                    print("Wrong miscue", ref, hyp)
-        alignment = fi.readline().strip().split(";")
-
-print("False acceptance rate:", (sum(missed.values()) + sum(false_accept.values())) / (sum(correctmiscue.values()) + sum(missed.values()) + sum(false_accept.values()) + sum(wrong_miscue.values())))
-
-print("False rejection rate:", sum(false_reject.values()) / (sum(correctcorrect.values()) + sum(false_reject.values())))
+# The outcomes of aligned (ref, hyp) pairs:
+outcomes = ["correctcorrect", "correctmiscue", "missed", "false_reject",
+        "hallucinated", "wrong_miscue", "false_accept"]
+
+# The bucket of the utterances that are missing from utt2bucket
+UNBUCKETED = "<unbucketed>"
+
+def parseAlignment(line):
+    """ Parses a line of align-text output, e.g.
+    utt1 [CORRECT]the [CORRECT]the ; [SKIP]cat <eps> ; ...
+    returns the uttid and a list of (ref, hyp) """
+    tokens = line.split()
+    # uttid ref hyp ; ref hyp ; ... ref hyp
+    if len(tokens) % 3 != 0 or any(separator != ";" for separator in tokens[3::3]):
+        raise ValueError("Bad alignment line: " + line)
+    return tokens[0], list(zip(tokens[1::3], tokens[2::3]))
+
+def miscueLabel(token):
+    # e.g. [CORRECT] for [CORRECT]the; tokens without a label, like <eps>, are their own label
+    if token.startswith("[") and "]" in token:
+        return token[:token.index("]")+1]
+    return token
+
+def classify(ref, hyp):
+    """ Returns the outcome of one aligned pair, or None for a pair that does not count """
+    if ref == hyp:
+        if ref.startswith(labels["correct"]):
+            return "correctcorrect"
+        return "correctmiscue"
+    elif ref.startswith(labels["jump"]) and hyp.startswith(labels["correct"]) and ref.split("]")[1] == hyp.split("]")[1]:
+        return "correctcorrect" #Correct with jump
+    elif hyp.startswith(labels["jump"]) and ref.startswith(labels["correct"]) and ref.split("]")[1] == hyp.split("]")[1]:
+        return "correctcorrect" #Correct with jump
+    elif hyp == labels["eps"]:
+        if ref.startswith(labels["skip"]):
+            return None
+        return "missed"
+    elif ref.startswith(labels["correct"]):
+        return "false_reject"
+    elif not hyp.startswith(labels["correct"]):
+        if ref == labels["eps"] and hyp.startswith(labels["skip"]):
+            return None
+        elif ref == labels["eps"]:
+            return "hallucinated"
+        return "wrong_miscue"
+    return "false_accept"
+
+def lengthBucket(pairs, bucket_size):
+    # The bucket of the reference length, e.g. 1-10 for bucket_size 10
+    length = sum(1 for ref, _ in pairs if ref != labels["eps"])
+    if length == 0:
+        return "0"
+    first = (length - 1) // bucket_size * bucket_size + 1
+    return "%d-%d" % (first, first + bucket_size - 1)
+
+def bucketOrder(bucket):
+    # Sorts the numbers in bucket names by value, so 2-2 comes before 10-10
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", bucket)]
+
+@functools.lru_cache(maxsize=1 << 16)
+def pairOutcome(ref, hyp):
+    """ Returns (label, outcome) of an aligned pair, or None for a pair that does not count.
+    The label is the miscue label of the reference, or of the hypothesis for
+    hallucinated miscues. The same pairs come up again and again, so these are cached. """
+    outcome = classify(ref, hyp)
+    if outcome is None:
+        return None
+    return miscueLabel(hyp if outcome == "hallucinated" else ref), outcome
+
+def scoreAlignment(uttid, pairs, tally, bucket=None, verbose=False):
+    """ Adds the outcomes of the aligned pairs of an utterance to tally,
+    a Counter of (bucket, label, outcome). """
+    scored = [pairOutcome(ref, hyp) for ref, hyp in pairs]
+    tally.update((bucket, label, outcome) for label, outcome in filter(None, scored))
+    if verbose:
+        for (ref, hyp), label_outcome in zip(pairs, scored):
+            if label_outcome is not None:
+                print(uttid, label_outcome[1], ref, hyp)
+
+def fileChunks(filepath, chunk_size):
+    """ Splits a file into byte ranges (filepath, start, end) of about chunk_size """
+    size = os.path.getsize(filepath)
+    return [(filepath, start, min(start + chunk_size, size)) for start in range(0, max(size, 1), chunk_size)]
+
+def chunkLines(chunk):
+    """ Yields the lines that start in the byte range of the chunk """
+    filepath, start, end = chunk
+    with open(filepath, "rb") as fi:
+        if start > 0:
+            # The line that started before the chunk belongs to the previous chunk
+            fi.seek(start - 1)
+            fi.readline()
+        while fi.tell() < end:
+            line = fi.readline()
+            if not line:
+                break
+            yield line.decode("utf-8")
+
+def scoreChunk(chunk, utt2bucket=None, bucket_size=None, verbose=False, refs=None):
+    """ Returns the tally of the alignments in a chunk. With refs, a dict of uttid
+    to the annotated reference tokens, the chunk is of a text of annotated
+    hypotheses instead, and each is aligned with its reference here. """
+    tally = Counter()
+    for line in chunkLines(chunk):
+        if not line.strip():
+            continue
+        if refs is None:
+            uttid, pairs = parseAlignment(line)
+        else:
+            linesplit = line.split()
+            uttid = linesplit[0]
+            if uttid not in refs:
+                print("No reference for", uttid, file=sys.stderr)
+                continue
+            pairs, _ = align_text.levenshteinAlignment(refs[uttid],
+                    align_text.attachLabels(linesplit[1:]), labels["eps"])
+        if utt2bucket is not None:
+            bucket = utt2bucket.get(uttid, UNBUCKETED)
+        elif bucket_size is not None:
+            bucket = lengthBucket(pairs, bucket_size)
+        else:
+            bucket = None
+        scoreAlignment(uttid, pairs, tally, bucket, verbose)
+    return tally
+
+# The worker processes get the maps once, not with each chunk
+_worker_maps = None
+
+def _initWorker(utt2bucket, refs):
+    global _worker_maps
+    _worker_maps = (utt2bucket, refs)
+
+def _scoreChunkJob(job):
+    chunk, bucket_size, verbose = job
+    utt2bucket, refs = _worker_maps
+    return scoreChunk(chunk, utt2bucket, bucket_size, verbose, refs)
+
+def scoreFiles(filepaths, utt2bucket=None, bucket_size=None, verbose=False, jobs=1, chunk_size=64*1024*1024,
+        refs=None):
+    """ Returns the summed tally of all the alignment files (or hypothesis texts,
+    with refs), scored in jobs processes. verbose needs jobs=1, so that the
+    lines of the processes are not mixed up. """
+    if verbose and jobs > 1:
+        raise ValueError("verbose needs jobs=1")
+    chunks = [chunk for filepath in filepaths for chunk in fileChunks(filepath, chunk_size)]
+    tally = Counter()
+    if jobs > 1:
+        import multiprocessing
+        with multiprocessing.Pool(jobs, _initWorker, (utt2bucket, refs)) as pool:
+            job_args = [(chunk, bucket_size, verbose) for chunk in chunks]
+            for chunk_tally in pool.imap_unordered(_scoreChunkJob, job_args):
+                tally.update(chunk_tally)
+    else:
+        for chunk in chunks:
+            tally.update(scoreChunk(chunk, utt2bucket, bucket_size, verbose, refs))
+    return tally
+
+def rates(counts):
+    """ Returns the false acceptance and false rejection rates of a Counter of
+    outcomes, None where nothing was counted """
+    far_total = counts["correctmiscue"] + counts["missed"] + counts["false_accept"] + counts["wrong_miscue"]
+    frr_total = counts["correctcorrect"] + counts["false_reject"]
+    far = (counts["missed"] + counts["false_accept"]) / far_total if far_total else None
+    frr = counts["false_reject"] / frr_total if frr_total else None
+    return far, frr
+
+def summary(tally):
+    """ Sums the tally overall, by label and by bucket,
+    returns a dict with the counts and rates of each """
+    def entry(counts):
+        far, frr = rates(counts)
+        return {"far": far, "frr": frr, "counts": {outcome: counts[outcome] for outcome in outcomes}}
+    overall = Counter()
+    by_label = {}
+    by_bucket = {}
+    for (bucket, label, outcome), count in tally.items():
+        overall[outcome] += count
+        by_label.setdefault(label, Counter())[outcome] += count
+        if bucket is not None:
+            by_bucket.setdefault(bucket, Counter())[outcome] += count
+    result = {"overall": entry(overall),
+            "labels": {label: entry(counts) for label, counts in sorted(by_label.items())}}
+    if by_bucket:
+        result["buckets"] = {bucket: entry(by_bucket[bucket]) for bucket in sorted(by_bucket, key=bucketOrder)}
+    return result
+
+def readUtt2Bucket(filepath):
+    # A Kaldi style map of uttid to bucket, like utt2spk
+    utt2bucket = {}
+    with open(filepath, encoding="utf-8") as fi:
+        for line in fi:
+            linesplit = line.split()
+            if linesplit:
+                utt2bucket[linesplit[0]] = " ".join(linesplit[1:])
+    return utt2bucket
+
+def printSummary(result, fo=sys.stdout):
+    def formatRate(rate):
+        return "n/a" if rate is None else "%.4f" % rate
+    #The overall rates in full, as before the breakdowns were added
+    print("False acceptance rate:", result["overall"]["far"], file=fo)
+    print("False rejection rate:", result["overall"]["frr"], file=fo)
+    for section in ("labels", "buckets"):
+        if section not in result:
+            continue
+        print(file=fo)
+        print("%-20s %8s %8s %s" % (section[:-1].capitalize(), "FAR", "FRR", " ".join(outcomes)), file=fo)
+        for key, entry in result[section].items():
+            print("%-20s %8s %8s %s" % (key, formatRate(entry["far"]), formatRate(entry["frr"]),
+                " ".join(str(entry["counts"][outcome]) for outcome in outcomes)), file=fo)
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description = """
+    This script computes miscue detection false acceptance rate and
+    false rejection rate for a decoded output
+    The input is alignment files for annotated miscues, with miscue labels
+    attached to the words, from align-text Kaldi tool or align_text.py.
+    Or with --ref-text, the input is texts of annotated hypotheses, which are
+    aligned with the annotated references here.
+    The rates are also given for each miscue label, and each bucket of utterances.""")
+    parser.add_argument("--verbose", action="store_const", const=True, default=False,
+            help="Print the outcome of each aligned pair")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    parser.add_argument("--utt2bucket", help="""Kaldi style map of uttid to a bucket,
+            e.g. the speaker or the book, to also give the rates for each bucket.
+            Utterances that are not in the map are in the bucket """ + UNBUCKETED)
+    parser.add_argument("--length-bucket-size", type=int, help="""Give the rates for buckets
+            of the reference length, e.g. 10 for 1-10, 11-20, ... annotated words""")
+    parser.add_argument("--jobs", type=int, default=1, help="Number of processes")
+    parser.add_argument("--chunk-size", type=int, default=64, help="""Size of the chunks
+            of the files that are scored at a time, in MB""")
+    parser.add_argument("--ref-text", help="""The annotated references, e.g. from annotate_miscues.py,
+            to align the annotated hypotheses in the input files with, without align-text""")
+    parser.add_argument("align_files", nargs="+", help="""Alignment files, e.g. shards of one alignment,
+            or with --ref-text, the annotated hypotheses""")
+    args = parser.parse_args()
+    if args.utt2bucket and args.length_bucket_size:
+        parser.error("Give only one of --utt2bucket and --length-bucket-size")
+    if args.verbose and args.jobs > 1:
+        parser.error("--verbose needs --jobs 1")
+    utt2bucket = readUtt2Bucket(args.utt2bucket) if args.utt2bucket else None
+    refs = align_text.readTexts(args.ref_text, attach_labels=True) if args.ref_text else None
+    tally = scoreFiles(args.align_files, utt2bucket, args.length_bucket_size, args.verbose,
+            args.jobs, args.chunk_size * 1024 * 1024, refs)
+    result = summary(tally)
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        printSummary(result)
@@ -2,6 +2,8 @@
 
 #Takes a reference text indexed by uttid
 #And creates a directory of FSTs which can be used to annotate miscues.
+#The FSTs are built in one process, into the Kaldi archive keys.ark,
+#with the offset of each uttid's FST in keys.scp
 
 set -euo pipefail
 
@@ -23,13 +25,7 @@ cat miscue-tolerant-lm-fst/kaldi-scripts/eps.txt\
   miscue-tolerant-lm-fst/kaldi-scripts/extra_special_labels.txt |\
   awk '{print $1 " " NR-1}' > "$wordstxt"
 
-while read promptline; do
-  uttid=$(echo "$promptline" | cut -d " " -f 1 )
-  prompt=$(echo "$promptline" | cut -d " " -f 2- )
-  keyfst="$fstdir/$uttid.key.fst"
-  echo "$prompt" |\
-    miscue-tolerant-lm-fst/make_miscue_annotation_transducer.py \
-    --rubbish-label $(cat "$langdir/rubbish") --truncation-label $(cat "$langdir/truncation_symbol") \
-    --homophones "$langdir/homophones.txt" --truncations "$langdir/truncations.txt" |\
-    fstcompile --isymbols="$wordstxt" --osymbols="$wordstxt" > "$keyfst"
-done < "$reftext"
+miscue-tolerant-lm-fst/annotation-scripts/make_miscue_annotation_transducer.py \
+  --rubbish-label $(cat "$langdir/rubbish") --truncation-label $(cat "$langdir/truncation_symbol") \
+  --homophones "$langdir/homophones.txt" --truncations "$langdir/truncations.txt" \
+  --words-table "$wordstxt" --ark "$fstdir/keys.ark" --scp "$fstdir/keys.scp" < "$reftext"
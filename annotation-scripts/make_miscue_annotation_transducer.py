@@ -1,9 +1,11 @@
-#!/usr/bin/env python2
+#!/usr/bin/env python3
 from __future__ import print_function
-import prompt_lmfst
 import argparse
+import os
 import sys
 import math
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import prompt_lmfst
 
 parser = argparse.ArgumentParser(description="""
         This script creates a transducer which can be composed with a text acceptor,
@@ -155,7 +157,7 @@ def convertRelativeProbs(p_fst):
     # probabilities, then converts to negative logarithms.
     for state_num, leaves in p_fst.states.items():
         #leaves has Arcs and FinalStates, both of which have a property called weight
-        total_weight = reduce(lambda x, y: x + y.weight, leaves, 0.)
+        total_weight = sum(leaf.weight for leaf in leaves)
         normalised_leaves = []
         for leaf in leaves:
             if total_weight == 0. or leaf.weight == 0.:
@@ -171,6 +173,23 @@ def readTruncations(truncationsfile):
         truncationslist = fi.read().split()
     return set(truncationslist)
 
+def buildAnnotationFST(prompt_tokenised, homophones, truncations=None, weights=weights, special_labels=special_labels):
+    """ Builds the normalised annotation transducer of a prompt.
+    truncations is a set of the truncation entries, or None for no truncation paths """
+    fst = prompt_lmfst.PromptLMFST(homophones)
+    fst.addWordSequence(prompt_tokenised)
+    addCorrectPaths(fst, weights, special_labels)
+    addRubbishPaths(fst, weights, special_labels)
+    addSkipPaths(fst, weights, special_labels)
+    addRepeatPaths(fst, weights, special_labels)
+    addPrematureEnds(fst, weights, special_labels)
+    addJumpsBackward(fst, weights, special_labels)
+    addJumpsForward(fst, weights, special_labels)
+    if truncations is not None:
+        addTruncations(fst, weights, special_labels, truncations)
+    convertRelativeProbs(fst)
+    return fst
+
 if __name__ == "__main__":
     ## Now we just parse arguments and run the functions.
     parser.add_argument('--correct-word-boost', dest="correct_boost", 
@@ -191,7 +210,21 @@ if __name__ == "__main__":
             """The label to use for Rubbish, i.e. spoken noise""")
     parser.add_argument('--truncation-label', dest="truncation_label", nargs="?", help=
             """The label to use for Truncation, concatenated with the word, like [TRUNC]:label""")
+    parser.add_argument('--ark', help=
+            """Batch mode: read Kaldi style prompt lines (uttid followed by the prompt)
+            from the standard input, and write the transducer of each into this Kaldi
+            archive, keyed by the uttid, in the OpenFst binary format. Needs --words-table""")
+    parser.add_argument('--scp', help=
+            """With --ark, also write a Kaldi script file of the archive entries.
+            Utterances of the same prompt share one entry, so look them up by this file""")
+    parser.add_argument('--words-table', dest="words_table", help=
+            """Symbol table to write the labels as integers with, e.g. the words.txt
+            of make_annotation_fsts.sh""")
     args = parser.parse_args()
+    if args.ark and not args.words_table:
+        parser.error("--ark needs --words-table")
+    if args.scp and not args.ark:
+        parser.error("--scp needs --ark")
     if args.rubbish_label is not None:
         special_labels["Rubbish"] = args.rubbish_label
     if args.truncation_label is not None:
@@ -199,22 +232,34 @@ if __name__ == "__main__":
     if args.correct_boost is not None:
         weights["Correct"] = weights["Correct"] * args.correct_boost 
 
-    fst = prompt_lmfst.PromptLMFST(homophones_path=args.homophones)
-    prompt = sys.stdin.readline()
-    prompt_tokenised = prompt.strip().split()
-    if not prompt_tokenised:
-        raise ValueError("Prompt empty!")
-    fst.addWordSequence(prompt_tokenised)
-    addCorrectPaths(fst, weights, special_labels)
-    addRubbishPaths(fst, weights, special_labels)
-    addSkipPaths(fst, weights, special_labels)
-    addRepeatPaths(fst, weights, special_labels)
-    addPrematureEnds(fst, weights, special_labels)
-    addJumpsBackward(fst, weights, special_labels)
-    addJumpsForward(fst, weights, special_labels)
-    if args.truncations is not None:
-        truncated_words = readTruncations(args.truncations)
-        addTruncations(fst, weights, special_labels, truncated_words)
-
-    convertRelativeProbs(fst)
-    print(fst.inText())
+    truncated_words = readTruncations(args.truncations) if args.truncations is not None else None
+    homophones = prompt_lmfst.readHomophones(args.homophones)
+    if args.ark:
+        symbols = prompt_lmfst.SymbolTable(args.words_table)
+        # Many utterances are readings of the same prompt. The FST of a prompt is
+        # written once, and the script file points the other utterances to it.
+        offsets_by_prompt = {}
+        with prompt_lmfst.KaldiFstArchiveWriter(args.ark, args.scp) as archive:
+            for line in sys.stdin:
+                linesplit = line.strip().split()
+                if not linesplit:
+                    continue
+                uttid, prompt_tokenised = linesplit[0], tuple(linesplit[1:])
+                if not prompt_tokenised:
+                    raise ValueError("Prompt empty for " + uttid + "!")
+                if prompt_tokenised in offsets_by_prompt:
+                    archive.writeScpEntry(uttid, offsets_by_prompt[prompt_tokenised])
+                else:
+                    fst = buildAnnotationFST(prompt_tokenised, homophones, truncated_words)
+                    offsets_by_prompt[prompt_tokenised] = archive.write(uttid, fst.inBinary(symbols, symbols))
+    else:
+        prompt = sys.stdin.readline()
+        prompt_tokenised = prompt.strip().split()
+        if not prompt_tokenised:
+            raise ValueError("Prompt empty!")
+        fst = buildAnnotationFST(prompt_tokenised, homophones, truncated_words)
+        if args.words_table:
+            symbols = prompt_lmfst.SymbolTable(args.words_table)
+            print(fst.inText(symbols, symbols))
+        else:
+            print(fst.inText())
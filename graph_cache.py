@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# An on-disk cache of compiled graphs, shared by make_miscue_tolerant_lms.py
+# (the G FSTs) and kaldi-scripts/hclg_cache.py (the HCLGs), see GraphCache.
+
+import hashlib
+import os
+import sys
+import tempfile
+
+# Part of every key. Bump it when the output of a given version of the code
+# changes in a way the hashes of the code files do not show, e.g. a new
+# OpenFst or Kaldi writes the graphs differently.
+FORMAT_VERSION = "2"
+
+def fileHash(filepath):
+    # Returns the SHA-1 of the contents of the file, or None if no file is given.
+    if filepath is None:
+        return None
+    sha1 = hashlib.sha1()
+    with open(filepath, "rb") as fi:
+        for block in iter(lambda: fi.read(1 << 20), b""):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+class GraphCache(object):
+    ## A content addressed on-disk cache of compiled graphs, e.g. the output
+    ## of make_miscue_tolerant_lms.py for one prompt, or an HCLG of one prompt.
+    ## The key of an entry is a hash of everything the graph depends on:
+    ## the prompt, the weights, the labels and the hashes of the input files.
+    ## Entries are files named by the key, so the cache can be shared between
+    ## runs and processes. They are written into a temporary file and renamed,
+    ## so a reader never sees a partial entry.
+    ## Reading an entry updates its mtime, and evict() removes the least recently
+    ## used entries until the total size is at most max_bytes.
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    @staticmethod
+    def key(*parts):
+        # The parts are anything with a stable repr, e.g. strings, numbers,
+        # and sorted lists of tuples of those.
+        return hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def tmpPath(self, key):
+        # A path in the cache directory to write an entry to, before store() moves it into place.
+        tmpdir = os.path.join(self.cache_dir, "tmp")
+        os.makedirs(tmpdir, exist_ok=True)
+        fd, path = tempfile.mkstemp(prefix=key + ".", dir=tmpdir)
+        os.close(fd)
+        return path
+
+    def lookup(self, key):
+        # Returns the path of the entry if it is in the cache, else None.
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return path
+
+    def get(self, key):
+        # Returns the contents of the entry as bytes, or None on a miss.
+        path = self.lookup(key)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as fi:
+                return fi.read()
+        except FileNotFoundError:
+            #Evicted by another process in between
+            self.hits -= 1
+            self.misses += 1
+            return None
+
+    def put(self, key, data):
+        tmp_path = self.tmpPath(key)
+        with open(tmp_path, "wb") as fo:
+            fo.write(data)
+        self.store(key, tmp_path)
+
+    def store(self, key, tmp_path):
+        # Moves a file written into tmpPath(key) into the cache.
+        os.makedirs(os.path.dirname(self.path(key)), exist_ok=True)
+        os.replace(tmp_path, self.path(key))
+
+    def evict(self):
+        # Removes the least recently used entries until the cache fits in max_bytes.
+        entries = []
+        for dirpath, dirnames, filenames in os.walk(self.cache_dir):
+            if os.path.basename(dirpath) == "tmp":
+                continue
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
+            self.evicted += 1
+
+    def report(self, name="Graph cache", fileobj=sys.stderr):
+        print(name + ":", self.hits, "hits,", self.misses, "misses,",
+                self.evicted, "evicted", file=fileobj)
@@ -22,18 +22,12 @@ modeldir=$2
 promptstbl=$3
 out=$4
 
-#The while loop makes a text format G FST 
-#for each utterance in $textfile, then and echoes that:
-cat "$promptstbl" | while read promptline; do
-  promptid=$(echo "$promptline" | awk '{print $1}' )
-  prompt=$(echo "$promptline" | cut -f 2- -d " " )
-  echo "$promptid" #Header
-  echo "$prompt"  | miscue-tolerant-lm-fst/make_one_miscue_tolerant_lm.py \
-    $lm_opts |\
-    utils/eps2disambig.pl |\
-    utils/sym2int.pl -f 3-4 "$langdir"/words.txt >&1
-  echo #empty line as separator
-done |\
+#Makes an integer labelled text format G FST 
+#for each prompt in $promptstbl, with the prompt id as the header:
+miscue-tolerant-lm-fst/make_miscue_tolerant_lms.py \
+  $lm_opts --kaldi-style \
+  --words-table "$langdir"/words.txt --eps-to-disambig \
+  "$promptstbl" |\
   compile-train-graphs-fsts $scale_opts --read-disambig-syms="$langdir"/phones/disambig.int \
     "$modeldir"/tree $modeldir/final.mdl "$langdir"/L_disambig.fst ark:- \
     $out
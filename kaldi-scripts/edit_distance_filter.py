@@ -33,6 +33,89 @@ def levenshtein(s1, s2):
     previous_row = current_row
   return previous_row[-1]
 
+def boundedLevenshtein(s1, s2, max_distance):
+  # The same distance as levenshtein(s1, s2) if it is at most max_distance,
+  # otherwise just max_distance + 1, which is all the filter needs to know.
+  # After skipping the common prefix and suffix, only the diagonal band of cells
+  # within max_distance of the main diagonal is computed (Ukkonen's cutoff), and
+  # it stops as soon as a whole row of the band is over max_distance. O(n*k) time.
+  if len(s1) < len(s2):
+    s1, s2 = s2, s1
+  start = 0
+  while start < len(s2) and s1[start] == s2[start]:
+    start += 1
+  end1, end2 = len(s1), len(s2)
+  while end2 > start and s1[end1-1] == s2[end2-1]:
+    end1 -= 1
+    end2 -= 1
+  n, m = end1 - start, end2 - start
+  k = max_distance
+  if n - m > k:
+    return k + 1
+  if m == 0:
+    return n
+  s1, s2 = s1[start:end1], s2[start:end2]
+  # Band cell d of row i is the cell (i, j) with j = i + d - k.
+  # Cells outside the matrix or over k are capped at k + 1.
+  width = 2 * k + 1
+  previous_band = [d - k if k <= d <= k + m else k + 1 for d in range(width)]
+  for i in range(1, n + 1):
+    c1 = s1[i-1]
+    current_band = [k + 1] * width
+    for d in range(max(0, k - i), min(width, m - i + k + 1)):
+      j = i + d - k
+      if j == 0:
+        current_band[d] = i
+        continue
+      value = previous_band[d] + (c1 != s2[j-1]) # substitution
+      if d + 1 < width and previous_band[d+1] + 1 < value: # deletion
+        value = previous_band[d+1] + 1
+      if d > 0 and current_band[d-1] + 1 < value: # insertion
+        value = current_band[d-1] + 1
+      current_band[d] = min(value, k + 1)
+    if min(current_band) > k:
+      return k + 1
+    previous_band = current_band
+  return previous_band[m - n + k]
+
+def excludedUttids(line_pairs, max_distance):
+  # Returns the number of line pairs and the uttids to exclude among them, in order
+  excluded = []
+  num_pairs = 0
+  for line_a, line_b in line_pairs:
+    num_pairs += 1
+    uttid_a, *text_a = line_a.strip().split()
+    uttid_b, *text_b = line_b.strip().split()
+    if uttid_a != uttid_b:
+      raise ValueError("Utterances did not match exactly! Found out at: "+uttid_a+" != "+uttid_b)
+    if boundedLevenshtein(text_a, text_b, max_distance) > max_distance:
+      excluded.append(uttid_a)
+  return num_pairs, excluded
+
+def chunked(iterable, chunk_size):
+  chunk = []
+  for item in iterable:
+    chunk.append(item)
+    if len(chunk) == chunk_size:
+      yield chunk
+      chunk = []
+  if chunk:
+    yield chunk
+
+def parallelExcludedUttids(line_pairs, max_distance, jobs, chunk_size=10000):
+  # Like excludedUttids, in jobs processes, yields the results chunk by chunk in order.
+  # At most 2*jobs chunks are in flight, so the texts are not all read into memory.
+  import collections
+  import multiprocessing
+  with multiprocessing.Pool(jobs) as pool:
+    pending = collections.deque()
+    for chunk in chunked(line_pairs, chunk_size):
+      pending.append(pool.apply_async(excludedUttids, (chunk, max_distance)))
+      if len(pending) >= 2 * jobs:
+        yield pending.popleft().get()
+    while pending:
+      yield pending.popleft().get()
+
 if __name__ == "__main__":
   import argparse
   import pathlib
@@ -46,17 +129,18 @@ if __name__ == "__main__":
     You can use utils/filter_scp.pl to filter any missing lines.""")
   parser.add_argument("texts", metavar="TEXT", nargs=2, type=pathlib.Path)
   parser.add_argument("--max-distance", default = 1, type=int)
+  parser.add_argument("--jobs", default = 1, type=int, help = "Number of processes, for very large texts")
   args = parser.parse_args()
   total_utterances = 0
   total_excluded = 0
   with open(args.texts[0]) as fa, open(args.texts[1]) as fb:
-    for line_a, line_b in zip(fa, fb):
-      total_utterances +=1
-      uttid_a, *text_a = line_a.strip().split()
-      uttid_b, *text_b = line_b.strip().split()
-      if uttid_a != uttid_b:
-        raise ValueError("Utterances did not match exactly! Found out at: "+uttid_a+" != "+uttid_b)
-      if levenshtein(text_a, text_b) > args.max_distance:
-        print(uttid_a)
-        total_excluded+=1
+    if args.jobs > 1:
+      results = parallelExcludedUttids(zip(fa, fb), args.max_distance, args.jobs)
+    else:
+      results = (excludedUttids(chunk, args.max_distance) for chunk in chunked(zip(fa, fb), 10000))
+    for num_pairs, excluded in results:
+      total_utterances += num_pairs
+      for uttid in excluded:
+        print(uttid)
+      total_excluded += len(excluded)
   print("Excluded", total_excluded, "uttids out of", total_utterances, "based on edit distance.", file=sys.stderr)
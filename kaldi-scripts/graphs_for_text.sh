@@ -17,6 +17,8 @@ cmd=run.pl
 scale_opts="--transition-scale=1.0 --self-loop-scale=0.1"
 correct_boost=1.0
 cleanup=true
+graph_cache=
+graph_cache_size=10240
 
 . ./path.sh
 . parse_options.sh || exit 1;
@@ -27,6 +29,9 @@ if [ "$#" -ne 4 ]; then
   echo "--scale_opts <scale-opts>           Scale options to pass to kaldi. default:"
   echo "                            --transition-scale=1.0 --self-loop-scale=0.1"
   echo "--correct_boost <float>                Multiply the probability of the correct words by float, default 1.0 (no boost)"
+  echo "--graph_cache <dir>                 Keep the per-prompt graphs in this directory between runs,"
+  echo "                            and only compile the prompts that are not there yet. default: no cache"
+  echo "--graph_cache_size <megabytes>      Maximum size of the graph cache, default 10240"
   exit 1
 fi
 
@@ -42,15 +47,30 @@ for f in $required; do
 done
 
 if [ $stage -le 1 ]; then
-  #Map uttids to unique prompts:
-  utils/split_data.sh $datadir $nj
-  $cmd JOB=1:$nj $outdir/log/get_prompt_ids.JOB.log \
-    miscue-tolerant-lm-fst/kaldi-scripts/map_utts_to_prompts.sh \
-    $datadir/split$nj/JOB/text \
-    $outdir/log/utt2promptcrc.JOB \
-    $outdir/log/prompts.JOB.scp
-  cat $outdir/log/utt2promptcrc.* > $outdir/utt2promptcrc
-  cat $outdir/log/prompts.*.scp | sort -u > $outdir/prompts.scp
+  #Map uttids to unique prompts, and split the unique prompts into $nj
+  #shards of about equal compile cost:
+  if [ -z "$graph_cache" ]; then
+    miscue-tolerant-lm-fst/kaldi-scripts/map_utts_to_prompts.py \
+      --nj $nj --shard-pattern $outdir/log/prompts.JOB.scp \
+      $datadir/text $outdir/utt2promptcrc $outdir/prompts.scp
+  else
+    #Only the prompts that are not in the cache are sharded and compiled:
+    miscue-tolerant-lm-fst/kaldi-scripts/map_utts_to_prompts.py \
+      $datadir/text $outdir/utt2promptcrc $outdir/prompts.scp
+    miscue-tolerant-lm-fst/kaldi-scripts/hclg_cache.py \
+      --cache-dir "$graph_cache" --cache-size $graph_cache_size lookup \
+      --key-file miscue-tolerant-lm-fst/make_miscue_tolerant_lms.py \
+      --key-file miscue-tolerant-lm-fst/prompt_lmfst.py \
+      --key-file miscue-tolerant-lm-fst/graph_cache.py \
+      --key-file $langdir/rubbish --key-file $langdir/truncation_symbol \
+      --key-file $langdir/truncations.txt --key-file $langdir/homophones.txt \
+      --key-file $langdir/words.txt --key-file $langdir/L_disambig.fst \
+      --key-file $langdir/phones/disambig.int \
+      --key-file $modeldir/tree --key-file $modeldir/final.mdl \
+      --key-string "$scale_opts" \
+      --nj $nj --shard-pattern $outdir/log/prompts.JOB.scp \
+      $outdir/prompts.scp $outdir/log/HCLG.cached.scp $outdir/log/HCLG.to_cache.scp
+  fi
 fi
 
 if [ $stage -le 2 ]; then
@@ -62,14 +82,25 @@ if [ $stage -le 2 ]; then
       --truncation-label $langdir/truncation_symbol \
       --truncations $langdir/truncations.txt \
       --homophones $langdir/homophones.txt \
+      --words-table "$langdir"/words.txt \
+      --eps-to-disambig \
       $outdir/log/prompts.JOB.scp \|\
-    utils/eps2disambig.pl \|\
-    utils/sym2int.pl -f 3-4 "$langdir"/words.txt \|\
     compile-train-graphs-fsts $scale_opts \
       --read-disambig-syms="$langdir"/phones/disambig.int \
       "$modeldir"/tree $modeldir/final.mdl "$langdir"/L_disambig.fst ark:- \
       ark,scp:$outdir/HCLG.JOB.fsts,$outdir/log/HCLG.JOB.fsts.per_prompt.scp
   cat $outdir/log/HCLG.*.fsts.per_prompt.scp > $outdir/HCLG.fsts.per_prompt.scp
+  if [ -n "$graph_cache" ]; then
+    #Copy the new graphs to where the cache takes them from, and the cached
+    #ones to the output before storing, since storing evicts entries:
+    fstcopy scp:$outdir/HCLG.fsts.per_prompt.scp scp:$outdir/log/HCLG.to_cache.scp
+    fstcopy scp:$outdir/log/HCLG.cached.scp \
+      ark,scp:$outdir/HCLG.cached.fsts,$outdir/log/HCLG_cached.fsts.per_prompt.scp
+    cat $outdir/log/HCLG_cached.fsts.per_prompt.scp >> $outdir/HCLG.fsts.per_prompt.scp
+    miscue-tolerant-lm-fst/kaldi-scripts/hclg_cache.py \
+      --cache-dir "$graph_cache" --cache-size $graph_cache_size store \
+      $outdir/log/HCLG.to_cache.scp
+  fi
 fi
 
 if [ $stage -le 3 ]; then
@@ -82,7 +113,7 @@ if [ $stage -le 3 ]; then
    grep pdfs | awk '{print $NF}' > "$outdir/num_pdfs"
 
   if [ $cleanup = true ]; then
-    rm $outdir/log/utt2promptcrc.* $outdir/log/prompts.*.scp \
+    rm $outdir/log/prompts.*.scp \
       $outdir/utt2promptcrc $outdir/prompts.scp
   fi
 fi
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# Keeps a persistent cache of per-prompt HCLG graphs between graphs_for_text.sh runs.
+# The cache entries are keyed by the prompt and the hashes of every file the graph
+# depends on (the lang and model files, and the code that writes the G graphs),
+# the scale options and graph_cache.FORMAT_VERSION.
+# Mostly should be used as a subtask of graphs_for_text.sh:
+#  lookup: splits a prompts table into the cached prompts and the ones to compile,
+#          and shards the latter like map_utts_to_prompts.py
+#  store:  moves newly compiled graphs (written by Kaldi to the paths given by lookup)
+#          into the cache, and removes the least recently used entries.
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import graph_cache
+from map_utts_to_prompts import shardPrompts, reportShards
+
+def promptKeys(fingerprint, prompt_lines):
+    # Returns (promptcrc, cache key) for each line <promptcrc> <prompt>
+    for line in prompt_lines:
+        promptcrc, prompt = line.split(" ", 1)
+        yield promptcrc, graph_cache.GraphCache.key(fingerprint, prompt.split())
+
+def lookup(cache, fingerprint, prompt_lines):
+    """ Returns the lines <promptcrc> <cached-graph-path> of the cached prompts,
+    the prompt table lines of the rest, and <promptcrc> <path-to-write-graph-to>
+    for the rest """
+    cached, to_compile, to_cache = [], [], []
+    for line, (promptcrc, key) in zip(prompt_lines, promptKeys(fingerprint, prompt_lines)):
+        path = cache.lookup(key)
+        if path is not None:
+            cached.append(promptcrc + " " + path)
+        else:
+            to_compile.append(line)
+            to_cache.append(promptcrc + " " + cache.tmpPath(key))
+    return cached, to_compile, to_cache
+
+def store(cache, to_cache_lines):
+    """ Moves the graphs written into the paths given by lookup into the cache.
+    Returns the number of graphs stored. """
+    num_stored = 0
+    for line in to_cache_lines:
+        promptcrc, tmp_path = line.split(" ", 1)
+        key = os.path.basename(tmp_path).split(".")[0]
+        if os.path.getsize(tmp_path) == 0:
+            #Never written, e.g. the compilation failed:
+            os.remove(tmp_path)
+            continue
+        cache.store(key, tmp_path)
+        num_stored += 1
+    return num_stored
+
+def readLines(filepath):
+    with open(filepath, encoding="utf-8") as fi:
+        return [line.rstrip("\n") for line in fi if line.strip()]
+
+def writeLines(filepath, lines):
+    with open(filepath, "w", encoding="utf-8") as fo:
+        fo.write("".join(line + "\n" for line in lines))
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="""
+        Persistent cache of per-prompt HCLG graphs, see the top of this file.""")
+    parser.add_argument("--cache-dir", required=True)
+    parser.add_argument("--cache-size", type=float, default=10240., help=
+        """Maximum size of the cache in megabytes, default 10240""")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+    lookup_parser = subparsers.add_parser("lookup")
+    lookup_parser.add_argument("--key-file", action="append", default=[], help=
+        """A file the graphs depend on, e.g. lang/L_disambig.fst. Can be given many times.""")
+    lookup_parser.add_argument("--key-string", default="", help=
+        """Options the graphs depend on, e.g. the scale options""")
+    lookup_parser.add_argument("--nj", type=int, default=1, help=
+        """Number of shards to split the prompts to compile into""")
+    lookup_parser.add_argument("--shard-pattern", required=True, help=
+        """Where to write the shards of the prompts to compile, JOB is replaced by
+        the shard number, e.g. exp/graphs/log/prompts.JOB.scp""")
+    lookup_parser.add_argument("promptstbl", metavar="prompts-table")
+    lookup_parser.add_argument("cached", help=
+        """Output: lines <promptcrc> <path-to-cached-graph>""")
+    lookup_parser.add_argument("to_cache", metavar="to-cache", help=
+        """Output: lines <promptcrc> <path>, a Kaldi scp wspecifier to write the new graphs with""")
+    store_parser = subparsers.add_parser("store")
+    store_parser.add_argument("to_cache", metavar="to-cache", help=
+        """The to-cache output of lookup, after the graphs have been written""")
+    args = parser.parse_args()
+
+    cache = graph_cache.GraphCache(args.cache_dir, int(args.cache_size * 1024 * 1024))
+    if args.command == "lookup":
+        if "JOB" not in args.shard_pattern:
+            parser.error("--shard-pattern must contain JOB")
+        fingerprint = graph_cache.GraphCache.key(graph_cache.FORMAT_VERSION,
+                sorted((os.path.basename(f), graph_cache.fileHash(f)) for f in args.key_file),
+                args.key_string)
+        cached, to_compile, to_cache = lookup(cache, fingerprint, readLines(args.promptstbl))
+        writeLines(args.cached, cached)
+        writeLines(args.to_cache, to_cache)
+        shards, total_costs = shardPrompts(to_compile, args.nj)
+        for job, shard in enumerate(shards, start=1):
+            writeLines(args.shard_pattern.replace("JOB", str(job)), shard)
+        reportShards(total_costs)
+        cache.report("HCLG cache")
+    else:
+        num_stored = store(cache, readLines(args.to_cache))
+        cache.evict()
+        print("Stored", num_stored, "graphs in the HCLG cache,", cache.evicted, "evicted", file=sys.stderr)
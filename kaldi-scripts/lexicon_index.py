@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+# A precompiled binary index of a Kaldi lexicon(p).txt, so that the lexicon scripts
+# do not need to parse the whole lexicon on every run.
+# The index is built once per dict dir, into a hidden file next to the lexicon,
+# and rebuilt when the lexicon changes (checked by size and mtime, then by SHA-1).
+# It is memory-mapped, and words are looked up in a hash table stored in the index,
+# so loading it takes milliseconds regardless of the size of the lexicon.
+# Works with both Python 2 and 3, like the rest of kaldi-scripts.
+from __future__ import print_function
+import hashlib
+import io
+import mmap
+import os
+import struct
+import zlib
+
+ENCODING = "utf8"
+INDEX_MAGIC = b"MTLMLX02"
+# magic, source size, source mtime, source SHA-1, then the section lengths:
+# num_tokens, num_prons, num_words, num_pron_tokens, num_word_prons, num_pron_words,
+# num_buckets, token_blob_len, word_blob_len, pron_blob_len
+HEADER_FORMAT = "<8sQd20s10I"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+INT = struct.Struct("<I")
+PAIR = struct.Struct("<2I")
+
+def wordHash(word_bytes):
+    # zlib.crc32 is signed in Python 2
+    return zlib.crc32(word_bytes) & 0xffffffff
+
+def sourceHash(lexiconfile):
+    sha1 = hashlib.sha1()
+    with open(lexiconfile, "rb") as fi:
+        for block in iter(lambda: fi.read(1 << 20), b""):
+            sha1.update(block)
+    return sha1.digest()
+
+def indexPath(lexiconfile):
+    # e.g. dict/.lexiconp.txt.index, which the dict dir globs (dict/*) do not copy
+    dirname, basename = os.path.split(lexiconfile)
+    return os.path.join(dirname, "." + basename + ".index")
+
+def buildIndex(lexiconfile):
+    """ Parses the lexicon like readLexiconEntries in make_extended_lexicon.py
+    and returns the index as bytes.
+    Sections (all integers uint32, little-endian):
+        token_offsets       (num_tokens+1) offsets into the token blob, the interned phones
+        pron_token_offsets  (num_prons+1) offsets into pron_tokens, for each unique pronunciation
+        pron_tokens         token ids
+        word_offsets        (num_words+1) offsets into the word blob, words sorted by their bytes
+        word_pron_offsets   (num_words+1) offsets into word_prons
+        word_prons          pronunciation ids, in the order of the lexicon file
+        pron_word_offsets   (num_prons+1) offsets into pron_words, the homophone buckets
+        pron_words          word ids
+        word_buckets        (num_buckets) word id + 1 or 0 for empty, an open addressing hash table
+                            of the words with linear probing, num_buckets a power of two
+        pron_text_offsets   (num_prons+1) offsets into the pronunciation blob
+        token blob, word blob, pronunciation blob (the pronunciations as text, for fast lookups)
+    """
+    token_ids = {}
+    pron_ids = {}
+    prons_by_word = {}
+    with io.open(lexiconfile, encoding=ENCODING) as fi:
+        for line in fi:
+            linesplit = line.strip().split()
+            # Some word entries might not have a pronunciation listed, those are left out.
+            if len(linesplit) > 1:
+                pron = tuple(token_ids.setdefault(token, len(token_ids)) for token in linesplit[1:])
+                prons_by_word.setdefault(linesplit[0], []).append(pron_ids.setdefault(pron, len(pron_ids)))
+    tokens = sorted(token_ids, key=token_ids.get)
+    prons = sorted(pron_ids, key=pron_ids.get)
+    words = sorted(prons_by_word, key=lambda word: word.encode(ENCODING))
+    words_by_pron = [[] for _ in prons]
+    for word_id, word in enumerate(words):
+        for pron_id in prons_by_word[word]:
+            if not words_by_pron[pron_id] or words_by_pron[pron_id][-1] != word_id:
+                words_by_pron[pron_id].append(word_id)
+
+    def offsets(lengths):
+        result = [0]
+        for length in lengths:
+            result.append(result[-1] + length)
+        return result
+    def packInts(ints):
+        return struct.pack("<" + str(len(ints)) + "I", *ints)
+    token_bytes = [token.encode(ENCODING) for token in tokens]
+    pron_bytes = [b" ".join(token_bytes[token_id] for token_id in pron) for pron in prons]
+    word_bytes = [word.encode(ENCODING) for word in words]
+    pron_tokens = [token_id for pron in prons for token_id in pron]
+    word_prons = [pron_id for word in words for pron_id in prons_by_word[word]]
+    pron_words = [word_id for word_ids in words_by_pron for word_id in word_ids]
+    num_buckets = 1
+    while num_buckets < 2 * len(words):
+        num_buckets *= 2
+    word_buckets = [0] * num_buckets
+    for word_id, word in enumerate(word_bytes):
+        bucket = wordHash(word) & (num_buckets - 1)
+        while word_buckets[bucket]:
+            bucket = (bucket + 1) & (num_buckets - 1)
+        word_buckets[bucket] = word_id + 1
+    sections = [
+            packInts(offsets(len(token) for token in token_bytes)),
+            packInts(offsets(len(pron) for pron in prons)),
+            packInts(pron_tokens),
+            packInts(offsets(len(word) for word in word_bytes)),
+            packInts(offsets(len(prons_by_word[word]) for word in words)),
+            packInts(word_prons),
+            packInts(offsets(len(word_ids) for word_ids in words_by_pron)),
+            packInts(pron_words),
+            packInts(word_buckets),
+            packInts(offsets(len(pron) for pron in pron_bytes)),
+            b"".join(token_bytes),
+            b"".join(word_bytes),
+            b"".join(pron_bytes),
+    ]
+    stat = os.stat(lexiconfile)
+    header = struct.pack(HEADER_FORMAT, INDEX_MAGIC, stat.st_size, stat.st_mtime, sourceHash(lexiconfile),
+            len(tokens), len(prons), len(words), len(pron_tokens), len(word_prons), len(pron_words),
+            num_buckets, len(sections[-3]), len(sections[-2]), len(sections[-1]))
+    return header + b"".join(sections)
+
+def isValidIndex(header, lexiconfile):
+    """ Checks the header of an index against the lexicon file """
+    if len(header) < HEADER_SIZE:
+        return False
+    magic, size, mtime, sha1 = struct.unpack_from(HEADER_FORMAT, header)[:4]
+    if magic != INDEX_MAGIC:
+        return False
+    stat = os.stat(lexiconfile)
+    if (size, mtime) == (stat.st_size, stat.st_mtime):
+        return True
+    # E.g. copied or touched, but the same contents:
+    return size == stat.st_size and sha1 == sourceHash(lexiconfile)
+
+class LexiconIndex(object):
+    ## Read-only dict-like view of the index: index[word] gives the list of pronunciations
+    ## of the word, like the dict from readLexiconEntries. The buffer is an mmap or bytes.
+    def __init__(self, buf):
+        self.buf = buf
+        (self.num_tokens, self.num_prons, self.num_words, num_pron_tokens, num_word_prons,
+                num_pron_words, self.num_buckets, token_blob_len, word_blob_len,
+                pron_blob_len) = struct.unpack_from(HEADER_FORMAT, buf)[4:]
+        lengths = [self.num_tokens + 1, self.num_prons + 1, num_pron_tokens,
+                self.num_words + 1, self.num_words + 1, num_word_prons,
+                self.num_prons + 1, num_pron_words, self.num_buckets, self.num_prons + 1]
+        self.section_offsets = []
+        offset = HEADER_SIZE
+        for length in lengths:
+            self.section_offsets.append(offset)
+            offset += 4 * length
+        self.token_blob = offset
+        self.word_blob = offset + token_blob_len
+        self.pron_blob = self.word_blob + word_blob_len
+        self.size = self.pron_blob + pron_blob_len
+        self.tokens = {} #Decoded tokens by id, filled on demand
+
+    @classmethod
+    def load(cls, lexiconfile, write=True):
+        """ Opens the index of the lexicon file, building it first if it does not exist
+        or is out of date. If write is True, a new index is saved next to the lexicon,
+        when the directory is writable. """
+        path = indexPath(lexiconfile)
+        try:
+            with open(path, "rb") as fi:
+                buf = mmap.mmap(fi.fileno(), 0, access=mmap.ACCESS_READ)
+            if isValidIndex(buf[:HEADER_SIZE], lexiconfile):
+                index = cls(buf)
+                if index.size == len(buf):
+                    return index
+            buf.close()
+        except (IOError, OSError, ValueError):
+            pass #No index yet (or an empty file)
+        data = buildIndex(lexiconfile)
+        if write:
+            tmp_path = path + "." + str(os.getpid())
+            try:
+                with open(tmp_path, "wb") as fo:
+                    fo.write(data)
+                os.rename(tmp_path, path)
+            except (IOError, OSError):
+                pass #E.g. a read-only dict dir, the index is then just used from memory
+        return cls(data)
+
+    def ints(self, section, start, end):
+        return struct.unpack_from("<" + str(end - start) + "I", self.buf, self.section_offsets[section] + 4 * start)
+
+    def pair(self, section, i):
+        # The ith and the next integer of a section, e.g. the start and end offsets of an item
+        return PAIR.unpack_from(self.buf, self.section_offsets[section] + 4 * i)
+
+    def wordBytes(self, word_id):
+        start, end = self.pair(3, word_id)
+        return self.buf[self.word_blob + start:self.word_blob + end]
+
+    def wordID(self, word):
+        # Probes the hash table, None if not found
+        target = word.encode(ENCODING)
+        mask = self.num_buckets - 1
+        bucket = wordHash(target) & mask
+        while True:
+            word_id = INT.unpack_from(self.buf, self.section_offsets[8] + 4 * bucket)[0] - 1
+            if word_id < 0:
+                return None
+            if self.wordBytes(word_id) == target:
+                return word_id
+            bucket = (bucket + 1) & mask
+
+    def token(self, token_id):
+        if token_id not in self.tokens:
+            start, end = self.pair(0, token_id)
+            self.tokens[token_id] = self.buf[self.token_blob + start:self.token_blob + end].decode(ENCODING)
+        return self.tokens[token_id]
+
+    def pronunciationTokens(self, pron_id):
+        start, end = self.pair(1, pron_id)
+        return [self.token(token_id) for token_id in self.ints(2, start, end)]
+
+    def pronunciation(self, pron_id):
+        start, end = self.pair(9, pron_id)
+        return self.buf[self.pron_blob + start:self.pron_blob + end].decode(ENCODING)
+
+    def pronunciationIDs(self, word):
+        word_id = self.wordID(word)
+        if word_id is None:
+            raise KeyError(word)
+        start, end = self.pair(4, word_id)
+        return self.ints(5, start, end)
+
+    def homophones(self, word):
+        """ All the words in the lexicon that share a pronunciation with the word (itself included) """
+        words = []
+        for pron_id in self.pronunciationIDs(word):
+            start, end = self.pair(6, pron_id)
+            for word_id in self.ints(7, start, end):
+                homophone = self.wordBytes(word_id).decode(ENCODING)
+                if homophone not in words:
+                    words.append(homophone)
+        return words
+
+    def __getitem__(self, word):
+        return [self.pronunciation(pron_id) for pron_id in self.pronunciationIDs(word)]
+
+    def __contains__(self, word):
+        return self.wordID(word) is not None
+
+    def __len__(self):
+        return self.num_words
+
+    def get(self, word, default=None):
+        return self[word] if word in self else default
+
+    def subset(self, words):
+        """ A plain dict of the given words that are in the lexicon, which can then be modified
+        by e.g. addOOVs and addTruncations """
+        lexicon = {}
+        for word in words:
+            try:
+                lexicon[word] = self[word]
+            except KeyError:
+                pass
+        return lexicon
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+    import time
+    parser = argparse.ArgumentParser(description="""
+        Builds (or checks) the binary index of a lexicon, see the top of this file.""")
+    parser.add_argument("lexiconfile", help="e.g. data/local/dict/lexiconp.txt")
+    args = parser.parse_args()
+    start = time.time()
+    index = LexiconIndex.load(args.lexiconfile)
+    print("Index of", len(index), "words,", index.num_prons, "pronunciations and", index.num_tokens,
+            "phones ready in", "%.3f" % (time.time() - start), "s:", indexPath(args.lexiconfile), file=sys.stderr)
@@ -1,21 +1,27 @@
 #!/usr/bin/env python
 from __future__ import print_function
+import io
+import os.path
+import sys
+from lexicon_index import LexiconIndex
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from prompt_lmfst import HomophoneClasses
 
 ENCODING="utf8"
 IMPORTANT_WORDS = set([])
 
 def getHomophones(lexicondict, allwords):
-    """ Returns a list of lists of homophones for a given lexicon """
-    #Indexed by pronunciations, gives all corresponding words, i.e. gives homophones:
-    words_by_pronunciation = {}
+    """ Returns a list of lists of homophones for a given lexicon.
+    Homophony is transitive here: e.g. if read is pronounced both like red and like reed,
+    all three are in the same list. """
+    #Indexed by pronunciations, gives the first corresponding word:
+    word_by_pronunciation = {}
+    #Pairs of homophones, and each word with itself, for the union-find:
+    pairs = []
     for word in allwords:
         for pronunciation in lexicondict[word]:
-            words_by_pronunciation.setdefault(pronunciation,[]).append(word)
-    #The homophones list could also be simply words_by_pronunciation.values()
-    homophones = words_by_pronunciation.values()
-    #But we delete duplicates, e.g.[[lead#1, lead#2], [lead#1, lead#2]]
-    nodup_homophones = [list(tup) for tup in set(tuple(words) for words in homophones)]
-    return nodup_homophones 
+            pairs.append((word_by_pronunciation.setdefault(pronunciation, word), word))
+    return HomophoneClasses(pairs).groups()
 
 def readLexiconEntries(lexiconfile):
     """ Read the lexiconfile as a dict 
@@ -24,8 +30,8 @@ def readLexiconEntries(lexiconfile):
     A probability after the word is also supported, like in lexiconp.txt
     In case of multiple pronunciations, expects multiple entries for the same word. """
     lexicon = {}
-    with open(lexiconfile, "r") as fi:
-        rawline = fi.readline().decode(ENCODING)
+    with io.open(lexiconfile, "r", encoding=ENCODING) as fi:
+        rawline = fi.readline()
         while rawline:
             linesplit = rawline.strip().split()
             word = linesplit[0]
@@ -35,9 +41,23 @@ def readLexiconEntries(lexiconfile):
                 lexicon.setdefault(word,[]).append(pronunciation)
             else: 
                 pass #ie. exclude from lexicon dict: it can then be treated with OOV addition.
-            rawline = fi.readline().decode(ENCODING)
+            rawline = fi.readline()
     return lexicon 
 
+def loadLexicon(srcdir, use_index=True):
+    """ Loads the lexicon of a dict dir. The lexiconp.txt is prioritised, lexicon.txt is also tried.
+    With use_index, the lexicon is a LexiconIndex (built on the first run),
+    otherwise the dict from readLexiconEntries.
+    Returns the lexicon, the file name and the LEXICON_CONSTANT:
+    the pronunciation entry is lexicon[word][1:] for lexiconp.txt (1), and lexicon[word][0:] for lexicon.txt (0) """
+    for lexiconstyle, LEXICON_CONSTANT in (("lexiconp.txt", 1), ("lexicon.txt", 0)):
+        lexiconfile = os.path.join(srcdir, lexiconstyle)
+        if os.path.exists(lexiconfile):
+            break
+    if use_index:
+        return LexiconIndex.load(lexiconfile), lexiconstyle, LEXICON_CONSTANT
+    return readLexiconEntries(lexiconfile), lexiconstyle, LEXICON_CONSTANT
+
 def addOOVs(textwords, lexicon, oov):
     """ Adds the pronunciation of oov as the pronunciation of each
     out-of-vocabulary word in the texts """
@@ -50,9 +70,13 @@ def addOOVs(textwords, lexicon, oov):
             print(word)
             raise
 
-def addTruncations(lexicon, textwords, truncation_label, min_cut_phonemes=2, min_left_phonemes=2, LEXICON_CONSTANT=1):
+def addTruncations(lexicon, textwords, truncation_label, min_cut_phonemes=2, min_left_phonemes=2, LEXICON_CONSTANT=1,
+        max_truncations=None):
     """ Adds truncated lexicon entries for all textwords into the lexicon inplace.
     Returns the added words as a set. 
+    Each distinct truncation of a word is added once, even if many pronunciations of the word
+    begin the same way. With max_truncations, at most that many truncations are added for
+    each word, the shortest ones first.
 
     Note: LEXICON_CONSTANT is used here to keep compatibility with both lexiconp.txt and lexicon.txt
     formats. It is either 1 or 0, as lexicon[uttid][0] can be a weight or the first phoneme of the
@@ -60,15 +84,33 @@ def addTruncations(lexicon, textwords, truncation_label, min_cut_phonemes=2, min
     """
     truncation_words = set()
     for word in textwords:
+        #The prefixes of the pronunciations as a trie, (parent prefix id, phoneme) -> prefix id,
+        #so a prefix that was already seen is not joined again:
+        prefix_ids = {}
+        truncations = [] #(number of entries, truncation), in the order they are found
         for pronunciation in lexicon[word]:
             pronunciation_list = pronunciation.split()
-            if len(pronunciation_list) - LEXICON_CONSTANT < min_cut_phonemes + min_left_phonemes:
+            if len(lexicon[word]) == 1:
+                #Nothing to share the prefixes with
+                truncations.extend((upto_pos, u" ".join(pronunciation_list[:upto_pos]))
+                        for upto_pos in range(min_left_phonemes + LEXICON_CONSTANT, len(pronunciation_list) - min_cut_phonemes))
                 continue
-            for upto_pos in range(min_left_phonemes + LEXICON_CONSTANT, len(pronunciation_list) - min_cut_phonemes):
-                truncation = u" ".join(pronunciation_list[:upto_pos])
-                truncation_word = truncation_label + word
-                lexicon.setdefault(truncation_word, []).append(truncation)
-                truncation_words.add(truncation_word)
+            prefix_id = 0 #the empty prefix
+            for upto_pos in range(1, len(pronunciation_list) - min_cut_phonemes):
+                key = (prefix_id, pronunciation_list[upto_pos-1])
+                if key in prefix_ids:
+                    prefix_id = prefix_ids[key]
+                    continue
+                prefix_id = prefix_ids[key] = len(prefix_ids) + 1
+                if upto_pos >= min_left_phonemes + LEXICON_CONSTANT:
+                    truncations.append((upto_pos, u" ".join(pronunciation_list[:upto_pos])))
+        if max_truncations is not None:
+            #The sort is stable, so equally long truncations stay in the order they were found
+            truncations = sorted(truncations, key=lambda x:x[0])[:max_truncations]
+        if truncations:
+            truncation_word = truncation_label + word
+            lexicon.setdefault(truncation_word, []).extend(truncation for _, truncation in truncations)
+            truncation_words.add(truncation_word)
     return truncation_words
 
 def readText(textfile):
@@ -89,7 +131,7 @@ def readText(textfile):
 
 def getAllTextWords(texts):
     """ Returns a set of all the words in the given texts """
-    return reduce(lambda x,y: x | set(y), texts.values(), set()) #union of all the texts as sets
+    return set().union(*texts.values())
         
 def getFilteredLexicon(lexicondict, allwords):
     """ Returns a lexicon with just the necessary words.
@@ -97,15 +139,13 @@ def getFilteredLexicon(lexicondict, allwords):
     return { word: lexicondict[word] for word in allwords }
         
 def writeLexicon(lexicondict, outfile):
-    entries = [] 
-    for word, pronunciations in lexicondict.items():
-        #Last entry has to end in new line, or validate_dict_dir.pl will fail!
-        entries.extend(word + " " + pronunciation + "\n" for pronunciation in pronunciations)
-    #For example truncations can result in duplicates, remove them:
-    entries = sorted(list(set(entries)), key=lambda x:x[0])
-    outunicode = u"".join(entries)
+    """ Writes the entries sorted by word and then pronunciation, each entry only once """
     with open(outfile, "w") as fo:
-        fo.write(outunicode.encode(ENCODING))
+        for word in sorted(lexicondict):
+            #For example truncations can result in duplicates, remove them:
+            for pronunciation in sorted(set(lexicondict[word])):
+                #Last entry has to end in new line, or validate_dict_dir.pl will fail!
+                fo.write((word + u" " + pronunciation + u"\n").encode(ENCODING))
 
 def writeHomophones(homophones, outfile):
     outunicode = u"\n".join([u" ".join(words) for words in homophones])
@@ -119,7 +159,6 @@ def writeTruncations(truncations, outfile):
 
 if __name__ == "__main__":
     import argparse
-    import os.path
 
     ###Parse script arguments:
     parser = argparse.ArgumentParser()
@@ -128,21 +167,18 @@ if __name__ == "__main__":
     parser.add_argument("textfile", help = "The Kaldi style text file")
     parser.add_argument("--oov", dest="oov", help="Dictionary entry to use for missing words")
     parser.add_argument("--truncation-label", dest="truncation_label", help="Prefix for truncation entries in the lexicon")
+    parser.add_argument("--max-truncations", type=int,
+            help="Add at most this many truncations for each word, the shortest ones first")
+    parser.add_argument("--no-index", dest="use_index", action="store_false",
+            help="Parse the lexicon file instead of using (and building) its binary index")
     inputs = parser.parse_args()
 
-    #The lexiconp.txt is prioritised, lexicon.txt is also tried:
-    try:
-        lexiconstyle = "lexiconp.txt"
-        LEXICON_CONSTANT = 1 #the pronunciation entry is lexicon[uttid][1:]
-        lexiconfile = os.path.join(inputs.srcdir, lexiconstyle)
-        lexicon = readLexiconEntries(lexiconfile)
-    except IOError:
-        lexiconstyle = "lexicon.txt"
-        LEXICON_CONSTANT = 0 #the pronunciation entry is lexicon[uttid][0:] 
-        lexiconfile = os.path.join(inputs.srcdir, lexiconstyle)
-        lexicon = readLexiconEntries(lexiconfile)
+    lexicon, lexiconstyle, LEXICON_CONSTANT = loadLexicon(inputs.srcdir, inputs.use_index)
     texts = readText(inputs.textfile)
     textwords = getAllTextWords(texts)
+    if inputs.use_index:
+        #Only the text words (and the OOV entry) are needed, as a dict that can be modified:
+        lexicon = lexicon.subset(textwords | set([inputs.oov.decode(ENCODING)] if inputs.oov is not None else []))
     if inputs.oov is not None: 
         print("Adding pronunciation for any missing words from the pronunciation of: "+inputs.oov)
         oov_entry = inputs.oov.decode(ENCODING)
@@ -152,7 +188,8 @@ if __name__ == "__main__":
     if inputs.truncation_label is not None:
         print("Adding truncations with truncation prefix: "+inputs.truncation_label)
         #Modifies lexicon in place, returns a set of all used word entries (sets are immutable)
-        truncwords = addTruncations(lexicon, textwords, inputs.truncation_label.decode(ENCODING))
+        truncwords = addTruncations(lexicon, textwords, inputs.truncation_label.decode(ENCODING),
+                max_truncations=inputs.max_truncations)
     words_to_keep = truncwords | textwords | IMPORTANT_WORDS #union 
     filtered_lexicon = getFilteredLexicon(lexicon, words_to_keep)
     #This must of course be done last:
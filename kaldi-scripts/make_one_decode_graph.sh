@@ -60,13 +60,13 @@ cp "$workdir"/{homophones,truncations}.txt "$langdir"
 echo "$OOV" > "$langdir"/rubbish
 echo "$truncation_symbol" > "$langdir"/truncation_symbol
 
-cat "$workdir"/uniqued_prompt.txt | miscue-tolerant-lm-fst/make_one_miscue_tolerant_lm.py \
-  --homophones "$langdir"/homophones.txt --rubbish-label "$OOV" \
+#Writes an arc sorted binary G.fst directly, no need for fstcompile | fstarcsort
+cat "$workdir"/uniqued_prompt.txt | miscue-tolerant-lm-fst/make_miscue_tolerant_lms.py \
+  --homophones "$langdir"/homophones.txt --rubbish-label "$langdir"/rubbish \
   --correct-word-boost "$correct_boost" \
   --truncations "$langdir"/truncations.txt --truncation-label "$langdir"/truncation_symbol \
-  | utils/eps2disambig.pl |\
-  fstcompile --isymbols="$langdir"/words.txt --osymbols="$langdir"/words.txt |\
-  fstarcsort --sort_type=ilabel > "$langdir"/G.fst
+  --words-table "$langdir"/words.txt --eps-to-disambig \
+  --fst-out "$langdir"/G.fst -
 
 echo "utils/mkgraph.sh $scale_opts $langdir $modeldir $graphdir" #Logging
 utils/mkgraph.sh $scale_opts "$langdir" "$modeldir" "$graphdir"
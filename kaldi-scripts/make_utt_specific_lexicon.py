@@ -1,8 +1,9 @@
 #!/usr/bin/env python
 from __future__ import print_function
-from make_extended_lexicon import (getHomophones, readLexiconEntries, 
+import os.path
+from make_extended_lexicon import (getHomophones,
     addOOVs, addTruncations, writeHomophones, writeLexicon, writeTruncations,
-    getFilteredLexicon)
+    getFilteredLexicon, readText, loadLexicon)
 
 ENCODING="utf8"
 IMPORTANT_WORDS = set([])
@@ -19,6 +20,43 @@ def uniquefyPrompt(prompt, lexicondict):
         lexicondict[uniquefied_word] = lexicondict[word]
     return uniquefied_prompt
 
+def makeUttSpecificLexicon(prompt, lexicon, oov=None, truncation_label=None, LEXICON_CONSTANT=1,
+        max_truncations=None):
+    """ Makes the lexicon entries, homophones and truncations for one prompt.
+    Only the entries of the words in the prompt are looked up in the lexicon,
+    and it is not modified, so it can be loaded once for many prompts.
+    Returns the uniquefied prompt, the filtered lexicon, the homophones and the truncation words. """
+    textwords = set(prompt)
+    important_words = set(IMPORTANT_WORDS)
+    prompt_lexicon = {}
+    if oov is not None:
+        prompt_lexicon[oov] = lexicon[oov]
+        important_words.add(oov)
+    for word in textwords:
+        if word in lexicon:
+            prompt_lexicon[word] = lexicon[word]
+    if oov is not None:
+        #Modifies prompt_lexicon in place:
+        addOOVs(textwords, prompt_lexicon, oov)
+    uniqued_prompt = uniquefyPrompt(prompt, prompt_lexicon)
+    unique_textwords = set(uniqued_prompt)
+    truncwords = set()
+    if truncation_label is not None:
+        #Modifies prompt_lexicon in place, returns a set of all used word entries
+        truncwords = addTruncations(prompt_lexicon, unique_textwords, truncation_label,
+                LEXICON_CONSTANT=LEXICON_CONSTANT, max_truncations=max_truncations)
+    words_to_keep = truncwords | unique_textwords | important_words #union
+    filtered_lexicon = getFilteredLexicon(prompt_lexicon, words_to_keep)
+    #This must of course be done last:
+    homophones = getHomophones(filtered_lexicon, words_to_keep)
+    return uniqued_prompt, filtered_lexicon, homophones, truncwords
+
+def writeUttSpecificLexicon(outdir, lexiconstyle, uniqued_prompt, filtered_lexicon, homophones, truncwords):
+    writePrompt(uniqued_prompt, os.path.join(outdir, "uniqued_prompt.txt"))
+    writeLexicon(filtered_lexicon, os.path.join(outdir, lexiconstyle))
+    writeHomophones(homophones, os.path.join(outdir, "homophones.txt"))
+    writeTruncations(truncwords, os.path.join(outdir, "truncations.txt"))
+
 def readPrompt(promptfile):
     """ Expects the prompt to be the first (only) line, already tokenised,
     with words separated by whitespace """
@@ -36,59 +74,52 @@ def writePrompt(prompt, outfile):
 
 if __name__ == "__main__":
     import argparse
-    import os.path
 
     ###Parse script arguments:
     parser = argparse.ArgumentParser()
     parser.add_argument("srcdir", help = "The source dictionary directory")
     parser.add_argument("tmpdir", help = "The directory to place the output")
-    parser.add_argument("promptfile", help = "The file containing the prompt")
+    parser.add_argument("promptfile", help = "The file containing the prompt, or with --batch, a Kaldi style text file")
     parser.add_argument("--keep", dest="keepwords", 
             help = "Words to keep from the lexicon, even if not found in prompt, in the form they appear.")
     parser.add_argument("--oov", dest="oov", help="Dictionary entry to use for missing words")
     parser.add_argument("--truncation-label", dest="truncation_label", help="Prefix for truncation entries in the lexicon")
+    parser.add_argument("--max-truncations", type=int,
+            help="Add at most this many truncations for each word, the shortest ones first")
+    parser.add_argument("--batch", action="store_true",
+            help = "Make the outputs for each utterance in the text file, into <tmpdir>/<uttid>/, loading the lexicon only once")
+    parser.add_argument("--no-index", dest="use_index", action="store_false",
+            help="Parse the lexicon file instead of using (and building) its binary index")
     inputs = parser.parse_args()
 
     ###Process inputs:
-    prompt = readPrompt(inputs.promptfile)
+    if inputs.batch:
+        prompts = readText(inputs.promptfile)
+    else:
+        prompts = {None: readPrompt(inputs.promptfile)}
     keepwords = inputs.keepwords.split() if inputs.keepwords is not None else []
-    oov = inputs.oov
+    oov_entry = inputs.oov.decode(ENCODING) if inputs.oov is not None else None
+    truncation_label = inputs.truncation_label.decode(ENCODING) if inputs.truncation_label is not None else None
     demand_comprehensive_lexicon = True
-    #The lexiconp.txt is prioritised, lexicon.txt is also tried:
-    try:
-        lexiconstyle = "lexiconp.txt"
-        LEXICON_CONSTANT = 1 #the pronunciation entry is lexicon[uttid][1:]
-        lexiconfile = os.path.join(inputs.srcdir, lexiconstyle)
-        lexicon = readLexiconEntries(lexiconfile)
-    except IOError:
-        lexiconstyle = "lexicon.txt"
-        LEXICON_CONSTANT = 0 #the pronunciation entry is lexicon[uttid][0:] 
-        lexiconfile = os.path.join(inputs.srcdir, lexiconstyle)
-        lexicon = readLexiconEntries(lexiconfile)
-    textwords = set(prompt)
-    if inputs.oov is not None: 
+    #makeUttSpecificLexicon does not modify the lexicon, so the index can be used directly
+    lexicon, lexiconstyle, LEXICON_CONSTANT = loadLexicon(inputs.srcdir, inputs.use_index)
+    if oov_entry is not None: 
         print("Adding pronunciation for any missing words from the pronunciation of: "+inputs.oov)
-        oov_entry = inputs.oov.decode(ENCODING)
-        #Modifies lexicon in place, note this does not add new words:
-        addOOVs(textwords, lexicon, oov_entry)
-        IMPORTANT_WORDS.add(oov_entry)
-    uniqued_prompt = uniquefyPrompt(prompt, lexicon)
-    unique_textwords = set(uniqued_prompt)
-    if inputs.truncation_label is not None:
+    if truncation_label is not None:
         print("Adding truncations with truncation prefix: "+inputs.truncation_label)
-        #Modifies lexicon in place, returns a set of all used word entries (sets are immutable)
-        truncwords = addTruncations(lexicon, unique_textwords, inputs.truncation_label.decode(ENCODING), LEXICON_CONSTANT=LEXICON_CONSTANT)
-    words_to_keep = truncwords | unique_textwords | IMPORTANT_WORDS #union 
-    filtered_lexicon = getFilteredLexicon(lexicon, words_to_keep)
-    #This must of course be done last:
-    homophones = getHomophones(filtered_lexicon, words_to_keep)
+    for uttid, prompt in sorted(prompts.items()):
+        if not prompt:
+            raise ValueError("The prompt was empty! " + (uttid or ""))
+        outputs = makeUttSpecificLexicon(prompt, lexicon, oov_entry, truncation_label, LEXICON_CONSTANT,
+                inputs.max_truncations)
 
-    ###Write outputs:
-    promptout = os.path.join(inputs.tmpdir, "uniqued_prompt.txt")
-    lexiconout = os.path.join(inputs.tmpdir, lexiconstyle)
-    homophoneout = os.path.join(inputs.tmpdir, "homophones.txt")
-    truncwordout = os.path.join(inputs.tmpdir, "truncations.txt")
-    writePrompt(uniqued_prompt, promptout)
-    writeLexicon(filtered_lexicon, lexiconout)
-    writeHomophones(homophones, homophoneout)
-    writeTruncations(truncwords, truncwordout)
+        ###Write outputs:
+        if uttid is None:
+            outdir = inputs.tmpdir
+        else:
+            outdir = os.path.join(inputs.tmpdir, uttid)
+            if not os.path.isdir(outdir):
+                os.makedirs(outdir)
+        writeUttSpecificLexicon(outdir, lexiconstyle, *outputs)
+    if inputs.batch:
+        print("Wrote the lexicons of "+str(len(prompts))+" utterances into "+inputs.tmpdir)
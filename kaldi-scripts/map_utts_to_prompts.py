@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# Finds the unique prompts in a Kaldi text file, and maps uttids to those (via prompt ids)
+# Does the same as map_utts_to_prompts.sh, for the whole text file in one pass:
+# the prompt ids are the POSIX cksum CRCs of the prompts, as given by
+#   echo "$prompt" | cksum
+# so the outputs are the same as from the shell script.
+# Mostly should be used as a subtask of graphs_for_text.sh
+
+import heapq
+import os
+import re
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import make_miscue_tolerant_lms as mtlm
+
+def makeCksumTable():
+    table = []
+    for byte in range(256):
+        crc = byte << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7) if crc & 0x80000000 else (crc << 1)
+        table.append(crc & 0xFFFFFFFF)
+    return table
+
+CKSUM_TABLE = makeCksumTable()
+
+def cksum(data):
+    """ The POSIX cksum CRC of the given bytes """
+    crc = 0
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFFFFFF) ^ CKSUM_TABLE[(crc >> 24) ^ byte]
+    length = len(data)
+    while length:
+        crc = ((crc << 8) & 0xFFFFFFFF) ^ CKSUM_TABLE[(crc >> 24) ^ (length & 0xFF)]
+        length >>= 8
+    return ~crc & 0xFFFFFFFF
+
+def splitTextLine(line):
+    """ Splits a text line into the uttid and the prompt, the way
+    map_utts_to_prompts.sh does with read, awk and cut -f 2- -d " " """
+    #read without -r strips the surrounding whitespace and removes backslashes:
+    line = re.sub(r"\\(.)", r"\1", line.strip(" \t\n"))
+    uttid = line.split()[0]
+    prompt = line.split(" ", 1)[1] if " " in line else line
+    return uttid, prompt
+
+# The options of make_miscue_tolerant_lms.py that graphs_for_text.sh uses,
+# as far as they change the number of arcs, which are the defaults.
+# Truncations add at most one arc per word, so they are left out.
+COST_SETTINGS = mtlm.makeSettings()
+
+def promptCost(prompt, cost_settings=COST_SETTINGS):
+    """ An estimate of the cost of compiling the graph for a prompt:
+    the number of arcs in its G, which grows quadratically in the prompt length
+    because of the jump arcs """
+    return mtlm.estimateNumArcs(prompt.split(), cost_settings)
+
+def mapUttsToPrompts(textfile):
+    """ Reads the text file and returns a list of (uttid, promptcrc) in input order,
+    and the sorted unique lines <promptcrc> <prompt> for the prompts table. """
+    utt2promptcrc = []
+    crc_by_prompt = {}
+    unique_prompts = {}
+    with open(textfile, encoding="utf-8") as fi:
+        for line in fi:
+            if not line.strip():
+                continue
+            uttid, prompt = splitTextLine(line)
+            if prompt not in crc_by_prompt:
+                promptcrc = str(cksum((prompt + "\n").encode("utf-8")))
+                crc_by_prompt[prompt] = promptcrc
+                if promptcrc in unique_prompts:
+                    print("WARNING: prompts with the same CRC", promptcrc + ":",
+                            repr(unique_prompts[promptcrc]), repr(prompt), file=sys.stderr)
+                unique_prompts.setdefault(promptcrc, prompt)
+            utt2promptcrc.append((uttid, crc_by_prompt[prompt]))
+    prompt_lines = sorted(set(crc + " " + prompt for prompt, crc in crc_by_prompt.items()))
+    return utt2promptcrc, prompt_lines
+
+def shardPrompts(prompt_lines, nj, cost_settings=COST_SETTINGS):
+    """ Splits the prompt table lines into nj shards of about equal total cost.
+    Longest processing time first: the most expensive prompts are placed first,
+    each into the cheapest shard so far.
+    Returns the shards, and the total cost of each. """
+    costs = dict((line, promptCost(line.split(" ", 1)[1], cost_settings)) for line in prompt_lines)
+    shards = [[] for _ in range(nj)]
+    loads = [(0, job) for job in range(nj)]
+    for line in sorted(prompt_lines, key=lambda line: costs[line], reverse=True):
+        load, job = heapq.heappop(loads)
+        shards[job].append(line)
+        heapq.heappush(loads, (load + costs[line], job))
+    total_costs = [load for load, job in sorted(loads, key=lambda load_job: load_job[1])]
+    return [sorted(shard) for shard in shards], total_costs
+
+def reportShards(total_costs, fileobj=sys.stderr):
+    print("Estimated arcs per shard: max", max(total_costs), "min", min(total_costs),
+            "total", sum(total_costs), file=fileobj)
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="""
+        Finds the unique prompts in a Kaldi text file, and maps uttids to those.
+        Writes <utt2prompt> with lines <uttid> <promptcrc> and <prompts-table> with
+        lines <promptcrc> <prompt>, like map_utts_to_prompts.sh""")
+    parser.add_argument("text")
+    parser.add_argument("utt2prompt")
+    parser.add_argument("promptstbl", metavar="prompts-table")
+    parser.add_argument("--nj", type=int, default=1, help=
+        """Number of shards to split the unique prompts into,
+        balanced by the estimated cost of each prompt""")
+    parser.add_argument("--shard-pattern", help=
+        """Where to write the shards of the prompts table, JOB is replaced by
+        the shard number, e.g. exp/graphs/log/prompts.JOB.scp""")
+    args = parser.parse_args()
+    if args.shard_pattern is not None and "JOB" not in args.shard_pattern:
+        parser.error("--shard-pattern must contain JOB")
+
+    utt2promptcrc, prompt_lines = mapUttsToPrompts(args.text)
+    with open(args.utt2prompt, "w", encoding="utf-8") as fo:
+        fo.write("".join(uttid + " " + promptcrc + "\n" for uttid, promptcrc in utt2promptcrc))
+    with open(args.promptstbl, "w", encoding="utf-8") as fo:
+        fo.write("".join(line + "\n" for line in prompt_lines))
+    if args.shard_pattern is not None:
+        shards, total_costs = shardPrompts(prompt_lines, args.nj)
+        for job, shard in enumerate(shards, start=1):
+            with open(args.shard_pattern.replace("JOB", str(job)), "w", encoding="utf-8") as fo:
+                fo.write("".join(line + "\n" for line in shard))
+        reportShards(total_costs)
+    print("Mapped", len(utt2promptcrc), "utterances to", len(prompt_lines), "unique prompts", file=sys.stderr)
@@ -5,6 +5,7 @@ set -o pipefail
 OOV="<SPOKEN_NOISE>"
 truncation_symbol="[TRUNC]:"
 silprob=0.7 #the default is 0.5, this should reflect higher hesitation time.
+max_truncations= #empty for all truncations, a smaller L_disambig.fst with e.g. 3
 
 . path.sh
 . parse_options.sh
@@ -14,6 +15,7 @@ if [ "$#" -ne 3 ]; then
   echo "Options:"
   echo "--OOV <OOV>                  Entry to use as pronunciation for oov words, default: <SPOKEN_NOISE>"
   echo "--truncation_symbol <truncation-prefix>   Prefix for truncated words in lexicon, default: [TRUNC]:" 
+  echo "--max_truncations <n>        Add at most n truncations for each word, the shortest ones first, default: all"
   exit 1
 fi
 
@@ -41,6 +43,7 @@ rm "$localdictsrc"/lexicon*.txt
 
 miscue-tolerant-lm-fst/kaldi-scripts/make_extended_lexicon.py \
   --oov "$OOV" --truncation-label "$truncation_symbol" \
+  ${max_truncations:+--max-truncations $max_truncations} \
   "$dictsrcdir" "$localdictsrc" "$textfile"
 utils/prepare_lang.sh --sil-prob "$silprob" "$localdictsrc" "$OOV" "$langtmpdir" "$langdir"
 cp "$localdictsrc"/{homophones,truncations}.txt "$langdir"
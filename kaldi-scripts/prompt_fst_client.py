@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# A client for prompt_fst_server.py, and a load test for it.
+# With a prompt, writes the outputs of the server into a directory, with the same
+# file names as make_utt_specific_lexicon.py, plus G.txt. With --load-test, sends
+# the prompts of a file to the server from many threads and reports the latencies.
+
+import http.client
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout=60):
+        http.client.HTTPConnection.__init__(self, "localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+class PromptFSTClient(object):
+    ## Keeps one connection to the server open, so use one client per thread.
+    def __init__(self, port=None, socket_path=None):
+        self.port = port
+        self.socket_path = socket_path
+        self.connection = None
+
+    def request(self, method, path, obj=None):
+        if self.connection is None:
+            if self.socket_path is not None:
+                self.connection = UnixHTTPConnection(self.socket_path)
+            else:
+                self.connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=60)
+        body = json.dumps(obj).encode("utf-8") if obj is not None else None
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        try:
+            self.connection.request(method, path, body, headers)
+            response = self.connection.getresponse()
+            result = json.loads(response.read().decode("utf-8"))
+        except (http.client.HTTPException, OSError):
+            self.close()
+            raise
+        if response.status != 200:
+            raise RuntimeError("Server error " + str(response.status) + ": " + result.get("error", ""))
+        return result
+
+    def fst(self, prompt):
+        return self.request("POST", "/fst", {"prompt": prompt})
+
+    def metrics(self):
+        return self.request("GET", "/metrics")
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+def writeOutputs(result, outdir, lexiconstyle="lexicon.txt"):
+    """ Writes the files that make_utt_specific_lexicon.py and make_miscue_tolerant_lms.py
+    would write for the prompt """
+    outputs = {
+            "G.txt":                result["fst"],
+            "uniqued_prompt.txt":   result["uniqued_prompt"],
+            lexiconstyle:           "".join(line + "\n" for line in result["lexicon"]),
+            "homophones.txt":       "\n".join(" ".join(words) for words in result["homophones"]),
+            "truncations.txt":      "\n".join(result["truncations"]),
+    }
+    for filename, text in outputs.items():
+        with open(os.path.join(outdir, filename), "w", encoding="utf-8") as fo:
+            fo.write(text)
+
+def loadTest(makeClient, prompts, num_requests, concurrency):
+    """ Sends num_requests requests, cycling through the prompts, from concurrency threads.
+    Returns the number of requests per second, and the sorted latencies in seconds. """
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    next_request = [0]
+    def work():
+        client = makeClient()
+        while True:
+            with lock:
+                index = next_request[0]
+                next_request[0] += 1
+            if index >= num_requests:
+                break
+            start = time.perf_counter()
+            try:
+                client.fst(prompts[index % len(prompts)])
+            except (RuntimeError, http.client.HTTPException, OSError) as e:
+                with lock:
+                    errors.append(e)
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - start)
+        client.close()
+    start = time.perf_counter()
+    threads = [threading.Thread(target=work) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    if errors:
+        print("Load test:", len(errors), "errors, e.g.", errors[0], file=sys.stderr)
+    return len(latencies) / elapsed, sorted(latencies)
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="""
+        Client and load test for prompt_fst_server.py""")
+    parser.add_argument("--port", type=int, help="The server is on this port on localhost")
+    parser.add_argument("--socket", help="The server is on this Unix socket")
+    parser.add_argument("--prompt", help="Get the FST of this prompt")
+    parser.add_argument("--outdir", help="With --prompt, write the outputs here instead of G to stdout")
+    parser.add_argument("--lexiconstyle", default="lexicon.txt", help=
+        """With --outdir, the file name of the lexicon, lexicon.txt or lexiconp.txt""")
+    parser.add_argument("--load-test", metavar="PROMPTS", help=
+        """File of prompts, one per line, to send for a load test""")
+    parser.add_argument("--requests", type=int, default=1000, help="Number of requests in the load test")
+    parser.add_argument("--concurrency", type=int, default=8, help="Number of threads in the load test")
+    parser.add_argument("--metrics", action="store_true", help="Print the metrics of the server")
+    args = parser.parse_args()
+    if (args.port is None) == (args.socket is None):
+        parser.error("Give one of --port and --socket")
+    makeClient = lambda: PromptFSTClient(args.port, args.socket)
+
+    if args.prompt is not None:
+        result = makeClient().fst(args.prompt)
+        if args.outdir is not None:
+            writeOutputs(result, args.outdir, args.lexiconstyle)
+        else:
+            sys.stdout.write(result["fst"])
+    if args.load_test is not None:
+        with open(args.load_test, encoding="utf-8") as fi:
+            prompts = [line.strip() for line in fi if line.strip()]
+        throughput, latencies = loadTest(makeClient, prompts, args.requests, args.concurrency)
+        if latencies:
+            percentile = lambda p: latencies[min(len(latencies)-1, int(p / 100. * len(latencies)))] * 1000.
+            print("%d requests, %.1f requests/s, latency ms: p50 %.2f p95 %.2f p99 %.2f max %.2f" % (
+                len(latencies), throughput, percentile(50), percentile(95), percentile(99), latencies[-1] * 1000.))
+    if args.metrics or args.load_test is not None:
+        print(json.dumps(makeClient().metrics(), indent=2))
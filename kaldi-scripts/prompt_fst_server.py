@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# A resident server that makes miscue tolerant G FSTs for prompts, for interactive use.
+# Does what make_utt_specific_lexicon.py and make_miscue_tolerant_lms.py do in
+# make_one_decode_graph.sh, but the lexicon is loaded only once, when the server starts,
+# and the results for recent prompts are kept in an LRU cache.
+# Listens on local HTTP (--port) or on a Unix socket (--socket):
+#   POST /fst      with a JSON object {"prompt": "the words of the prompt"}
+#                  returns a JSON object with:
+#                    fst:             G in the OpenFst text format, with word labels
+#                    uniqued_prompt:  the prompt with the word positions appended, like uniqued_prompt.txt
+#                    lexicon:         the lines of the prompt specific lexicon, like lexicon(p).txt
+#                    homophones:      lists of homophones, like homophones.txt
+#                    truncations:     the truncation entries, like truncations.txt
+#                    cached:          whether the result came from the cache
+#   GET /metrics   returns request counts, cache hits and misses, and latencies in milliseconds
+# See prompt_fst_client.py for a client and a load test.
+
+import collections
+import json
+import os
+import socketserver
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import prompt_lmfst
+import make_miscue_tolerant_lms as mtlm
+from make_utt_specific_lexicon import makeUttSpecificLexicon
+from make_extended_lexicon import loadLexicon
+
+class PromptFSTBuilder(object):
+    ## Holds the lexicon and the FST settings, and makes the outputs for one prompt.
+    ## The lexicon is never modified, see makeUttSpecificLexicon.
+    def __init__(self, lexicon, lexicon_constant, oov=None, truncation_label=None,
+            settings=None, isymbols=None):
+        self.lexicon = lexicon
+        self.lexicon_constant = lexicon_constant
+        self.oov = oov
+        self.truncation_label = truncation_label
+        self.settings = settings
+        self.isymbols = isymbols
+
+    def build(self, prompt):
+        tokens = prompt.split()
+        if not tokens:
+            raise ValueError("The prompt was empty!")
+        uniqued_prompt, filtered_lexicon, homophone_groups, truncwords = makeUttSpecificLexicon(
+                tokens, self.lexicon, self.oov, self.truncation_label, self.lexicon_constant)
+        fst, _ = mtlm.buildFST(None, uniqued_prompt, prompt_lmfst.homophonesFromGroups(homophone_groups),
+                truncwords, self.settings)
+        return {
+                "fst":              fst.inText(self.isymbols),
+                "uniqued_prompt":   " ".join(uniqued_prompt),
+                "lexicon":          sorted(set(word + " " + pronunciation
+                    for word, pronunciations in filtered_lexicon.items()
+                    for pronunciation in pronunciations)),
+                "homophones":       sorted(sorted(words) for words in homophone_groups),
+                "truncations":      sorted(truncwords),
+        }
+
+class PromptFSTService(object):
+    ## The builder with an LRU cache of the results, and the metrics.
+    ## Safe to use from many threads; the FSTs are built outside the lock.
+    def __init__(self, builder, cache_size=1000, num_latencies=10000):
+        self.builder = builder
+        self.cache_size = cache_size
+        self.cache = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.latencies = collections.deque(maxlen=num_latencies) #Seconds, of the most recent requests
+        self.started = time.time()
+
+    def get(self, prompt):
+        start = time.perf_counter()
+        if not isinstance(prompt, str):
+            with self.lock:
+                self.requests += 1
+                self.errors += 1
+            raise TypeError("The prompt must be a string")
+        key = " ".join(prompt.split())
+        with self.lock:
+            self.requests += 1
+            result = self.cache.get(key)
+            if result is not None:
+                self.cache.move_to_end(key)
+                self.hits += 1
+        if result is None:
+            try:
+                result = self.builder.build(key)
+            except (ValueError, KeyError):
+                with self.lock:
+                    self.errors += 1
+                raise
+            with self.lock:
+                self.misses += 1
+                if self.cache_size > 0:
+                    self.cache[key] = result
+                    if len(self.cache) > self.cache_size:
+                        self.cache.popitem(last=False)
+            cached = False
+        else:
+            cached = True
+        with self.lock:
+            self.latencies.append(time.perf_counter() - start)
+        return dict(result, cached=cached)
+
+    def metrics(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            metrics = {
+                    "uptime_s":     time.time() - self.started,
+                    "requests":     self.requests,
+                    "hits":         self.hits,
+                    "misses":       self.misses,
+                    "errors":       self.errors,
+                    "cache_size":   len(self.cache),
+                    "cache_max":    self.cache_size,
+            }
+        if latencies:
+            percentile = lambda p: latencies[min(len(latencies)-1, int(p / 100. * len(latencies)))] * 1000.
+            metrics["latency_ms"] = {
+                    "mean":     sum(latencies) / len(latencies) * 1000.,
+                    "p50":      percentile(50),
+                    "p95":      percentile(95),
+                    "p99":      percentile(99),
+                    "max":      latencies[-1] * 1000.,
+            }
+        return metrics
+
+class PromptFSTHandler(BaseHTTPRequestHandler):
+    ## The HTTP interface, see the top of this file. The server has the service.
+    def sendJSON(self, status, obj):
+        body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            self.sendJSON(200, self.server.service.metrics())
+        else:
+            self.sendJSON(404, {"error": "Unknown path " + self.path})
+
+    def do_POST(self):
+        if self.path != "/fst":
+            self.sendJSON(404, {"error": "Unknown path " + self.path})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length).decode("utf-8"))
+            result = self.server.service.get(request.get("prompt") if isinstance(request, dict) else None)
+        except (ValueError, KeyError, TypeError) as e:
+            self.sendJSON(400, {"error": str(e)})
+            return
+        self.sendJSON(200, result)
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return self.client_address[0] if self.client_address else self.server.server_address
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+class ThreadingPromptFSTServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class ThreadingUnixPromptFSTServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def makeServer(service, port=None, socket_path=None, verbose=False):
+    """ Returns a server for the service on localhost:port or on the Unix socket """
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = ThreadingUnixPromptFSTServer(socket_path, PromptFSTHandler)
+    else:
+        server = ThreadingPromptFSTServer(("127.0.0.1", port), PromptFSTHandler)
+    server.service = service
+    server.verbose = verbose
+    return server
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="""
+        Serves miscue tolerant G FSTs for prompts, see the top of this file.""")
+    parser.add_argument("srcdir", help = "The source dictionary directory")
+    parser.add_argument("--port", type=int, help="Listen on this port on localhost")
+    parser.add_argument("--socket", help="Listen on this Unix socket")
+    parser.add_argument("--oov", help="Dictionary entry to use for missing words, and the rubbish label")
+    parser.add_argument("--truncation-label", help="Prefix for truncation entries in the lexicon")
+    parser.add_argument("--correct-word-boost", type=float, help=
+        """Amount to multiply the correct words probability by, like in make_miscue_tolerant_lms.py""")
+    parser.add_argument("--eps-to-disambig", action="store_true", help=
+        """Write #0 instead of epsilon on the input side, like utils/eps2disambig.pl""")
+    parser.add_argument("--cache-size", type=int, default=1000, help=
+        """Number of recent prompts to keep the results of, default 1000""")
+    parser.add_argument("--no-index", dest="use_index", action="store_false",
+            help="Parse the lexicon file instead of using (and building) its binary index")
+    parser.add_argument("--verbose", action="store_true", help="Log each request")
+    args = parser.parse_args()
+    if (args.port is None) == (args.socket is None):
+        parser.error("Give one of --port and --socket")
+
+    if args.oov is not None:
+        mtlm.special_labels["Rubbish"] = args.oov
+    if args.truncation_label is not None:
+        mtlm.special_labels["Truncation"] = args.truncation_label
+    if args.correct_word_boost:
+        mtlm.weights["Correct"] = mtlm.weights["Correct"] * args.correct_word_boost
+    settings = mtlm.makeSettings()
+    isymbols = None
+    if args.eps_to_disambig:
+        isymbols = prompt_lmfst.Relabeling({mtlm.special_labels["Epsilon"]: "#0"})
+    load_start = time.time()
+    lexicon, lexiconstyle, lexicon_constant = loadLexicon(args.srcdir, args.use_index)
+    print("Loaded", len(lexicon), "words from", lexiconstyle, "in", "%.2f" % (time.time() - load_start), "s",
+            file=sys.stderr)
+    builder = PromptFSTBuilder(lexicon, lexicon_constant, args.oov, args.truncation_label,
+            settings, isymbols)
+    server = makeServer(PromptFSTService(builder, args.cache_size), args.port, args.socket, args.verbose)
+    print("Serving on", args.socket if args.socket is not None else "127.0.0.1:" + str(args.port),
+            file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket is not None and os.path.exists(args.socket):
+            os.remove(args.socket)
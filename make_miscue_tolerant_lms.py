@@ -1,9 +1,13 @@
 #!/usr/bin/env python3
-import locale
-locale.setlocale(locale.LC_ALL,'en_US.UTF-8')
 import prompt_lmfst
+import graph_cache
+import collections
 import math
 import functools
+import operator
+import sys
+from array import array
+from collections.abc import Mapping
 
 #NOTE: See the if __name__ == "__main__": block below for a description
 
@@ -106,36 +110,138 @@ def addPrematureEnds(p_fst, weights):
     for word in p_fst.words:
         p_fst.addFinalState(word.start, weights["PrematureEnd"])
 
-def addJumpsBackward(p_fst, weights):
+def stateWeight(p_fst, state):
+    # The total relative weight of the arcs and final weight added to a state so far.
+    return sum(leaf.weight for leaf in p_fst.states[state])
+
+def jumpIsPruned(n, decayed_weight, state_weight, max_distance, min_prob):
+    # The state weight only grows as more arcs are added, so
+    # decayed_weight / state_weight is an upper bound for the jump probability
+    # and only jumps that surely end up below min_prob are pruned.
+    if max_distance is not None and n > max_distance:
+        return True
+    if min_prob is not None and decayed_weight < min_prob * (state_weight + decayed_weight):
+        return True
+    return False
+
+def addJumpsBackward(p_fst, weights, max_distance=None, min_prob=None):
     # This will care of all but the last word 
     # (it's simpler code to add jumps from the start state, so we know the next correct word)
+    # Jumps over more than max_distance words, or with a probability below min_prob
+    # are not added. Returns the number of such pruned arcs.
+    num_pruned = 0
     for i, word, in enumerate(p_fst.words):
+        state_weight = stateWeight(p_fst, word.start) if min_prob is not None else None
         for n, prev_word in enumerate(reversed(p_fst.words[:i])):
             # n = number of words jumped over
             if n==0:
                 continue # The latest word is special; we add a repeat arc, not a jump back arc.
             decayed_weight = weights["LongJumpDecay"] ** n * weights["JumpBackward"]
+            if jumpIsPruned(n, decayed_weight, state_weight, max_distance, min_prob):
+                num_pruned += 1
+                continue
             p_fst.addArc(word.start, prev_word.final,
                     prev_word.label, prev_word.label,
                     decayed_weight)
     # We have to deal with the last word separately
+    state_weight = stateWeight(p_fst, p_fst.words[-1].final) if min_prob is not None else None
     for n, prev_word in enumerate(reversed(p_fst.words[:-1])):
         decayed_weight = weights["LongJumpDecay"] ** n * weights["JumpBackward"]
+        # Here the jump goes over n+1 words, the last word included
+        if jumpIsPruned(n + 1, decayed_weight, state_weight, max_distance, min_prob):
+            num_pruned += 1
+            continue
         p_fst.addArc(p_fst.words[-1].final, prev_word.final,
                 prev_word.label, prev_word.label,
                 decayed_weight)
+    return num_pruned
 
-def addJumpsForward(p_fst, weights):
+def addJumpsForward(p_fst, weights, max_distance=None, min_prob=None):
     # It's again simpler to add jumps from the start states, so we know the next correct word)
+    # Pruning works like in addJumpsBackward. Returns the number of pruned arcs.
+    num_pruned = 0
     for i, word, in enumerate(p_fst.words):
+        state_weight = stateWeight(p_fst, word.start) if min_prob is not None else None
         for n, later_word in enumerate(p_fst.words[i:]):
             # n = number of words jumped over
             if n == 0:
                 continue # The next word is special; we add a skip arc, not a jump forward arc.
             decayed_weight = weights["LongJumpDecay"] ** n * weights["JumpForward"]
+            if jumpIsPruned(n, decayed_weight, state_weight, max_distance, min_prob):
+                num_pruned += 1
+                continue
             p_fst.addArc(word.start, later_word.final,
                     later_word.label, later_word.label,
                     decayed_weight)
+    return num_pruned
+
+## The next two recipes are alternatives to addJumpsBackward and addJumpsForward.
+## Instead of an arc from every word to every other word, they build a chain
+## of auxiliary "jump hub" states, one per word, linked by epsilon arcs.
+## A jump enters the chain with one epsilon arc, hops along it, and leaves with
+## the target word label. The decay is applied once per hop, so the number of
+## arcs grows linearly in the prompt length.
+## Each hub is normalised like any other state, so the relative weight of
+## continuing along the chain is the decayed total of the jumps still ahead.
+## With that, every jump path gets the same cost as the corresponding dense
+## jump arc, as long as no homophone arcs are suppressed at the source state
+## (the hubs do not know which labels the source state already has).
+
+def addJumpHubsBackward(p_fst, weights, special_labels):
+    decay = weights["LongJumpDecay"]
+    # hubs[k] emits the label of word k, and continues to hubs[k-1]
+    hubs = []
+    tail_mass = 0.  # Sum of decay**m over the jumps reachable from a hub
+    for k, word in enumerate(p_fst.words[:-1]):
+        hub = p_fst.newState()
+        p_fst.addArc(hub, word.final,
+                word.label, word.label,
+                1.)
+        if hubs:
+            p_fst.addArc(hub, hubs[-1][0],
+                    special_labels["Epsilon"], special_labels["Epsilon"],
+                    decay * tail_mass)
+        tail_mass = 1. + decay * tail_mass
+        hubs.append((hub, tail_mass))
+    # From the start of word i, the first jump goes to word i-2 (one word jumped over)
+    for i, word in enumerate(p_fst.words):
+        if i < 2:
+            continue
+        hub, mass = hubs[i-2]
+        p_fst.addArc(word.start, hub,
+                special_labels["Epsilon"], special_labels["Epsilon"],
+                decay * mass * weights["JumpBackward"])
+    # The last word is again special, there the first jump goes to the word before it.
+    if hubs:
+        hub, mass = hubs[-1]
+        p_fst.addArc(p_fst.words[-1].final, hub,
+                special_labels["Epsilon"], special_labels["Epsilon"],
+                mass * weights["JumpBackward"])
+
+def addJumpHubsForward(p_fst, weights, special_labels):
+    decay = weights["LongJumpDecay"]
+    # Build the chain from the end, hubs[j] emits the label of word j
+    # and continues to hubs[j+1]
+    hubs = {}
+    tail_mass = 0.
+    for j in reversed(range(1, len(p_fst.words))):
+        word = p_fst.words[j]
+        hub = p_fst.newState()
+        p_fst.addArc(hub, word.final,
+                word.label, word.label,
+                1.)
+        if j + 1 in hubs:
+            p_fst.addArc(hub, hubs[j+1][0],
+                    special_labels["Epsilon"], special_labels["Epsilon"],
+                    decay * tail_mass)
+        tail_mass = 1. + decay * tail_mass
+        hubs[j] = (hub, tail_mass)
+    # Like in addJumpsForward, the jumps from word i start at word i+1.
+    for i, word in enumerate(p_fst.words[:-1]):
+        hub, mass = hubs[i+1]
+        p_fst.addArc(word.start, hub,
+                special_labels["Epsilon"], special_labels["Epsilon"],
+                decay * mass * weights["JumpForward"])
 
 def addTruncations(p_fst, weights, special_labels, truncations):
     for word in p_fst.words:
@@ -149,17 +255,34 @@ def addTruncations(p_fst, weights, special_labels, truncations):
 def convertRelativeProbs(p_fst):
     # First normalises the weights in relative probabilities into true
     # probabilities, then converts to negative logarithms.
+    # The weights of a state are summed and converted as a flat list of floats,
+    # and the leaves are rebuilt only once, with the new weights.
+    # A CompactPromptLMFST is normalised in place in its weight arrays.
+    # NOTE: One pass over the weights of all the states (with the totals in a
+    # list indexed by state) was tried, but in pure Python it was slower than
+    # this, since the leaves have to be rebuilt state by state anyway.
+    if isinstance(p_fst, prompt_lmfst.CompactPromptLMFST):
+        for state_num, (_, _, _, weights) in p_fst.arrays_by_state.items():
+            weights[:] = array("d", normalisedLogWeights(p_fst, state_num, weights))
+        return
     for state_num, leaves in p_fst.states.items():
         #leaves has Arcs and FinalStates, both of which have a property called weight
-        total_weight = functools.reduce(lambda x, y: x + y.weight, leaves, 0.)
-        normalised_leaves = []
-        for leaf in leaves:
-            if total_weight == 0. or leaf.weight == 0.:
-                raise ValueError("Relative probability was zero at: " + repr(leaf)) 
-            else:
-                new_weight = -math.log(leaf.weight / total_weight)
-            normalised_leaves.append(leaf._replace(weight = new_weight))
-        p_fst.states[state_num] = normalised_leaves
+        weights = [leaf.weight for leaf in leaves]
+        p_fst.states[state_num] = [type(leaf)._make(leaf[:-1] + (new_weight,))
+                for leaf, new_weight in zip(leaves, normalisedLogWeights(p_fst, state_num, weights))]
+
+def normalisedLogWeights(p_fst, state_num, weights, leaves=None):
+    # Returns the negative logarithms of weights normalised to sum to one.
+    # The sum is taken left to right, like functools.reduce would, so the
+    # results are exactly the same as when normalising leaf by leaf.
+    # leaves are the leaves of the state for the error message, by default p_fst.states[state_num]
+    total_weight = functools.reduce(operator.add, weights, 0.)
+    if weights and (total_weight == 0. or 0. in weights):
+        bad_leaf = 0 if total_weight == 0. else list(weights).index(0.)
+        leaves = leaves if leaves is not None else p_fst.states[state_num]
+        raise ValueError("Relative probability was zero at: " + repr(leaves[bad_leaf]))
+    log = math.log
+    return [-log(weight / total_weight) for weight in weights]
 
 def readTruncations(truncationsfile):
     """ Reads truncations from the given file and returns them as a set """
@@ -167,9 +290,489 @@ def readTruncations(truncationsfile):
         truncationslist = fi.read().split()
     return set(truncationslist)
 
+def splitPromptLine(line, kaldi_style):
+    """ Returns the ID (None if not kaldi_style) and the tokenised prompt """
+    if kaldi_style:
+        ID, *prompt_tokenised = line.strip().split()
+    else:
+        ID = None
+        prompt_tokenised = line.strip().split()
+    return ID, prompt_tokenised
+
+def makeSettings(**overrides):
+    """ Returns the settings of buildPromptFST and promptOutput, a dict of everything
+    that is shared between the prompts, with the defaults of the command line
+    for the settings that are not given:
+    weights, special_labels, homophones, truncations (a set or None),
+    kaldi_style, compact, lazy (build a LazyPromptLMFST), jump_topology,
+    max_jump_distance and min_arc_prob, isymbols and osymbols for writing the
+    labels (or None), binary for writing OpenFst binary instead of text,
+    topology_cache (a TopologyCache or None), and graph_cache (a GraphCache or
+    None, see promptOutput) with graph_cache_fingerprint. """
+    settings = {
+            "weights":              weights,
+            "special_labels":       special_labels,
+            "homophones":           prompt_lmfst.readHomophones(None),
+            "truncations":          None,
+            "kaldi_style":          False,
+            "compact":              False,
+            "lazy":                 False,
+            "jump_topology":        "dense",
+            "max_jump_distance":    None,
+            "min_arc_prob":         None,
+            "isymbols":             None,
+            "osymbols":             None,
+            "binary":               False,
+            "topology_cache":       None,
+            "graph_cache":          None,
+            "graph_cache_fingerprint": None,
+    }
+    unknown = set(overrides) - set(settings)
+    if unknown:
+        raise TypeError("Unknown settings: " + ", ".join(sorted(unknown)))
+    settings.update(overrides)
+    return settings
+
+def buildPromptFST(line, settings):
+    """ Builds the normalised FST for one line of input, settings from makeSettings.
+    Returns the FST and the number of pruned jump arcs. """
+    ID, prompt_tokenised = splitPromptLine(line, settings["kaldi_style"])
+    if settings["lazy"]:
+        fst = LazyPromptLMFST(ID, prompt_tokenised, settings["homophones"], settings["truncations"], settings)
+        return fst, fst.numPruned()
+    if settings["topology_cache"] is not None:
+        return settings["topology_cache"].buildFST(ID, prompt_tokenised, settings)
+    return buildFST(ID, prompt_tokenised, settings["homophones"], settings["truncations"], settings)
+
+def buildFST(ID, prompt_tokenised, homophones, truncations, settings):
+    """ Runs all the recipes for the prompt and normalises the weights.
+    Returns the FST and the number of pruned jump arcs. """
+    fst, num_pruned = buildRelativeFST(ID, prompt_tokenised, homophones, truncations, settings)
+    convertRelativeProbs(fst)
+    return fst, num_pruned
+
+def buildRelativeFST(ID, prompt_tokenised, homophones, truncations, settings):
+    """ Runs all the recipes for the prompt, the weights are left as relative probabilities.
+    Returns the FST and the number of pruned jump arcs. """
+    weights = settings["weights"]
+    special_labels = settings["special_labels"]
+    if settings["compact"]:
+        fst = prompt_lmfst.CompactPromptLMFST(homophones = homophones, ID=ID)
+    else:
+        fst = prompt_lmfst.PromptLMFST(homophones = homophones, ID=ID)
+    fst.addWordSequence(prompt_tokenised)
+    addCorrectPaths(fst, weights)
+    addRubbishPaths(fst, weights, special_labels)
+    addSkipPaths(fst, weights)
+    addRepeatPaths(fst, weights)
+    addPrematureEnds(fst, weights)
+    num_pruned = 0
+    if settings["jump_topology"] == "hubs":
+        addJumpHubsBackward(fst, weights, special_labels)
+        addJumpHubsForward(fst, weights, special_labels)
+    else:
+        num_pruned += addJumpsBackward(fst, weights,
+                settings["max_jump_distance"], settings["min_arc_prob"])
+        num_pruned += addJumpsForward(fst, weights,
+                settings["max_jump_distance"], settings["min_arc_prob"])
+    if truncations is not None:
+        addTruncations(fst, weights, special_labels, truncations)
+    return fst, num_pruned
+
+def estimateNumArcs(prompt_tokenised, settings):
+    """ The number of arcs (and final states) that buildFST adds for the prompt,
+    counted from the recipes without building the FST. Used to balance the
+    compilation jobs. Arcs dropped because of homophones, and jumps pruned by
+    min_arc_prob are not subtracted, so this is an upper bound. """
+    N = len(prompt_tokenised)
+    if N == 0:
+        return 0
+    num_arcs = N + 1            #addCorrectPaths
+    num_arcs += 3*(N-1) + 2     #addRubbishPaths
+    num_arcs += N-1             #addSkipPaths
+    num_arcs += N               #addRepeatPaths
+    num_arcs += N               #addPrematureEnds
+    if settings["jump_topology"] == "hubs":
+        #N-1 hubs each way, with an arc out and an epsilon onwards (but the last),
+        #and the entry arcs from the words
+        num_arcs += (N-1) + max(0, N-2) + max(0, N-2) + min(1, N-1)
+        num_arcs += (N-1) + max(0, N-2) + (N-1)
+    else:
+        d = settings["max_jump_distance"]
+        d = N if d is None else d
+        #addJumpsBackward: from word i over n=1..i-1 words, from the last final over 1..N-1 words
+        num_arcs += sum(min(i-1, d) for i in range(2, N)) + min(N-1, d)
+        #addJumpsForward: from word i over n=1..N-1-i words
+        num_arcs += sum(min(N-1-i, d) for i in range(N-1))
+    if settings["truncations"] is not None:
+        num_arcs += sum(1 for label in prompt_tokenised
+                if settings["special_labels"]["Truncation"]+label in settings["truncations"])
+    return num_arcs
+
+def promptShape(prompt_tokenised, homophones, truncations, special_labels):
+    """ The FST of a prompt only depends on the number of words, on which of
+    its labels are homophones of each other, and on which words have truncations.
+    Returns that as a hashable shape, and a dict that maps the placeholder labels
+    a template of the shape is built with to the labels of this prompt.
+    The placeholder for word i is "\\0i", and for its truncation the truncation
+    label followed by that. """
+    placeholders = {}
+    has_truncation = []
+    for i, label in enumerate(prompt_tokenised):
+        placeholders["\0" + str(i)] = label
+    for i, label in enumerate(prompt_tokenised):
+        truncation_entry = special_labels["Truncation"] + label
+        has_truncation.append(truncations is not None and truncation_entry in truncations)
+        if has_truncation[-1]:
+            placeholders[special_labels["Truncation"] + "\0" + str(i)] = truncation_entry
+    for special in (special_labels["Epsilon"], special_labels["Rubbish"]):
+        placeholders[special] = special
+    placeholders_by_label = {}
+    for placeholder, label in placeholders.items():
+        placeholders_by_label.setdefault(label, []).append(placeholder)
+    homophone_pairs = frozenset((placeholder, other)
+            for placeholder, label in placeholders.items() if label in homophones
+            for homophone in homophones[label]
+            for other in placeholders_by_label.get(homophone, ()))
+    shape = (len(prompt_tokenised), truncations is not None, tuple(has_truncation), homophone_pairs)
+    return shape, placeholders
+
+class TopologyCache(object):
+    ## Keeps the normalised FSTs of recently seen prompt shapes (see promptShape),
+    ## built with placeholder labels. A prompt with a cached shape gets a copy
+    ## of the template with its own labels substituted, which is exactly the FST
+    ## that the recipes would have built.
+    ## Holds at most max_size templates, the least recently used is dropped first.
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.templates = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def buildFST(self, ID, prompt_tokenised, settings):
+        shape, placeholders = promptShape(prompt_tokenised, settings["homophones"],
+                settings["truncations"], settings["special_labels"])
+        if shape in self.templates:
+            self.hits += 1
+            self.templates.move_to_end(shape)
+            template, num_pruned = self.templates[shape]
+        else:
+            self.misses += 1
+            template_homophones = prompt_lmfst.HomophoneClasses(shape[3])
+            template_truncations = None
+            if settings["truncations"] is not None:
+                template_truncations = set(placeholder for placeholder in placeholders
+                        if placeholder.startswith(settings["special_labels"]["Truncation"] + "\0"))
+            template_words = ["\0" + str(i) for i in range(len(prompt_tokenised))]
+            template, num_pruned = buildFST(None, template_words,
+                    template_homophones, template_truncations, settings)
+            self.templates[shape] = (template, num_pruned)
+            if len(self.templates) > self.max_size:
+                self.templates.popitem(last=False)
+        return template.relabelled(prompt_lmfst.Relabeling(placeholders), ID), num_pruned
+
+class LazyStates(Mapping):
+    ## A read-only view of the states of a LazyPromptLMFST, that looks like
+    ## PromptLMFST.states. Each state is built and normalised when it is read,
+    ## and not kept.
+    def __init__(self, fst):
+        self.fst = fst
+
+    def __getitem__(self, state):
+        leaves, _ = self.fst.relativeLeaves(state)
+        weights = [leaf.weight for leaf in leaves]
+        return [type(leaf)._make(leaf[:-1] + (new_weight,)) for leaf, new_weight
+                in zip(leaves, normalisedLogWeights(self.fst, state, weights, leaves))]
+
+    def __iter__(self):
+        return iter(range(self.fst.state_counter + 1))
+
+    def __len__(self):
+        return self.fst.state_counter + 1
+
+class LazyPromptLMFST(prompt_lmfst.PromptLMFST):
+    ## The same FST that buildFST makes with the dense jump topology, but no arcs
+    ## are stored: the recipes are run for one state at a time, when the state is
+    ## read, e.g. by write or writeBinary. So the memory needed for writing is that
+    ## of the largest state, not of the whole FST, which for long prompts (with
+    ## jumps between all the words) is quadratic in the prompt length.
+    ## The states are numbered like the recipes number them: state i is the start
+    ## of word i, state N the end of the last word, and N+1+i the rubbish state
+    ## before word i+1. relativeLeaves must be kept in the order of the recipes.
+    ## writeBinary writes the states in that order, see binaryStateOrder, so
+    ## the text output is the same as buildFST's, and the binary output is the
+    ## same FST with other state numbers.
+    def __init__(self, ID, prompt_tokenised, homophones, truncations, settings):
+        super(LazyPromptLMFST, self).__init__(homophones, ID)
+        self.truncations = truncations
+        self.weights = settings["weights"]
+        self.special_labels = settings["special_labels"]
+        self.max_jump_distance = settings["max_jump_distance"]
+        self.min_arc_prob = settings["min_arc_prob"]
+        self.addWordSequence(prompt_tokenised)
+        if not self.words:
+            raise ValueError("Prompt empty!")
+        self.state_counter += max(0, len(self.words) - 1) #The rubbish states
+        self.states = LazyStates(self)
+
+    def initState(self, state):
+        pass
+
+    def relativeLeaves(self, state):
+        """ Returns the leaves of a state with the relative weights, in the order
+        buildRelativeFST adds them, and the number of jump arcs pruned from it """
+        weights = self.weights
+        labels = [word.label for word in self.words]
+        N = len(labels)
+        rubbish = self.special_labels["Rubbish"]
+        Arc, FinalState = prompt_lmfst.Arc, prompt_lmfst.FinalState
+        leaves = []
+        class_ids = set()
+        def addArc(to_state, label, weight):
+            # Like PromptLMFST.addArc, for arcs with the same input and output label
+            class_id = self.homophones.classID(label)
+            if class_id is not None:
+                if class_id in class_ids:
+                    return
+                class_ids.add(class_id)
+            leaves.append(Arc(state, to_state, label, label, weight))
+        if state > N:
+            # addRubbishPaths: rubbish state before word i+1
+            i = state - N - 1
+            addArc(i, self.special_labels["Epsilon"], weights["Correct"])
+            addArc(i + 2, labels[i+1], weights["Correct"])
+            return leaves, 0
+        i = state
+        #addCorrectPaths:
+        if i < N:
+            addArc(i + 1, labels[i], weights["Correct"])
+        else:
+            leaves.append(FinalState(i, weights["FinalState"]))
+        #addRubbishPaths:
+        if i < N - 1:
+            addArc(N + 1 + i, rubbish, weights["Rubbish"])
+        else:
+            addArc(i, rubbish, weights["Rubbish"])
+        #addSkipPaths:
+        if i < N - 1:
+            addArc(i + 2, labels[i+1], weights["Skip"])
+        #addRepeatPaths:
+        if i > 0:
+            addArc(i, labels[i-1], weights["Repeat"])
+        #addPrematureEnds:
+        if i < N:
+            leaves.append(FinalState(i, weights["PrematureEnd"]))
+        #addJumpsBackward, and then addJumpsForward, as (decay exponent, number of
+        #words jumped over, ...); from the last word's end the first jump goes to
+        #the word before it with the exponent 0, from the start of word i over one word:
+        num_pruned = 0
+        if i < N:
+            jumps = [(n, n, i - n, labels[i-1-n], weights["JumpBackward"]) for n in range(1, i)]
+        else:
+            jumps = [(n, n + 1, N - 1 - n, labels[N-2-n], weights["JumpBackward"]) for n in range(N - 1)]
+        forward_jumps = [(n, n, i + n + 1, labels[i+n], weights["JumpForward"]) for n in range(1, N - i)]
+        for direction in (jumps, forward_jumps):
+            state_weight = sum(leaf.weight for leaf in leaves) if self.min_arc_prob is not None else None
+            for n, distance, to_state, label, jump_weight in direction:
+                decayed_weight = weights["LongJumpDecay"] ** n * jump_weight
+                if jumpIsPruned(distance, decayed_weight, state_weight, self.max_jump_distance, self.min_arc_prob):
+                    num_pruned += 1
+                    continue
+                addArc(to_state, label, decayed_weight)
+        #addTruncations:
+        if self.truncations is not None and i < N:
+            truncation_entry = self.special_labels["Truncation"] + labels[i]
+            if truncation_entry in self.truncations:
+                addArc(i, truncation_entry, weights["Truncation"])
+        return leaves, num_pruned
+
+    def binaryStateOrder(self, isymbols, osymbols):
+        # The states in their own order, so that writeBinary builds each of them
+        # once: numbering them like fstcompile, and working out the properties,
+        # would take another pass over all the states. So only the properties
+        # writeBinary makes sure of are written.
+        return dict((state, state) for state in self.states), (prompt_lmfst.FST_EXPANDED
+                | prompt_lmfst.FST_MUTABLE | prompt_lmfst.FST_I_LABEL_SORTED)
+
+    def numPruned(self):
+        # The number of jump arcs pruned, like buildFST returns.
+        # That needs a pass over the states, so only when something can be pruned.
+        if self.max_jump_distance is None and self.min_arc_prob is None:
+            return 0
+        return sum(self.relativeLeaves(state)[1] for state in range(len(self.words) + 1))
+
+def promptOutput(line, settings):
+    """ Builds the output (text or binary) for one line of input.
+    With a graph_cache in the settings, the output is read from there
+    if the same prompt was built with the same settings before
+    (graph_cache_fingerprint is a hash of those), and stored there otherwise.
+    Returns the ID, the output, the number of pruned jump arcs and whether
+    the output came from the cache. """
+    graph_cache = settings["graph_cache"]
+    if graph_cache is not None:
+        ID, prompt_tokenised = splitPromptLine(line, settings["kaldi_style"])
+        key = graph_cache.key(settings["graph_cache_fingerprint"], prompt_tokenised)
+        entry = graph_cache.get(key)
+        if entry is not None:
+            #The entry is the number of pruned arcs on the first line, then the FST without the ID
+            num_pruned, output = entry.split(b"\n", 1)
+            if not settings["binary"]:
+                output = output.decode("utf-8")
+                if ID is not None:
+                    output = ID + "\n" + output
+            return ID, output, int(num_pruned), True
+    fst, num_pruned = buildPromptFST(line, settings)
+    if settings["binary"]:
+        output = fst.inBinary(settings["isymbols"], settings["osymbols"])
+    else:
+        output = fst.inText(settings["isymbols"], settings["osymbols"])
+    if graph_cache is not None:
+        if settings["binary"]:
+            entry = output
+        elif fst.ID is not None:
+            entry = output[len(fst.ID)+1:].encode("utf-8")
+        else:
+            entry = output.encode("utf-8")
+        graph_cache.put(key, str(num_pruned).encode("utf-8") + b"\n" + entry)
+    return fst.ID, output, num_pruned, False
+
+## Weight sweeps: the arcs of a prompt do not depend on the weights (unless
+## jumps are pruned by probability), so for tuning the weights each prompt is
+## built once, with symbolic weights that record which weight each arc gets.
+## Then for each weight configuration only the weights are computed and normalised.
+
+class WeightTerm(object):
+    ## A relative weight in symbolic form:
+    ##   weights["LongJumpDecay"] ** decay_power * weights[key]
+    ## where key None means just the decay term. The dense recipes only combine
+    ## weights with ** and *, so they can be run with these instead of floats.
+    __slots__ = ("key", "decay_power")
+    def __init__(self, key, decay_power=0):
+        self.key = key
+        self.decay_power = decay_power
+
+    def __pow__(self, n):
+        if self.key is not None:
+            raise TypeError("Only the decay term can be raised to a power")
+        return WeightTerm(None, self.decay_power * n)
+
+    def __mul__(self, other):
+        if not isinstance(other, WeightTerm) or (self.key is not None and other.key is not None):
+            raise TypeError("Weight terms only multiply with the decay term")
+        return WeightTerm(self.key if self.key is not None else other.key,
+                self.decay_power + other.decay_power)
+
+    def __eq__(self, other):
+        return isinstance(other, WeightTerm) and (self.key, self.decay_power) == (other.key, other.decay_power)
+
+    def __hash__(self):
+        return hash((self.key, self.decay_power))
+
+    def __repr__(self):
+        return "WeightTerm(" + repr(self.key) + ", " + repr(self.decay_power) + ")"
+
+    def value(self, weights):
+        # Computed the same way as in the recipes, so the floats are exactly the same
+        if self.decay_power == 0:
+            return weights[self.key]
+        return weights["LongJumpDecay"] ** self.decay_power * weights[self.key]
+
+def weightTerms(weights):
+    """ The symbolic version of a weights dict """
+    return {key: WeightTerm(None, 1) if key == "LongJumpDecay" else WeightTerm(key)
+            for key in weights}
+
+def buildSweepTemplate(line, settings):
+    """ Builds the FST for one line of input with WeightTerms as the weights.
+    The settings are as in buildPromptFST, but the jump topology must be dense
+    and min_arc_prob None. Returns a SweepTemplate and the number of pruned jump arcs. """
+    if settings["jump_topology"] != "dense" or settings["min_arc_prob"] is not None:
+        raise ValueError("Weight sweeps need the dense jump topology and no --min-arc-prob")
+    ID, prompt_tokenised = splitPromptLine(line, settings["kaldi_style"])
+    template_settings = dict(settings, weights=weightTerms(settings["weights"]), compact=False)
+    fst, num_pruned = buildRelativeFST(ID, prompt_tokenised, settings["homophones"],
+            settings["truncations"], template_settings)
+    return SweepTemplate(fst), num_pruned
+
+class SweepTemplate(object):
+    ## The FST of a prompt built with WeightTerms, to be written with many weights dicts.
+    ## The terms are numbered once, and for the text format the labels are formatted
+    ## once, so each weights dict only costs normalising and formatting the weights.
+    def __init__(self, fst):
+        self.fst = fst
+        term_ids = {}
+        self.term_ids_by_state = [(state, [term_ids.setdefault(leaf.weight, len(term_ids)) for leaf in leaves])
+                for state, leaves in fst.states.items()]
+        self.terms = sorted(term_ids, key=term_ids.get)
+        self.text_prefixes = {}
+
+    def logWeights(self, weights):
+        # Yields each state and the normalised log weights of its leaves
+        values = [term.value(weights) for term in self.terms]
+        for state, term_ids in self.term_ids_by_state:
+            yield state, normalisedLogWeights(self.fst, state, [values[i] for i in term_ids])
+
+    def normalisedFST(self, weights):
+        # The same FST that buildFST makes with the weights dict
+        return self.fst.reweighted(dict(self.logWeights(weights)), self.fst.ID)
+
+    def textPrefixes(self, isymbols, osymbols):
+        # The lines of the text format, up to the weight, for each state
+        symbols_key = (id(isymbols), id(osymbols))
+        if symbols_key not in self.text_prefixes:
+            isymbols = isymbols if isymbols is not None else prompt_lmfst.Relabeling()
+            osymbols = osymbols if osymbols is not None else prompt_lmfst.Relabeling()
+            self.text_prefixes[symbols_key] = [[str(leaf.state) + " "
+                if isinstance(leaf, prompt_lmfst.FinalState) else
+                " ".join(map(str, (leaf.from_state, leaf.to_state,
+                    isymbols[leaf.in_label], osymbols[leaf.out_label]))) + " "
+                for leaf in self.fst.states[state]] for state, _ in self.term_ids_by_state]
+        return self.text_prefixes[symbols_key]
+
+    def text(self, weights, isymbols=None, osymbols=None):
+        # Same as normalisedFST(weights).inText(isymbols, osymbols)
+        parts = [self.fst.ID + "\n"] if self.fst.ID is not None else []
+        for (state, log_weights), prefixes in zip(self.logWeights(weights),
+                self.textPrefixes(isymbols, osymbols)):
+            parts.append("".join([prefix + str(weight) + "\n"
+                for prefix, weight in zip(prefixes, log_weights)]))
+        return "".join(parts)
+
+def readWeightConfigs(filepath, base_weights):
+    """ Reads a weight configuration from each line of the file, as a JSON object
+    of the weights to change, e.g. {"Correct": 500, "LongJumpDecay": 0.8}
+    Returns a list of weights dicts, each a copy of base_weights with the changes. """
+    import json
+    weight_configs = []
+    with open(filepath, encoding="utf-8") as fi:
+        for line in fi:
+            if not line.strip():
+                continue
+            changes = json.loads(line)
+            unknown = set(changes) - set(base_weights)
+            if unknown:
+                raise ValueError("Unknown weights in " + filepath + ": " + ", ".join(sorted(unknown)))
+            weights = dict(base_weights)
+            weights.update((key, float(value)) for key, value in changes.items())
+            weight_configs.append(weights)
+    return weight_configs
+
+## Multiprocessing: the settings are sent to each worker process once,
+## when it starts, instead of with every prompt.
+_worker_settings = None
+
+def _initWorker(settings):
+    global _worker_settings
+    _worker_settings = settings
+
+def _buildPromptOutput(line):
+    return promptOutput(line, _worker_settings)
+
 if __name__ == "__main__":
     import argparse
     import fileinput
+    import locale
+    locale.setlocale(locale.LC_ALL,'en_US.UTF-8')
     parser = argparse.ArgumentParser(description="""
             This script creates a reading miscue tolerant language model,
             which is suitable for decoding read prompts.
@@ -207,9 +810,98 @@ if __name__ == "__main__":
         """For kaldi style inputs, but may be useful otherwise as well.
         With this option, the first column in the input is treated as an id, 
         which should be output as is.""")
+    parser.add_argument('--compact', action='store_true', help=
+        """Store the FSTs in typed arrays instead of lists of tuples.
+        The output is the same, but uses much less memory for long prompts.""")
+    parser.add_argument('--lazy', action='store_true', help=
+        """Do not store the arcs: build and normalise each state only when it is
+        written. The memory needed is that of the largest state instead of the
+        whole FST, for very long prompts. The text output is the same; the binary
+        output is the same FST, with the states in the order they are built in
+        instead of renumbered like fstcompile.
+        Only for the dense jump topology, and not with --compact, --topology-cache
+        or --sweep. Without --jobs and --graph-cache the output is also written
+        state by state.""")
+    parser.add_argument('--jump-topology', choices=["dense", "hubs"], default="dense", help=
+        """How to build the multi-word jumps. dense adds an arc from each word to
+        each other word. hubs routes the jumps through a chain of epsilon states,
+        which keeps the FST linear in the prompt length for long prompts.""")
+    parser.add_argument('--max-jump-distance', type=int, help=
+        """Do not add jumps over more than this many words.
+        Only for the dense jump topology.""")
+    parser.add_argument('--min-arc-prob', type=float, help=
+        """Do not add jumps whose probability would be below this.
+        Only for the dense jump topology.""")
+    parser.add_argument('--words-table', help=
+        """Symbol table (e.g. lang/words.txt) to write the labels as integers with,
+        instead of piping the output through utils/sym2int.pl -f 3-4""")
+    parser.add_argument('--map-oov', help=
+        """With --words-table, the symbol (or integer) to write for labels
+        that are not in the table. By default that is an error, like in sym2int.pl""")
+    parser.add_argument('--eps-to-disambig', action='store_true', help=
+        """Write #0 instead of epsilon on the input side,
+        instead of piping the output through utils/eps2disambig.pl""")
+    parser.add_argument('--ark', help=
+        """Write the FSTs in the OpenFst binary format into this Kaldi archive,
+        keyed by the ID, instead of text into the standard output.
+        Needs --kaldi-style and --words-table""")
+    parser.add_argument('--scp', help=
+        """With --ark, also write a Kaldi script file of the archive entries""")
+    parser.add_argument('--fst-out', help=
+        """Write the FST in the OpenFst binary format into this file,
+        arc sorted like fstcompile | fstarcsort --sort_type=ilabel would.
+        The input must have just one prompt. Needs --words-table""")
+    parser.add_argument('--topology-cache', type=int, default=0, help=
+        """Keep the FSTs of up to this many prompt shapes (number of words,
+        homophones among them and truncations) as templates, and build prompts
+        of the same shape by substituting the labels. The output is the same.
+        With --jobs, each process has its own cache. Default 0, no cache.""")
+    parser.add_argument('--graph-cache', help=
+        """Directory of a persistent cache of the output FSTs, shared between runs.
+        Prompts that were built with the same weights, labels, homophones,
+        truncations and output options before are read from there.""")
+    parser.add_argument('--graph-cache-size', type=float, default=1024., help=
+        """Maximum size of the --graph-cache in megabytes. The least recently
+        used entries are removed after the run. Default 1024""")
+    parser.add_argument('--sweep', help=
+        """Weight sweep: file with a weight configuration on each line, as a JSON
+        object of the weights to change, e.g. {"Correct": 500, "Skip": 20}.
+        Each prompt is built once, and written with each configuration.
+        Needs --sweep-out, or --ark (and --scp) with CONFIG in the paths.""")
+    parser.add_argument('--sweep-out', help=
+        """With --sweep, where to write the text format FSTs of each weight configuration,
+        CONFIG is replaced by the line number of the configuration, e.g. G.CONFIG.txt""")
+    parser.add_argument('--jobs', type=int, default=1, help=
+        """Number of processes to build the FSTs with.
+        The output is in the same order as the input in any case.""")
     parser.add_argument("input", help="""Input as a filepath or - for stdin. 
         Prompts are read line by line.""") 
     args = parser.parse_args()
+    pruning = args.max_jump_distance is not None or args.min_arc_prob is not None
+    if pruning and args.jump_topology != "dense":
+        parser.error("--max-jump-distance and --min-arc-prob need --jump-topology dense")
+    if args.ark and not args.kaldi_style:
+        parser.error("--ark needs --kaldi-style, the IDs are the archive keys")
+    if args.scp and not args.ark:
+        parser.error("--scp needs --ark")
+    if args.ark and args.fst_out:
+        parser.error("Give only one of --ark and --fst-out")
+    if (args.ark or args.fst_out) and not args.words_table:
+        parser.error("--ark and --fst-out need --words-table")
+    if args.sweep_out and not args.sweep:
+        parser.error("--sweep-out needs --sweep")
+    if args.lazy and (args.jump_topology != "dense" or args.compact or args.topology_cache or args.sweep):
+        parser.error("--lazy needs --jump-topology dense, and does not go with --compact, --topology-cache or --sweep")
+    if args.sweep:
+        if args.jobs > 1 or args.graph_cache or args.topology_cache or args.fst_out:
+            parser.error("--sweep does not go with --jobs, --graph-cache, --topology-cache or --fst-out")
+        if args.jump_topology != "dense" or args.min_arc_prob is not None:
+            parser.error("--sweep needs --jump-topology dense and no --min-arc-prob")
+        sweep_patterns = [args.ark, args.scp] if args.ark else [args.sweep_out]
+        if any(pattern is not None and "CONFIG" not in pattern for pattern in sweep_patterns):
+            parser.error("With --sweep, the output paths must contain CONFIG")
+        if not args.ark and not args.sweep_out:
+            parser.error("--sweep needs --sweep-out or --ark")
     if args.rubbish_label:
         with open(args.rubbish_label) as fi:
             special_labels["Rubbish"] = fi.read().strip()
@@ -217,29 +909,133 @@ if __name__ == "__main__":
         with open(args.truncation_label) as fi:
             special_labels["Truncation"] = fi.read().strip()
     if args.correct_word_boost:
-        weights["Correct"] = weights["Correct"] * args.correct_boost 
-    if args.truncations:
-        truncated_words = readTruncations(args.truncations)
+        weights["Correct"] = weights["Correct"] * args.correct_word_boost
+    isymbols = osymbols = None
+    if args.words_table:
+        osymbols = prompt_lmfst.SymbolTable(args.words_table, map_oov=args.map_oov)
+        isymbols = osymbols
+    if args.eps_to_disambig:
+        #Like utils/eps2disambig.pl, only the input side is changed.
+        disambig = prompt_lmfst.Relabeling({special_labels["Epsilon"]: "#0"})
+        isymbols = disambig if isymbols is None else isymbols.relabelled(disambig)
+    truncated_words = readTruncations(args.truncations) if args.truncations else None
     homophones = prompt_lmfst.readHomophones(args.homophones)
+    settings = makeSettings(
+            homophones=homophones,
+            truncations=truncated_words,
+            kaldi_style=args.kaldi_style,
+            compact=args.compact,
+            lazy=args.lazy,
+            jump_topology=args.jump_topology,
+            max_jump_distance=args.max_jump_distance,
+            min_arc_prob=args.min_arc_prob,
+            isymbols=isymbols,
+            osymbols=osymbols,
+            binary=bool(args.ark or args.fst_out),
+            topology_cache=TopologyCache(args.topology_cache) if args.topology_cache > 0 else None)
+    if args.graph_cache:
+        settings["graph_cache"] = graph_cache.GraphCache(args.graph_cache,
+                int(args.graph_cache_size * 1024 * 1024))
+        #Everything the output depends on, besides the prompt itself:
+        settings["graph_cache_fingerprint"] = graph_cache.GraphCache.key(
+                graph_cache.FORMAT_VERSION, graph_cache.fileHash(__file__),
+                graph_cache.fileHash(prompt_lmfst.__file__), graph_cache.fileHash(graph_cache.__file__),
+                sorted(weights.items()), sorted(special_labels.items()),
+                graph_cache.fileHash(args.homophones), graph_cache.fileHash(args.truncations),
+                graph_cache.fileHash(args.words_table), args.map_oov, args.eps_to_disambig,
+                args.jump_topology, args.max_jump_distance, args.min_arc_prob,
+                settings["binary"], settings["binary"] and args.lazy)
 
-    #Process each line in input:
-    for line in fileinput.input(args.input):
-        if args.kaldi_style:
-            ID, *prompt_tokenised = line.strip().split()
-            fst = prompt_lmfst.PromptLMFST(homophones = homophones, ID=ID)
+    def reportPruned(ID, lineno, num_pruned):
+        if pruning:
+            print("Pruned", num_pruned, "jump arcs from prompt",
+                    ID if ID is not None else lineno,
+                    file=sys.stderr)
+
+    #Where the FSTs go:
+    if args.sweep:
+        #One output for each weight configuration:
+        weight_configs = readWeightConfigs(args.sweep, weights)
+        def sweepPaths(pattern):
+            if pattern is None:
+                return [None] * len(weight_configs)
+            return [pattern.replace("CONFIG", str(config)) for config in range(1, len(weight_configs)+1)]
+        if args.ark:
+            sweep_outputs = [prompt_lmfst.KaldiFstArchiveWriter(ark_path, scp_path)
+                    for ark_path, scp_path in zip(sweepPaths(args.ark), sweepPaths(args.scp))]
         else:
-            prompt_tokenised = line.strip().split()
-            fst = prompt_lmfst.PromptLMFST(homophones = homophones, ID=None)
-        fst.addWordSequence(prompt_tokenised)
-        addCorrectPaths(fst, weights)
-        addRubbishPaths(fst, weights, special_labels)
-        addSkipPaths(fst, weights)
-        addRepeatPaths(fst, weights)
-        addPrematureEnds(fst, weights)
-        addJumpsBackward(fst, weights)
-        addJumpsForward(fst, weights)
-        if args.truncations is not None:
-            addTruncations(fst, weights, special_labels, truncated_words)
-        convertRelativeProbs(fst)
-        print(fst.inText())
-        print() #Empty line means end of FST
+            sweep_outputs = [open(path, "w", encoding="utf-8") for path in sweepPaths(args.sweep_out)]
+    elif args.ark:
+        archive = prompt_lmfst.KaldiFstArchiveWriter(args.ark, args.scp)
+        def writeOutput(ID, lineno, output):
+            archive.write(ID, output)
+    elif args.fst_out:
+        def writeOutput(ID, lineno, output):
+            if lineno > 1:
+                raise ValueError("--fst-out takes just one prompt, got more")
+            with open(args.fst_out, "wb") as fo:
+                fo.write(output)
+    else:
+        def writeOutput(ID, lineno, output):
+            sys.stdout.write(output)
+            sys.stdout.write("\n\n") #Empty line means end of FST
+
+    #Process each line in input:
+    lines = fileinput.input(args.input)
+    if args.sweep:
+        for lineno, line in enumerate(lines, start=1):
+            template, num_pruned = buildSweepTemplate(line, settings)
+            reportPruned(template.fst.ID, lineno, num_pruned)
+            for sweep_weights, sweep_output in zip(weight_configs, sweep_outputs):
+                if args.ark:
+                    sweep_output.write(template.fst.ID, template.normalisedFST(sweep_weights).inBinary(
+                        settings["isymbols"], settings["osymbols"]))
+                else:
+                    sweep_output.write(template.text(sweep_weights, settings["isymbols"], settings["osymbols"]))
+                    sweep_output.write("\n\n") #Empty line means end of FST
+        for sweep_output in sweep_outputs:
+            sweep_output.close()
+    elif args.jobs > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(args.jobs, initializer=_initWorker, initargs=(settings,))
+        #imap keeps the input order, so the output archive is the same as with one job
+        results = pool.imap(_buildPromptOutput, lines, chunksize=4)
+        for lineno, (ID, output, num_pruned, cached) in enumerate(results, start=1):
+            reportPruned(ID, lineno, num_pruned)
+            writeOutput(ID, lineno, output)
+            if settings["graph_cache"] is not None:
+                #The workers have their own copies of the cache object, count here
+                if cached:
+                    settings["graph_cache"].hits += 1
+                else:
+                    settings["graph_cache"].misses += 1
+        pool.close()
+        pool.join()
+    elif settings["graph_cache"] is not None:
+        for lineno, line in enumerate(lines, start=1):
+            ID, output, num_pruned, cached = promptOutput(line, settings)
+            reportPruned(ID, lineno, num_pruned)
+            writeOutput(ID, lineno, output)
+    else:
+        for lineno, line in enumerate(lines, start=1):
+            fst, num_pruned = buildPromptFST(line, settings)
+            reportPruned(fst.ID, lineno, num_pruned)
+            if args.ark:
+                #Written straight into the archive, which for a LazyPromptLMFST is state by state
+                archive.writeFST(fst.ID, fst, settings["isymbols"], settings["osymbols"])
+            elif args.fst_out:
+                if lineno > 1:
+                    raise ValueError("--fst-out takes just one prompt, got more")
+                with open(args.fst_out, "wb") as fo:
+                    fst.writeBinary(fo, settings["isymbols"], settings["osymbols"])
+            else:
+                fst.write(sys.stdout, settings["isymbols"], settings["osymbols"])
+                sys.stdout.write("\n\n") #Empty line means end of FST
+    if args.jobs == 1 and settings["topology_cache"] is not None:
+        print("Topology cache:", settings["topology_cache"].hits, "hits,",
+                settings["topology_cache"].misses, "misses", file=sys.stderr)
+    if settings["graph_cache"] is not None:
+        settings["graph_cache"].evict()
+        settings["graph_cache"].report()
+    if args.ark and not args.sweep:
+        archive.close()
@@ -4,7 +4,17 @@
 # Licence: BSD-2-Clause
 
 from __future__ import print_function
-from collections import namedtuple, defaultdict
+from collections import namedtuple
+from array import array
+import copy
+import io
+import operator
+import struct
+import sys
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
 
 class Word(object):
     ## A word object is created for each word in the input prompt.
@@ -12,6 +22,7 @@ class Word(object):
     ## Here the label is the word (as written) or its corresponding integer
     ## (in case using integer-to-symbol tables)
     ## In general, labels are the input and output labels of an FST
+    __slots__ = ("label", "start", "final", "next_start", "prev_final")
     def __init__(self, label, start, final):
         self.label = label
         self.start = start
@@ -26,17 +37,226 @@ FinalState = namedtuple("FinalState", "state weight")
 # This function is just used to read the homophones file
 def readHomophones(filepath):
     # Reads a file where on each line, words are considered homophones
-    # Returns a defaultdict that will for any word return a set of its homophones
-    # To check if two words are homophones: word in homophones[other_word]
-    homophones = defaultdict(set)
+    # Returns HomophoneClasses, which will for any word return a set of its homophones
+    # To check if two words are homophones: homophones.sameClass(word, other_word)
     if filepath is None:
-        return homophones
+        return homophonesFromGroups([])
     with open(filepath, encoding='utf-8') as fi:
-        lines_split = (line.strip().split() for line in fi.readlines())
-        for line in lines_split:
-            for word in line:
-                homophones[word] = set(line) | homophones[word]
-    return homophones
+        return homophonesFromGroups(line.strip().split() for line in fi.readlines())
+
+def homophonesFromGroups(groups):
+    # Like readHomophones, but from an iterable of lists of words that are homophones,
+    # e.g. from getHomophones in kaldi-scripts/make_extended_lexicon.py
+    return HomophoneClasses(groups)
+
+class HomophoneClasses(object):
+    ## The homophones as disjoint sets: each word that has homophones (itself at least)
+    ## maps to a small integer class ID. Groups that share a word are merged,
+    ## so homophony is transitive. Built once with union-find, then read only.
+    ## Also works like the old dict of sets: word in homophones, homophones[word]
+    def __init__(self, groups=()):
+        parents = {}
+        def find(word):
+            # With path halving
+            while parents[word] != word:
+                parents[word] = parents[parents[word]]
+                word = parents[word]
+            return word
+        for group in groups:
+            group = list(group)
+            for word in group:
+                parents.setdefault(word, word)
+            for word in group[1:]:
+                root, other_root = find(group[0]), find(word)
+                if root != other_root:
+                    parents[other_root] = root
+        self.class_ids = {}
+        ids_by_root = {}
+        members = []
+        for word in parents:
+            root = find(word)
+            if root not in ids_by_root:
+                ids_by_root[root] = len(members)
+                members.append([])
+            self.class_ids[word] = ids_by_root[root]
+            members[ids_by_root[root]].append(word)
+        self.classes = [frozenset(words) for words in members] #class ID to its words
+
+    def classID(self, word):
+        # None for words without homophones
+        return self.class_ids.get(word)
+
+    def sameClass(self, word, other):
+        class_id = self.class_ids.get(word)
+        return class_id is not None and class_id == self.class_ids.get(other)
+
+    def groups(self):
+        return [list(words) for words in self.classes]
+
+    def relabelled(self, relabeling):
+        # The same classes, with the same IDs, for the relabelled words
+        homophones = HomophoneClasses()
+        homophones.classes = [frozenset(relabeling[word] for word in words) for words in self.classes]
+        homophones.class_ids = dict((relabeling[word], class_id) for word, class_id in self.class_ids.items())
+        return homophones
+
+    def __contains__(self, word):
+        return word in self.class_ids
+
+    def __getitem__(self, word):
+        if word not in self.class_ids:
+            return frozenset()
+        return self.classes[self.class_ids[word]]
+
+    def __len__(self):
+        return len(self.class_ids)
+
+## OpenFst binary format constants
+FST_MAGIC_NUMBER = 2125659606
+VECTOR_FST_VERSION = 2
+# The property bits fstcompile | fstarcsort can set, see OpenFst properties.h
+FST_EXPANDED = 0x1
+FST_MUTABLE = 0x2
+FST_ACCEPTOR = 0x10000
+FST_NOT_ACCEPTOR = 0x20000
+FST_I_DETERMINISTIC = 0x40000
+FST_O_DETERMINISTIC = 0x100000
+FST_EPSILONS = 0x400000
+FST_NO_EPSILONS = 0x800000
+FST_I_EPSILONS = 0x1000000
+FST_NO_I_EPSILONS = 0x2000000
+FST_O_EPSILONS = 0x4000000
+FST_NO_O_EPSILONS = 0x8000000
+FST_I_LABEL_SORTED = 0x10000000
+FST_O_LABEL_SORTED = 0x40000000
+FST_WEIGHTED = 0x100000000
+FST_UNWEIGHTED = 0x200000000
+FST_ACYCLIC = 0x800000000
+FST_INITIAL_ACYCLIC = 0x2000000000
+FST_TOP_SORTED = 0x4000000000
+FST_NOT_TOP_SORTED = 0x8000000000
+FST_UNWEIGHTED_CYCLES = 0x800000000000
+
+def isWeighted(weight):
+    # Whether the weight is neither One (0) nor Zero (infinity) of the
+    # tropical semiring, once it is stored as a float32.
+    if 1e-30 < abs(weight) < 1e30:
+        return True
+    weight = struct.unpack("<f", struct.pack("<f", weight))[0]
+    return weight != 0. and weight != float("inf")
+
+def writeBinaryString(fileobj, string):
+    # OpenFst writes strings as an int32 length followed by the bytes
+    encoded = string.encode("utf-8")
+    fileobj.write(struct.pack("<i", len(encoded)))
+    fileobj.write(encoded)
+
+class KaldiFstArchiveWriter(object):
+    ## Writes binary FSTs into a Kaldi archive, keyed by e.g. the prompt ID,
+    ## and optionally a script file with the offset of each entry.
+    ## Works like the Kaldi wspecifier ark,scp:<ark_path>,<scp_path>
+    def __init__(self, ark_path, scp_path=None):
+        self.ark_path = ark_path
+        self.ark = open(ark_path, "wb")
+        self.scp = open(scp_path, "w", encoding="utf-8") if scp_path is not None else None
+
+    def write(self, key, fst_bytes):
+        # fst_bytes is the output of PromptLMFST.inBinary
+        # Returns the offset of the entry, as in the script file.
+        if not key or len(key.split()) != 1:
+            raise ValueError("Invalid Kaldi archive key: " + repr(key))
+        self.ark.write(key.encode("utf-8") + b" ")
+        offset = self.ark.tell()
+        #Kaldi binary mode marker:
+        self.ark.write(b"\0B")
+        self.ark.write(fst_bytes)
+        self.writeScpEntry(key, offset)
+        return offset
+
+    def writeFST(self, key, fst, isymbols=None, osymbols=None):
+        # Like write(key, fst.inBinary(isymbols, osymbols)), but the FST is
+        # written straight into the archive, state by state.
+        if not key or len(key.split()) != 1:
+            raise ValueError("Invalid Kaldi archive key: " + repr(key))
+        self.ark.write(key.encode("utf-8") + b" ")
+        offset = self.ark.tell()
+        self.ark.write(b"\0B")
+        fst.writeBinary(self.ark, isymbols, osymbols)
+        self.writeScpEntry(key, offset)
+        return offset
+
+    def writeScpEntry(self, key, offset):
+        # Points key at an entry already written, e.g. another utterance of the same prompt.
+        # Only the script file has such keys.
+        if self.scp is not None:
+            self.scp.write(key + " " + self.ark_path + ":" + str(offset) + "\n")
+
+    def close(self):
+        self.ark.close()
+        if self.scp is not None:
+            self.scp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class Relabeling(dict):
+    ## Maps the labels in the dict to new labels, and any other label to itself.
+    def __missing__(self, label):
+        return label
+
+    def lookupQuietly(self, label):
+        # Like self[label]; see SymbolTable.lookupQuietly
+        return self[label]
+
+class SymbolTable(dict):
+    ## Maps labels to the integers of an OpenFst / Kaldi symbol table, like words.txt
+    ## A label that is not in the table is handled like in Kaldi's utils/sym2int.pl:
+    ## it is an error, unless map_oov is given, in which case the label is replaced
+    ## by map_oov (a symbol or an integer), with a warning for the first few.
+    max_warnings = 20
+
+    def __init__(self, filepath, map_oov=None):
+        super(SymbolTable, self).__init__()
+        with open(filepath, encoding='utf-8') as fi:
+            for line in fi:
+                linesplit = line.split()
+                if len(linesplit) != 2:
+                    raise ValueError("Bad line in symbol table " + filepath + ": " + line)
+                self[linesplit[0]] = int(linesplit[1])
+        if map_oov is not None and not str(map_oov).isdigit():
+            if map_oov not in self:
+                raise KeyError("OOV symbol " + map_oov + " not defined.")
+            map_oov = self[map_oov]
+        self.map_oov = None if map_oov is None else int(map_oov)
+        self.num_warnings = 0
+
+    def __missing__(self, label):
+        if self.map_oov is None:
+            raise KeyError("undefined symbol " + str(label))
+        if self.num_warnings < self.max_warnings:
+            print("Replacing", label, "with", self.map_oov, file=sys.stderr)
+        self.num_warnings += 1
+        return self.map_oov
+
+    def lookupQuietly(self, label):
+        # Like self[label], but an OOV does not use up a warning. For a second look
+        # at the labels, so each OOV in the output is counted once, like sym2int.pl does.
+        if label in self:
+            return dict.__getitem__(self, label)
+        if self.map_oov is None:
+            raise KeyError("undefined symbol " + str(label))
+        return self.map_oov
+
+    def relabelled(self, relabeling):
+        # Returns a copy where each label in relabeling maps to the integer of its new label.
+        table = copy.copy(self)
+        table.num_warnings = 0
+        for label, new_label in relabeling.items():
+            table[label] = self[new_label]
+        return table
 
 class PromptLMFST(object):
     ## Language model weighted finite state transducer
@@ -49,8 +269,14 @@ class PromptLMFST(object):
         self.states = {}
         self.state_counter = 0
         self.initialised = False
-        self.homophones = homophones #an empty set is an acceptable argument here.
-        self.labels_by_state = {}
+        if not isinstance(homophones, HomophoneClasses):
+            #E.g. a dict of sets, or an empty set:
+            homophones = HomophoneClasses(homophones.values() if hasattr(homophones, "values") else ())
+        self.homophones = homophones
+        # For each state, the homophone class IDs of the in_labels of its arcs.
+        # Kept up to date in addArc, so the homophone check does not rescan the state.
+        # Only states that have arcs with homophones are in the dict.
+        self.classes_by_state = {}
 
     def addNextWord(self, label):
         # Use this to add words one by one into the PromptLMFST from a prompt text
@@ -58,7 +284,7 @@ class PromptLMFST(object):
         # We would need a weight for that.
         if not self.initialised:
             #Note: the initial state becomes the value state_counter is initialised to.
-            self.states[self.state_counter] = []
+            self.initState(self.state_counter)
             self.words.append(Word(label, self.state_counter, self.newState()))
             self.initialised = True
         else:
@@ -75,18 +301,24 @@ class PromptLMFST(object):
     def newState(self):
         # Creates a new, unused state, with a unique number, returns that number
         self.state_counter += 1
-        self.states[self.state_counter] = []
+        self.initState(self.state_counter)
         return self.state_counter
 
+    def initState(self, state):
+        self.states[state] = []
+
     def homophoneArcExists(self, from_state, label):
         # Returns true if an arc already exists from the given state
         # with a label that is a homophone of the given label
-        labels_from_state = set(getattr(item, "in_label", None) for item in self.states[from_state])
-        return any(label in self.homophones[other_label] for other_label in labels_from_state)
+        class_id = self.homophones.classID(label)
+        return class_id is not None and class_id in self.classes_by_state.get(from_state, ())
 
     def addArc(self, from_state, to_state, in_label, out_label, weight):
         if not self.homophoneArcExists(from_state, in_label):
             self.states[from_state].append(Arc(from_state, to_state, in_label, out_label, weight))
+            class_id = self.homophones.classID(in_label)
+            if class_id is not None:
+                self.classes_by_state.setdefault(from_state, set()).add(class_id)
 
     def addFinalState(self, state, weight):
         self.states[state].append(FinalState(state, weight))
@@ -96,13 +328,173 @@ class PromptLMFST(object):
         for label in sequence:
             self.addNextWord(label)
 
-    def inText(self):
-        # Returns a text representation of the FST. Compatible with OpenFST text format.
-        result = "" if self.ID is None else self.ID + "\n"
+    def relabelled(self, relabeling, ID=None):
+        # Returns a copy of the FST with each label replaced by relabeling[label],
+        # with the given ID. The weights and states stay the same.
+        fst = self.__class__(self.homophones.relabelled(relabeling), ID)
+        fst.words = [Word(relabeling[word.label], word.start, word.final) for word in self.words]
+        fst.state_counter = self.state_counter
+        fst.initialised = self.initialised
+        fst.classes_by_state = dict((state, set(class_ids))
+                for state, class_ids in self.classes_by_state.items())
+        fst.states = {state: [Arc(leaf.from_state, leaf.to_state,
+            relabeling[leaf.in_label], relabeling[leaf.out_label], leaf.weight)
+            if isinstance(leaf, Arc) else leaf for leaf in leaves]
+            for state, leaves in self.states.items()}
+        return fst
+
+    def reweighted(self, new_weights, ID=None):
+        # Returns a copy of the FST with the given ID, where the weights of each
+        # state are replaced by new_weights[state], a list in the order of the leaves.
+        # The labels and states stay the same.
+        fst = self.__class__(self.homophones, ID)
+        fst.words = self.words
+        fst.state_counter = self.state_counter
+        fst.initialised = self.initialised
+        fst.classes_by_state = self.classes_by_state
+        fst.states = {state: [type(leaf)._make(leaf[:-1] + (weight,))
+            for leaf, weight in zip(leaves, new_weights[state])]
+            for state, leaves in self.states.items()}
+        return fst
+
+    def write(self, fileobj, isymbols=None, osymbols=None):
+        # Writes the FST into fileobj in the OpenFST text format.
+        # The lines are formatted and written one state at a time,
+        # so the whole text is never held in memory.
+        # If isymbols or osymbols is given, the input or output labels are
+        # written as isymbols[label] or osymbols[label], e.g. with a SymbolTable.
+        if self.ID is not None:
+            fileobj.write(self.ID + "\n")
+        if isymbols is None and osymbols is None:
+            for state in self.states.values():
+                #leaf is an Arc or a FinalState
+                fileobj.write("".join(" ".join(map(str, leaf)) + "\n" for leaf in state))
+            return
+        isymbols = isymbols if isymbols is not None else Relabeling()
+        osymbols = osymbols if osymbols is not None else Relabeling()
         for state in self.states.values():
-            for leaf in state: #leaf is an Arc or a FinalState
-                result += " ".join(map(str, leaf)) + "\n"
-        return result
+            lines = []
+            for leaf in state:
+                if isinstance(leaf, FinalState):
+                    lines.append(" ".join(map(str, leaf)) + "\n")
+                else:
+                    lines.append(" ".join(map(str, (leaf.from_state, leaf.to_state,
+                        isymbols[leaf.in_label], osymbols[leaf.out_label], leaf.weight))) + "\n")
+            fileobj.write("".join(lines))
+
+    def inText(self, isymbols=None, osymbols=None):
+        # Returns a text representation of the FST. Compatible with OpenFST text format.
+        result = io.StringIO()
+        self.write(result, isymbols, osymbols)
+        return result.getvalue()
+
+    def compiledStateOrder(self, isymbols, osymbols):
+        """ Returns a dict of each state to the number fstcompile gives it, in that order,
+        which is the order they first appear in in the text format (see write), and the properties
+        that fstcompile | fstarcsort --sort_type=ilabel works out for the FST.
+        fstcompile updates the properties as it adds each arc and final weight,
+        like OpenFst properties.cc AddArcProperties and SetFinalProperties do. """
+        numbering = {}
+        label_pairs = set()
+        weighted, unweighted = False, True
+        top_sorted = True
+        in_label_of, out_label_of = operator.attrgetter("in_label"), operator.attrgetter("out_label")
+        for state in self.states:
+            leaves = self.states[state]
+            if not leaves:
+                continue
+            from_num = numbering.setdefault(state, len(numbering))
+            arcs = [leaf for leaf in leaves if isinstance(leaf, Arc)]
+            to_states = [arc.to_state for arc in arcs]
+            for to_state in dict.fromkeys(to_states):
+                if to_state not in numbering:
+                    numbering[to_state] = len(numbering)
+            label_pairs.update(zip(map(in_label_of, arcs), map(out_label_of, arcs)))
+            if top_sorted and any(numbering[to_state] <= from_num for to_state in to_states):
+                top_sorted = False
+            if len(leaves) - len(arcs) < 2:
+                if not weighted and any(isWeighted(leaf.weight) for leaf in leaves):
+                    weighted, unweighted = True, False
+                continue
+            #Setting a weighted final weight again can make the FST unweighted, so these go in order
+            final_weight = float("inf")
+            for leaf in leaves:
+                if isinstance(leaf, FinalState):
+                    if isWeighted(final_weight):
+                        weighted = False
+                    final_weight = leaf.weight
+                if isWeighted(leaf.weight):
+                    weighted, unweighted = True, False
+        #writeBinary looks the labels up again, so OOVs are warned about there
+        label_pairs = set((int(isymbols.lookupQuietly(in_label)), int(osymbols.lookupQuietly(out_label)))
+                for in_label, out_label in label_pairs)
+        properties = FST_EXPANDED | FST_MUTABLE | FST_I_LABEL_SORTED
+        if all(in_label == out_label for in_label, out_label in label_pairs):
+            properties |= FST_ACCEPTOR | FST_O_LABEL_SORTED
+        else:
+            properties |= FST_NOT_ACCEPTOR
+        properties |= FST_EPSILONS if (0, 0) in label_pairs else FST_NO_EPSILONS
+        properties |= FST_I_EPSILONS if any(in_label == 0 for in_label, _ in label_pairs) else FST_NO_I_EPSILONS
+        properties |= FST_O_EPSILONS if any(out_label == 0 for _, out_label in label_pairs) else FST_NO_O_EPSILONS
+        properties |= FST_WEIGHTED if weighted else 0
+        properties |= FST_UNWEIGHTED if unweighted else 0
+        if top_sorted:
+            properties |= FST_TOP_SORTED | FST_ACYCLIC | FST_INITIAL_ACYCLIC
+        else:
+            properties |= FST_NOT_TOP_SORTED
+        if not label_pairs:
+            #These are known for an FST without arcs, and only adding an arc clears them
+            properties |= FST_I_DETERMINISTIC | FST_O_DETERMINISTIC | FST_UNWEIGHTED_CYCLES
+        return numbering, properties
+
+    def binaryStateOrder(self, isymbols, osymbols):
+        # Returns the numbering of the states, in the order writeBinary writes them,
+        # and the properties it writes: like fstcompile, see compiledStateOrder.
+        return self.compiledStateOrder(isymbols, osymbols)
+
+    def writeBinary(self, fileobj, isymbols=None, osymbols=None):
+        # Writes the FST into fileobj (opened in binary mode) in the OpenFst binary
+        # format, as a VectorFst with standard arcs and the arcs sorted by input label.
+        # That is what fstcompile | fstarcsort --sort_type=ilabel would write:
+        # the states are renumbered like fstcompile does, see binaryStateOrder,
+        # and arcs with the same input and output label stay in order, like
+        # std::stable_sort keeps them in OpenFst 1.8.4. OpenFst versions that sort
+        # with std::sort can order those differently in states with more than 16 arcs.
+        # The labels are written as isymbols[label] and osymbols[label], or as is,
+        # so without symbol tables they must already be integers.
+        # The ID is not written; see KaldiFstArchiveWriter for keyed output.
+        isymbols = isymbols if isymbols is not None else Relabeling()
+        osymbols = osymbols if osymbols is not None else Relabeling()
+        numbering, properties = self.binaryStateOrder(isymbols, osymbols)
+        num_states = len(numbering)
+        fileobj.write(struct.pack("<i", FST_MAGIC_NUMBER))
+        writeBinaryString(fileobj, "vector")
+        writeBinaryString(fileobj, "standard")
+        #version, flags, properties, start state, number of states, number of arcs (unknown)
+        fileobj.write(struct.pack("<iiQqqq", VECTOR_FST_VERSION, 0, properties,
+            0 if num_states else -1, num_states, 0))
+        pack_arc = struct.Struct("<iifi").pack
+        by_in_label, by_out_label = operator.itemgetter(0), operator.itemgetter(1)
+        for state in numbering:
+            leaves = self.states[state]
+            arcs = [(int(isymbols[leaf.in_label]), int(osymbols[leaf.out_label]), leaf.weight, numbering[leaf.to_state])
+                    for leaf in leaves if isinstance(leaf, Arc)]
+            final_weight = float("inf") #the tropical semiring zero, i.e. not final
+            if len(arcs) < len(leaves):
+                #The last final weight counts, like in fstcompile
+                final_weight = [leaf.weight for leaf in leaves if isinstance(leaf, FinalState)][-1]
+            #Like ILabelCompare, by the input label and then the output label
+            #(the sorts are stable, and two are faster than sorting by a tuple)
+            arcs.sort(key=by_out_label)
+            arcs.sort(key=by_in_label)
+            fileobj.write(struct.pack("<fq", final_weight, len(arcs)))
+            fileobj.write(b"".join(pack_arc(*arc) for arc in arcs))
+
+    def inBinary(self, isymbols=None, osymbols=None):
+        # Returns the OpenFst binary representation of the FST as bytes.
+        result = io.BytesIO()
+        self.writeBinary(result, isymbols, osymbols)
+        return result.getvalue()
 
     def isDeterministic(self):
         # Checks if the FST is deterministic, i.e. no state has multiple
@@ -117,3 +509,120 @@ class PromptLMFST(object):
                     seen_labels[item.in_label] = True
         return True
 
+class CompactStates(MutableMapping):
+    ## A view of the arrays in a CompactPromptLMFST that looks like
+    ## PromptLMFST.states, i.e. maps state numbers to lists of Arcs and FinalStates.
+    ## The lists are built on demand, one state at a time.
+    ## Assigning a list back only updates the weights; the arcs must stay the same.
+    def __init__(self, fst):
+        self.fst = fst
+
+    def __getitem__(self, state):
+        to_states, in_labels, out_labels, weights = self.fst.arrays_by_state[state]
+        labels = self.fst.labels
+        leaves = []
+        for to_state, in_label, out_label, weight in zip(to_states, in_labels, out_labels, weights):
+            if to_state < 0:
+                leaves.append(FinalState(state, weight))
+            else:
+                leaves.append(Arc(state, to_state, labels[in_label], labels[out_label], weight))
+        return leaves
+
+    def __setitem__(self, state, leaves):
+        weights = self.fst.arrays_by_state[state][3]
+        if len(leaves) != len(weights):
+            raise ValueError("Only the weights of a compact state can be changed")
+        weights[:] = array("d", (leaf.weight for leaf in leaves))
+
+    def __delitem__(self, state):
+        raise TypeError("States of a CompactPromptLMFST cannot be deleted")
+
+    def __iter__(self):
+        return iter(self.fst.arrays_by_state)
+
+    def __len__(self):
+        return len(self.fst.arrays_by_state)
+
+class CompactPromptLMFST(PromptLMFST):
+    ## The same FST as PromptLMFST, but each state keeps its arcs in
+    ## parallel typed arrays (to_state, in_label, out_label, weight) instead of
+    ## a list of namedtuples. Labels are interned as integers into self.labels.
+    ## Final weights are stored as arcs with the to_state -1.
+    ## The states attribute is a CompactStates view, so the recipes that read
+    ## or normalise p_fst.states work unchanged.
+
+    def __init__(self, homophones, ID=None):
+        self.arrays_by_state = {}
+        self.labels = [] #integer to label
+        self.label_ids = {} #label to integer
+        super(CompactPromptLMFST, self).__init__(homophones, ID)
+        self.states = CompactStates(self)
+
+    def initState(self, state):
+        self.arrays_by_state[state] = (array("i"), array("i"), array("i"), array("d"))
+
+    def labelID(self, label):
+        try:
+            return self.label_ids[label]
+        except KeyError:
+            self.label_ids[label] = len(self.labels)
+            self.labels.append(label)
+            return self.label_ids[label]
+
+    def addArc(self, from_state, to_state, in_label, out_label, weight):
+        if not self.homophoneArcExists(from_state, in_label):
+            to_states, in_labels, out_labels, weights = self.arrays_by_state[from_state]
+            to_states.append(to_state)
+            in_labels.append(self.labelID(in_label))
+            out_labels.append(self.labelID(out_label))
+            weights.append(weight)
+            class_id = self.homophones.classID(in_label)
+            if class_id is not None:
+                self.classes_by_state.setdefault(from_state, set()).add(class_id)
+
+    def addFinalState(self, state, weight):
+        to_states, in_labels, out_labels, weights = self.arrays_by_state[state]
+        to_states.append(-1)
+        in_labels.append(-1)
+        out_labels.append(-1)
+        weights.append(weight)
+
+    def relabelled(self, relabeling, ID=None):
+        # Like PromptLMFST.relabelled, but only the label table is replaced:
+        # the copy shares the arc arrays with this FST, so neither should be changed after.
+        fst = self.__class__(self.homophones.relabelled(relabeling), ID)
+        fst.words = [Word(relabeling[word.label], word.start, word.final) for word in self.words]
+        fst.state_counter = self.state_counter
+        fst.initialised = self.initialised
+        fst.classes_by_state = self.classes_by_state
+        fst.arrays_by_state = self.arrays_by_state
+        fst.labels = [relabeling[label] for label in self.labels]
+        for label_id, label in enumerate(fst.labels):
+            fst.label_ids.setdefault(label, label_id)
+        return fst
+
+    def write(self, fileobj, isymbols=None, osymbols=None):
+        # Same output as PromptLMFST.write, formatted straight from the arrays.
+        if self.ID is not None:
+            fileobj.write(self.ID + "\n")
+        # Only the labels that are used on each side are looked up in the symbol tables.
+        isymbols = isymbols if isymbols is not None else Relabeling()
+        osymbols = osymbols if osymbols is not None else Relabeling()
+        in_ids, out_ids = set(), set()
+        for to_states, in_labels, out_labels, weights in self.arrays_by_state.values():
+            in_ids.update(in_labels)
+            out_ids.update(out_labels)
+        in_ids.discard(-1)
+        out_ids.discard(-1)
+        in_texts = {label_id: str(isymbols[self.labels[label_id]]) for label_id in in_ids}
+        out_texts = {label_id: str(osymbols[self.labels[label_id]]) for label_id in out_ids}
+        for state, (to_states, in_labels, out_labels, weights) in self.arrays_by_state.items():
+            state_str = str(state)
+            lines = []
+            for to_state, in_label, out_label, weight in zip(to_states, in_labels, out_labels, weights):
+                if to_state < 0:
+                    lines.append(state_str + " " + str(weight) + "\n")
+                else:
+                    lines.append(" ".join((state_str, str(to_state),
+                        in_texts[in_label], out_texts[out_label], str(weight))) + "\n")
+            fileobj.write("".join(lines))
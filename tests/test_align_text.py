@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# Checks the banded alignment against the full edit distance table, and that
+# scoring the annotated texts directly gives the same tally as scoring their alignment.
+import sys
+import os.path
+import random
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "annotation-scripts"))
+import align_text
+import compute_far_frr
+
+def fullAlignment(ref, hyp, eps="<eps>"):
+    e = [[i + j if i == 0 or j == 0 else 0 for j in range(len(hyp) + 1)] for i in range(len(ref) + 1)]
+    for i in range(1, len(ref) + 1):
+        for j in range(1, len(hyp) + 1):
+            e[i][j] = min(e[i-1][j-1] + (ref[i-1] != hyp[j-1]), e[i-1][j] + 1, e[i][j-1] + 1)
+    alignment = []
+    i, j = len(ref), len(hyp)
+    while i > 0 or j > 0:
+        if i > 0 and j > 0 and e[i][j] == e[i-1][j-1] + (ref[i-1] != hyp[j-1]):
+            alignment.append((ref[i-1], hyp[j-1]))
+            i, j = i - 1, j - 1
+        elif i > 0 and e[i][j] == e[i-1][j] + 1:
+            alignment.append((ref[i-1], eps))
+            i -= 1
+        else:
+            alignment.append((eps, hyp[j-1]))
+            j -= 1
+    return alignment[::-1], e[len(ref)][len(hyp)]
+
+def test_alignment():
+    assert align_text.levenshteinAlignment(["a", "a"], ["a"]) == ([("a", "<eps>"), ("a", "a")], 1)
+    rng = random.Random(0)
+    for _ in range(1000):
+        ref = [rng.choice("abc") for _ in range(rng.randint(0, 30))]
+        if rng.random() < 0.5:
+            hyp = [rng.choice("abc") for _ in range(rng.randint(0, 30))]
+        else:
+            hyp = [word if rng.random() < 0.8 else rng.choice("abcd") for word in ref]
+        assert align_text.levenshteinAlignment(ref, hyp) == fullAlignment(ref, hyp)
+
+def test_attach_labels():
+    assert align_text.attachLabels("[CORRECT] the [SKIP] cat <SPOKEN_NOISE> [REP] cat".split()) == \
+            ["[CORRECT]the", "[SKIP]cat", "<SPOKEN_NOISE>", "[REP]cat"]
+
+def test_score_texts(tmp_path):
+    (tmp_path / "ref.txt").write_text("u1 [CORRECT] the [SKIP] cat [CORRECT] sat\n"
+            "u2 [CORRECT] a [REP] a [CORRECT] b\n")
+    (tmp_path / "hyp.txt").write_text("u1 [CORRECT] the [CORRECT] cat [CORRECT] sat\n"
+            "u2 [CORRECT] a [CORRECT] b\nu3 [CORRECT] c\n")
+    refs = align_text.readTexts(str(tmp_path / "ref.txt"), attach_labels=True)
+    hyps = align_text.readTexts(str(tmp_path / "hyp.txt"), attach_labels=True)
+    with open(str(tmp_path / "align.txt"), "w") as fo:
+        for uttid in ["u1", "u2"]:
+            alignment, _ = align_text.levenshteinAlignment(refs[uttid], hyps[uttid])
+            fo.write(align_text.formatAlignment(uttid, alignment) + "\n")
+    tally = compute_far_frr.scoreFiles([str(tmp_path / "hyp.txt")], refs=refs)
+    assert tally == compute_far_frr.scoreFiles([str(tmp_path / "align.txt")])
+    assert tally[(None, "[SKIP]", "false_accept")] == 1 and tally[(None, "[REP]", "missed")] == 1
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+# Checks the in-process annotation: the directly built graph equals the annotation
+# FST, and the best paths for some readings.
+import sys
+import os.path
+import random
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "annotation-scripts"))
+import annotate_miscues
+import prompt_lmfst
+
+def test_build():
+    rng = random.Random(0)
+    homophones = prompt_lmfst.homophonesFromGroups([["a", "b"], ["c"]])
+    truncations = set(["[TRUNC]:a", "[TRUNC]:c"])
+    for _ in range(200):
+        prompt = [rng.choice("abcdef") for _ in range(rng.randint(1, 8))]
+        fst = annotate_miscues.annotation.buildAnnotationFST(prompt, homophones, truncations)
+        graph = annotate_miscues.AnnotationGraph.fromFST(fst, "<eps>")
+        built = annotate_miscues.AnnotationGraph.build(prompt, homophones, truncations)
+        assert (graph.start, graph.arcs, graph.epsilon_arcs, graph.finals) == \
+                (built.start, built.arcs, built.epsilon_arcs, built.finals)
+
+def test_annotate():
+    annotator = annotate_miscues.MiscueAnnotator(prompt_lmfst.homophonesFromGroups([]))
+    prompt = "the cat sat on the mat".split()
+    assert annotator.annotate(prompt, prompt) == \
+            "[CORRECT] the [CORRECT] cat [CORRECT] sat [CORRECT] on [CORRECT] the [CORRECT] mat".split()
+    assert annotator.annotate(prompt, "the sat on on the [RUB] mat".split()) == \
+            ("[CORRECT] the [SKIP] cat [CORRECT] sat [CORRECT] on [REP] on [CORRECT] the "
+            "[RUB] [CORRECT] mat").split()
+    assert annotator.annotate(prompt, "dog".split()) is None
+    jobs = [("u1", prompt, "the cat".split()), ("u2", prompt, "the mat".split())]
+    assert list(annotate_miscues.annotateAll(jobs, prompt_lmfst.homophonesFromGroups([]), num_jobs=2)) == \
+            list(annotate_miscues.annotateAll(jobs, prompt_lmfst.homophonesFromGroups([])))
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+# Checks the batch mode of make_miscue_annotation_transducer.py: each utterance
+# can be read from the archive by seeking to its offset in the script file,
+# and utterances of the same prompt share the entry.
+import sys
+import os.path
+import subprocess
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "annotation-scripts"))
+import prompt_lmfst
+import make_miscue_annotation_transducer as annotation
+from test_binary_fst import readBinaryFst
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..",
+        "annotation-scripts", "make_miscue_annotation_transducer.py")
+
+def test_archive(tmp_path):
+    labels = ["<eps>", "the", "cat", "sat", "[RUB]", "[CORRECT]", "[REP]", "[SKIP]", "[JUMP]"]
+    (tmp_path / "words.txt").write_text("".join("%s %d\n" % (label, i) for i, label in enumerate(labels)))
+    reftext = "u1 the cat sat\nu2 the cat\nu3 the cat sat\n"
+    ark, scp = str(tmp_path / "keys.ark"), str(tmp_path / "keys.scp")
+    subprocess.run([sys.executable, SCRIPT, "--words-table", str(tmp_path / "words.txt"),
+        "--ark", ark, "--scp", scp], input=reftext.encode("utf-8"), check=True)
+    symbols = prompt_lmfst.SymbolTable(str(tmp_path / "words.txt"))
+    homophones = prompt_lmfst.readHomophones(None)
+    with open(scp, encoding="utf-8") as fi:
+        entries = [line.split() for line in fi]
+    assert [uttid for uttid, _ in entries] == ["u1", "u2", "u3"]
+    # u3 reads the same prompt as u1, so they share the entry:
+    assert entries[2][1] == entries[0][1] != entries[1][1]
+    with open(ark, "rb") as fi:
+        for (uttid, entry), line in zip(entries[:2], reftext.splitlines()):
+            ark_path, offset = entry.rsplit(":", 1)
+            assert ark_path == ark
+            fi.seek(int(offset) - len(uttid) - 1)
+            assert fi.read(len(uttid) + 3) == uttid.encode("utf-8") + b" \0B"
+            expected = annotation.buildAnnotationFST(line.split()[1:], homophones).inBinary(symbols, symbols)
+            readBinaryFst(fi)
+            assert fi.tell() == int(offset) + 2 + len(expected)
+            fi.seek(int(offset) + 2)
+            assert fi.read(len(expected)) == expected
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# Tests for the OpenFst binary writer: reads the binary back with a minimal
+# parser and compares it to the text format output, and compares the bytes to
+# references made with OpenFst (1.8.4) from the text format output:
+#   echo "the cat and the dog" | ./make_miscue_tolerant_lms.py - |\
+#     fstcompile --isymbols=tests/words_table.txt --osymbols=tests/words_table.txt |\
+#     fstarcsort --sort_type=ilabel > tests/fstcompile_the_cat_and_the_dog.fst
+# and the same through utils/eps2disambig.pl for fstcompile_the_cat_and_the_dog_disambig.fst,
+# and for "the cat and the dog" four times over for fstcompile_the_cat_and_the_dog_x4.fst,
+# which has states with more than 16 arcs, some with the same labels. OpenFst 1.8.4
+# sorts those with std::stable_sort; versions that use std::sort can order them differently.
+# See test_binary_fst.sh for the same comparison with OpenFst installed.
+import sys
+import os.path
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import io
+import struct
+import prompt_lmfst
+import make_miscue_tolerant_lms as mtlm
+
+def readBinaryString(fi):
+    length, = struct.unpack("<i", fi.read(4))
+    return fi.read(length).decode("utf-8")
+
+def readBinaryFst(fi):
+    # Returns the header fields and a list of (final_weight, arcs) for each state
+    magic, = struct.unpack("<i", fi.read(4))
+    fsttype = readBinaryString(fi)
+    arctype = readBinaryString(fi)
+    version, flags, properties, start, num_states, num_arcs = struct.unpack("<iiQqqq", fi.read(40))
+    states = []
+    for _ in range(num_states):
+        final_weight, num_state_arcs = struct.unpack("<fq", fi.read(12))
+        arcs = [struct.unpack("<iifi", fi.read(16)) for _ in range(num_state_arcs)]
+        states.append((final_weight, arcs))
+    header = (magic, fsttype, arctype, version, flags, start)
+    return header, states
+
+def buildFST(prompt, ID=None, compact=False):
+    line = prompt if ID is None else ID + " " + prompt
+    return mtlm.buildPromptFST(line, mtlm.makeSettings(kaldi_style=ID is not None, compact=compact))[0]
+
+def textStates(fst, symbols):
+    # The text format FST as the readBinaryFst states, with float32 weights.
+    # The states are numbered like fstcompile numbers them, in the order they first appear.
+    numbering = {}
+    def number(state):
+        return numbering.setdefault(state, len(numbering))
+    states = [(float("inf"), []) for _ in fst.states]
+    lines = fst.inText(symbols, symbols).splitlines()
+    if fst.ID is not None:
+        lines = lines[1:]
+    for line in lines:
+        fields = line.split()
+        from_state = number(fields[0])
+        if len(fields) == 2:
+            states[from_state] = (struct.unpack("<f", struct.pack("<f", float(fields[1])))[0],
+                    states[from_state][1])
+        else:
+            weight = struct.unpack("<f", struct.pack("<f", float(fields[4])))[0]
+            states[from_state][1].append((int(fields[2]), int(fields[3]), weight, number(fields[1])))
+    return [(final, sorted(arcs, key=lambda arc: arc[:2])) for final, arcs in states[:len(numbering)]]
+
+SYMBOLS = prompt_lmfst.Relabeling({"<eps>": 0, "[RUB]": 1, "[TRUNC]:": 2,
+    "the": 3, "cat": 4, "sat": 5, "on": 6, "mat": 7})
+
+def test_round_trip():
+    for compact in (False, True):
+        fst = buildFST("the cat sat on the mat", compact=compact)
+        header, states = readBinaryFst(io.BytesIO(fst.inBinary(SYMBOLS, SYMBOLS)))
+        assert header == (prompt_lmfst.FST_MAGIC_NUMBER, "vector", "standard", 2, 0, 0)
+        assert states == textStates(fst, SYMBOLS)
+
+def test_fstcompile_reference():
+    tests_dir = os.path.dirname(os.path.abspath(__file__))
+    symbols = prompt_lmfst.SymbolTable(os.path.join(tests_dir, "words_table.txt"))
+    disambig = symbols.relabelled(prompt_lmfst.Relabeling({"<eps>": "#0"}))
+    fst = buildFST("the cat and the dog")
+    for isymbols, reference in ((symbols, "fstcompile_the_cat_and_the_dog.fst"),
+            (disambig, "fstcompile_the_cat_and_the_dog_disambig.fst")):
+        with open(os.path.join(tests_dir, reference), "rb") as fi:
+            assert fst.inBinary(isymbols, symbols) == fi.read()
+    long_fst = buildFST(" ".join(["the cat and the dog"] * 4))
+    states = readBinaryFst(io.BytesIO(long_fst.inBinary(symbols, symbols)))[1]
+    assert any(len(arcs) > 16 and len(set(arc[:2] for arc in arcs)) < len(arcs) for _, arcs in states)
+    with open(os.path.join(tests_dir, "fstcompile_the_cat_and_the_dog_x4.fst"), "rb") as fi:
+        assert long_fst.inBinary(symbols, symbols) == fi.read()
+
+def test_kaldi_archive(tmp_path):
+    ark = str(tmp_path / "G.ark")
+    scp = str(tmp_path / "G.scp")
+    fsts = [buildFST("the cat", "p1"), buildFST("the mat", "p2")]
+    with prompt_lmfst.KaldiFstArchiveWriter(ark, scp) as writer:
+        for fst in fsts:
+            writer.write(fst.ID, fst.inBinary(SYMBOLS, SYMBOLS))
+    with open(scp) as fi, open(ark, "rb") as arkfile:
+        for fst, line in zip(fsts, fi):
+            key, location = line.split()
+            path, offset = location.rsplit(":", 1)
+            assert key == fst.ID and path == ark
+            arkfile.seek(int(offset))
+            assert arkfile.read(2) == b"\0B"
+            assert readBinaryFst(arkfile)[1] == textStates(fst, SYMBOLS)
@@ -0,0 +1,29 @@
+#!/bin/bash
+# Test the OpenFst binary output of make_miscue_tolerant_lms.py against
+# the reference made with fstcompile | fstarcsort.
+# Requires openfst.
+
+set -eu
+set -o pipefail
+
+test_string="the cat and the dog"
+sym_table="tests/words_table.txt"
+outname=tests/$(echo $test_string | sed -r "s/ /_/g")
+
+echo "Testing make_miscue_tolerant_lms.py --fst-out"
+echo "Test string: $test_string"
+echo
+
+echo $test_string | ./make_miscue_tolerant_lms.py - |\
+    fstcompile --isymbols=$sym_table --osymbols=$sym_table |\
+    fstarcsort --sort_type=ilabel > ${outname}.ref.fst
+echo $test_string | ./make_miscue_tolerant_lms.py --words-table $sym_table \
+    --fst-out ${outname}.fst -
+
+fstequal ${outname}.ref.fst ${outname}.fst
+diff <(fstprint ${outname}.ref.fst) <(fstprint ${outname}.fst)
+
+# Remove tempfiles:
+rm ${outname}.ref.fst ${outname}.fst
+
+echo "The binary output matches fstcompile | fstarcsort"
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+# Checks the outcomes of aligned pairs, and that scoring the alignment files in
+# chunks, in parallel, gives the same tallies as scoring them whole.
+import sys
+import os.path
+import random
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "annotation-scripts"))
+import compute_far_frr
+
+ALIGNMENT = """utt1 [CORRECT]the [CORRECT]the ; [SKIP]cat <eps> ; [CORRECT]sat [REP]sat
+utt2 [CORRECT]a [JUMP]a ; <eps> [REP]a ; [REP]b [CORRECT]b ; [JUMP]c [SKIP]c
+"""
+
+def test_outcomes(tmp_path):
+    (tmp_path / "align.txt").write_text(ALIGNMENT)
+    result = compute_far_frr.summary(compute_far_frr.scoreFiles([str(tmp_path / "align.txt")]))
+    assert result["overall"]["counts"] == {"correctcorrect": 2, "correctmiscue": 0, "missed": 0,
+            "false_reject": 1, "hallucinated": 1, "wrong_miscue": 1, "false_accept": 1}
+    assert result["overall"]["far"] == 0.5 and result["overall"]["frr"] == 1 / 3
+    assert result["labels"]["[REP]"]["counts"]["hallucinated"] == 1
+    assert result["labels"]["[CORRECT]"]["far"] is None and result["labels"]["[JUMP]"]["far"] == 0
+    assert "buckets" not in result
+    result = compute_far_frr.summary(compute_far_frr.scoreFiles([str(tmp_path / "align.txt")],
+            utt2bucket={"utt1": "book1"}))
+    assert list(result["buckets"]) == ["<unbucketed>", "book1"]
+    assert result["buckets"]["<unbucketed>"]["counts"]["hallucinated"] == 1
+
+def test_chunks(tmp_path):
+    rng = random.Random(0)
+    tokens = ["[CORRECT]a", "[CORRECT]b", "[REP]a", "[SKIP]b", "[JUMP]a", "<eps>"]
+    for shard in range(2):
+        with open(str(tmp_path / ("align.%d.txt" % shard)), "w") as fo:
+            for i in range(300):
+                pairs = [(rng.choice(tokens), rng.choice(tokens)) for _ in range(rng.randint(1, 12))]
+                fo.write("utt%d.%d " % (shard, i) + " ; ".join(ref + " " + hyp for ref, hyp in pairs) + "\n")
+    filepaths = [str(tmp_path / "align.0.txt"), str(tmp_path / "align.1.txt")]
+    expected = compute_far_frr.scoreFiles(filepaths, bucket_size=5)
+    assert compute_far_frr.scoreFiles(filepaths, bucket_size=5, jobs=2, chunk_size=997) == expected
+    buckets = list(compute_far_frr.summary(expected)["buckets"])
+    assert buckets[-3:] == ["1-5", "6-10", "11-15"]
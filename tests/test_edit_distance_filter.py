@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+# Checks the banded edit distance against the full one, and that the parallel
+# path excludes the same utterances in the same order.
+import sys
+import os.path
+import random
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "kaldi-scripts"))
+import edit_distance_filter
+
+def test_bounded_levenshtein():
+    rng = random.Random(0)
+    for _ in range(2000):
+        a = [rng.choice("abc") for _ in range(rng.randint(0, 8))]
+        b = [rng.choice("abc") for _ in range(rng.randint(0, 8))]
+        max_distance = rng.randint(0, 4)
+        distance = edit_distance_filter.levenshtein(a, b)
+        assert edit_distance_filter.boundedLevenshtein(a, b, max_distance) == min(distance, max_distance + 1)
+
+def test_parallel():
+    rng = random.Random(1)
+    line_pairs = []
+    for i in range(500):
+        words = [rng.choice("abcdef") for _ in range(rng.randint(1, 10))]
+        other = [word if rng.random() < 0.8 else "x" for word in words]
+        line_pairs.append(("utt%d %s\n" % (i, " ".join(words)), "utt%d %s\n" % (i, " ".join(other))))
+    expected = edit_distance_filter.excludedUttids(line_pairs, 1)
+    results = list(edit_distance_filter.parallelExcludedUttids(line_pairs, 1, 2, chunk_size=50))
+    assert sum(num_pairs for num_pairs, _ in results) == expected[0] == 500
+    assert [uttid for _, excluded in results for uttid in excluded] == expected[1]
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+# Checks that the on-disk graph cache gives back the same output as building
+# the prompts, and that eviction keeps the most recently used entries.
+import sys
+import os
+import os.path
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import graph_cache
+import make_miscue_tolerant_lms as mtlm
+
+PROMPTS = ["p1 the cat sat on the mat",
+        "p2 a dog ran in the park",
+        "p3 the cat sat on the mat"]
+
+def test_cached_output_is_the_same(tmp_path):
+    direct = mtlm.makeSettings(kaldi_style=True)
+    for _ in range(2):
+        cached = mtlm.makeSettings(kaldi_style=True, graph_cache=graph_cache.GraphCache(str(tmp_path), 1 << 30),
+                graph_cache_fingerprint=graph_cache.GraphCache.key("test"))
+        for line in PROMPTS:
+            assert mtlm.promptOutput(line, cached)[:3] == mtlm.promptOutput(line, direct)[:3]
+    # p3 is the same prompt as p1, with another ID:
+    assert (cached["graph_cache"].hits, cached["graph_cache"].misses) == (3, 0)
+    assert mtlm.promptOutput(PROMPTS[2], cached)[1].startswith("p3\n")
+
+def test_evict_keeps_recent_entries(tmp_path):
+    cache = graph_cache.GraphCache(str(tmp_path), 250)
+    for i in range(5):
+        key = cache.key(i)
+        cache.put(key, b"x" * 100)
+        os.utime(cache.path(key), (i, i))
+    cache.get(cache.key(0))
+    cache.evict()
+    assert cache.evicted == 3
+    assert cache.get(cache.key(0)) is not None
+    assert cache.get(cache.key(4)) is not None
+    assert cache.get(cache.key(1)) is None
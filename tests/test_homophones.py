@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+# Checks that homophone groups sharing a word are merged, and that the FST then
+# suppresses homophone arcs regardless of the order the arcs are added in.
+import sys
+import os.path
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "kaldi-scripts"))
+import prompt_lmfst
+import make_extended_lexicon
+
+def test_classes():
+    homophones = prompt_lmfst.homophonesFromGroups([["read", "red"], ["reed", "read"], ["two", "too"], ["cat"]])
+    assert homophones.sameClass("red", "reed") and not homophones.sameClass("red", "two")
+    assert homophones["red"] == frozenset(["read", "red", "reed"])
+    assert "cat" in homophones and "dog" not in homophones and homophones["dog"] == frozenset()
+    assert sorted(sorted(words) for words in homophones.groups()) == [
+            ["cat"], ["read", "red", "reed"], ["too", "two"]]
+
+def test_arcs():
+    homophones = prompt_lmfst.homophonesFromGroups([["read", "red"], ["reed", "read"]])
+    for order in (["red", "read", "reed"], ["reed", "red", "read"]):
+        fst = prompt_lmfst.PromptLMFST(homophones)
+        fst.addWordSequence(["a"])
+        for label in order:
+            fst.addArc(0, 1, label, label, 1.)
+        assert [arc.in_label for arc in fst.states[0]] == order[:1]
+
+def test_get_homophones():
+    lexicon = {"read": ["r eh d", "r iy d"], "red": ["r eh d"], "reed": ["r iy d"], "cat": ["k ae t"]}
+    groups = make_extended_lexicon.getHomophones(lexicon, ["read", "red", "reed", "cat"])
+    assert sorted(sorted(words) for words in groups) == [["cat"], ["read", "red", "reed"]]
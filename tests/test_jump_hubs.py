@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# Checks that the jump hub topology gives the same per-path costs as the
+# dense jump arcs. Run from the repository root, e.g. python3 -m pytest tests
+# For each state of the dense FST, every path that consumes exactly one label
+# (epsilons through the hub states included) must have a matching path in the
+# hub FST, with the same cost.
+import sys
+import os.path
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from collections import defaultdict
+import prompt_lmfst
+import make_miscue_tolerant_lms as mtlm
+
+def buildFST(prompt, jump_topology, truncations=set()):
+    fst = prompt_lmfst.PromptLMFST(homophones=defaultdict(set))
+    fst.addWordSequence(prompt.split())
+    mtlm.addCorrectPaths(fst, mtlm.weights)
+    mtlm.addRubbishPaths(fst, mtlm.weights, mtlm.special_labels)
+    mtlm.addSkipPaths(fst, mtlm.weights)
+    mtlm.addRepeatPaths(fst, mtlm.weights)
+    mtlm.addPrematureEnds(fst, mtlm.weights)
+    if jump_topology == "hubs":
+        mtlm.addJumpHubsBackward(fst, mtlm.weights, mtlm.special_labels)
+        mtlm.addJumpHubsForward(fst, mtlm.weights, mtlm.special_labels)
+    else:
+        mtlm.addJumpsBackward(fst, mtlm.weights)
+        mtlm.addJumpsForward(fst, mtlm.weights)
+    mtlm.addTruncations(fst, mtlm.weights, mtlm.special_labels, truncations)
+    mtlm.convertRelativeProbs(fst)
+    return fst
+
+def onePathCosts(fst, state, hub_states, cost=0.):
+    # Returns a list of (label, destination, cost) for each path from state
+    # that goes through hub states only, and ends in a labelled arc.
+    result = []
+    for leaf in fst.states[state]:
+        if not isinstance(leaf, prompt_lmfst.Arc):
+            result.append(("<final>", None, cost + leaf.weight))
+        elif leaf.to_state in hub_states:
+            result.extend(onePathCosts(fst, leaf.to_state, hub_states, cost + leaf.weight))
+        else:
+            result.append((leaf.in_label, leaf.to_state, cost + leaf.weight))
+    return result
+
+def assertSamePathCosts(prompt, truncations=set()):
+    dense = buildFST(prompt, "dense", truncations)
+    hubs = buildFST(prompt, "hubs", truncations)
+    hub_states = set(hubs.states) - set(dense.states)
+    for state in dense.states:
+        dense_paths = sorted(onePathCosts(dense, state, set()), key=repr)
+        hub_paths = sorted(onePathCosts(hubs, state, hub_states), key=repr)
+        assert len(dense_paths) == len(hub_paths), (prompt, state)
+        for (d_label, d_to, d_cost), (h_label, h_to, h_cost) in zip(dense_paths, hub_paths):
+            assert (d_label, d_to) == (h_label, h_to), (prompt, state)
+            assert abs(d_cost - h_cost) < 1e-9, (prompt, state, d_label, d_cost, h_cost)
+
+def test_short_prompts():
+    assertSamePathCosts("the")
+    assertSamePathCosts("the cat")
+    assertSamePathCosts("the cat sat")
+
+def test_long_prompt():
+    words = ["w" + str(i) for i in range(40)]
+    assertSamePathCosts(" ".join(words), truncations={"[TRUNC]:w3", "[TRUNC]:w17"})
+
+def test_hubs_are_linear():
+    words = ["w" + str(i) for i in range(100)]
+    fst = buildFST(" ".join(words), "hubs")
+    num_arcs = sum(len(leaves) for leaves in fst.states.values())
+    assert num_arcs < 20 * len(words)
+
+def test_estimated_num_arcs():
+    settings = mtlm.makeSettings(truncations={"[TRUNC]:w1"})
+    for jump_topology in ("dense", "hubs"):
+        settings["jump_topology"] = jump_topology
+        for num_words in (1, 2, 3, 10):
+            words = ["w" + str(i) for i in range(num_words)]
+            fst = buildFST(" ".join(words), jump_topology, settings["truncations"])
+            num_arcs = sum(len(leaves) for leaves in fst.states.values())
+            assert mtlm.estimateNumArcs(words, settings) == num_arcs, (jump_topology, num_words)
+
+if __name__ == "__main__":
+    test_short_prompts()
+    test_long_prompt()
+    test_hubs_are_linear()
+    print("Jump hub path costs match the dense jumps.")
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# Checks that the lazy FSTs, built one state at a time, are the same as the
+# FSTs built with the recipes, also when jumps are pruned.
+import sys
+import os.path
+import random
+import io
+import struct
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import prompt_lmfst
+import make_miscue_tolerant_lms as mtlm
+from test_binary_fst import readBinaryFst
+
+HOMOPHONES = prompt_lmfst.readHomophones(os.path.join(os.path.dirname(os.path.abspath(__file__)), "homophones.txt"))
+
+def test_lazy_is_the_same():
+    rng = random.Random(0)
+    words = ["the", "cat", "too", "two", "carat", "carrot", "sat"]
+    for i in range(200):
+        line = "p%d " % i + " ".join(rng.choice(words) for _ in range(rng.randint(1, 10)))
+        options = dict(max_jump_distance=rng.choice([None, 3]), min_arc_prob=rng.choice([None, 0.0005]),
+                truncations=rng.choice([None, {"[TRUNC]:cat", "[TRUNC]:too"}]))
+        expected, expected_pruned = mtlm.buildPromptFST(line,
+                mtlm.makeSettings(homophones=HOMOPHONES, kaldi_style=True, **options))
+        fst, num_pruned = mtlm.buildPromptFST(line,
+                mtlm.makeSettings(homophones=HOMOPHONES, kaldi_style=True, lazy=True, **options))
+        assert isinstance(fst, mtlm.LazyPromptLMFST)
+        assert fst.inText() == expected.inText() and num_pruned == expected_pruned, line
+
+def float32(weight):
+    return struct.unpack("<f", struct.pack("<f", weight))[0]
+
+def test_lazy_archive(tmp_path):
+    # The binary output has the states in the order they are built in, not renumbered
+    # like fstcompile, so it is read back and compared with the states of buildFST's FST
+    symbols = prompt_lmfst.SymbolTable(os.path.join(os.path.dirname(os.path.abspath(__file__)), "words_table.txt"))
+    line = "p1 the cat and the dog"
+    settings = mtlm.makeSettings(homophones=HOMOPHONES, kaldi_style=True)
+    expected = mtlm.buildPromptFST(line, settings)[0]
+    settings["lazy"] = True
+    with prompt_lmfst.KaldiFstArchiveWriter(str(tmp_path / "G.ark")) as archive:
+        offset = archive.writeFST("p1", mtlm.buildPromptFST(line, settings)[0], symbols, symbols)
+    data = (tmp_path / "G.ark").read_bytes()
+    assert data.startswith(b"p1 \0B") and offset == 3
+    header, states = readBinaryFst(io.BytesIO(data[5:]))
+    assert header == (prompt_lmfst.FST_MAGIC_NUMBER, "vector", "standard", 2, 0, 0)
+    properties, = struct.unpack_from("<Q", data, 5 + 34)
+    assert properties == prompt_lmfst.FST_EXPANDED | prompt_lmfst.FST_MUTABLE | prompt_lmfst.FST_I_LABEL_SORTED
+    assert len(states) == len(expected.states)
+    for state, (final_weight, arcs) in enumerate(states):
+        leaves = expected.states[state]
+        final_weights = [leaf.weight for leaf in leaves if isinstance(leaf, prompt_lmfst.FinalState)]
+        assert final_weight == float32(final_weights[-1] if final_weights else float("inf"))
+        assert arcs == sorted(((int(symbols[leaf.in_label]), int(symbols[leaf.out_label]),
+                float32(leaf.weight), leaf.to_state) for leaf in leaves if isinstance(leaf, prompt_lmfst.Arc)),
+                key=lambda arc: arc[:2])
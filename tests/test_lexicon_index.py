@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+# Checks that the binary lexicon index gives the same entries as parsing the lexicon,
+# and that it is rebuilt when the lexicon changes.
+import sys
+import os
+import os.path
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "kaldi-scripts"))
+import lexicon_index
+
+LEXICON = """<SPOKEN_NOISE> 1.0 SPN
+too 1.0 t uw
+two 1.0 t uw
+two 0.5 t uw
+tomato 1.0 t ax m aa t ow
+tomato 1.0 t ax m ey t ow
+zoë 1.0 z ow iy
+empty
+"""
+
+def test_lexicon_index(tmp_path):
+    lexiconfile = str(tmp_path / "lexiconp.txt")
+    (tmp_path / "lexiconp.txt").write_text(LEXICON, encoding="utf-8")
+    index = lexicon_index.LexiconIndex.load(lexiconfile)
+    assert os.path.exists(lexicon_index.indexPath(lexiconfile))
+    assert len(index) == 5
+    assert index["two"] == ["1.0 t uw", "0.5 t uw"]
+    assert index["tomato"] == ["1.0 t ax m aa t ow", "1.0 t ax m ey t ow"]
+    assert index["zoë"] == ["1.0 z ow iy"]
+    assert index.pronunciationTokens(index.pronunciationIDs("zoë")[0]) == ["1.0", "z", "ow", "iy"]
+    assert "empty" not in index and "three" not in index
+    assert index.homophones("too") == ["too", "two"]
+    assert index.subset(["too", "three"]) == {"too": ["1.0 t uw"]}
+    # Loaded from the file the second time, and rebuilt after a change:
+    assert isinstance(lexicon_index.LexiconIndex.load(lexiconfile).buf, lexicon_index.mmap.mmap)
+    (tmp_path / "lexiconp.txt").write_text(LEXICON + "three 1.0 th r iy\n", encoding="utf-8")
+    index = lexicon_index.LexiconIndex.load(lexiconfile)
+    assert index["three"] == ["1.0 th r iy"]
+    assert len(lexicon_index.LexiconIndex.load(lexiconfile)) == 6
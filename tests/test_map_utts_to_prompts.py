@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+# Checks the in-process prompt mapping against known cksum outputs, and that
+# the prompt shards cover the prompts table. Run from the repository root,
+# e.g. python3 -m pytest tests
+import sys
+import os.path
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "kaldi-scripts"))
+import map_utts_to_prompts
+
+def test_cksum():
+    # Values from: echo "$prompt" | cksum
+    assert map_utts_to_prompts.cksum(b"") == 4294967295
+    assert map_utts_to_prompts.cksum(b"the cat sat\n") == 200719092
+    assert map_utts_to_prompts.cksum(" double  space\n".encode("utf-8")) == 900130641
+
+def test_map_and_shard(tmp_path):
+    text = tmp_path / "text"
+    text.write_text("u1 the cat sat\nu2 the cat sat\nu3 a b c d e f g\nu4 one\n", encoding="utf-8")
+    utt2promptcrc, prompt_lines = map_utts_to_prompts.mapUttsToPrompts(str(text))
+    assert utt2promptcrc[0] == ("u1", "200719092")
+    assert utt2promptcrc[0][1] == utt2promptcrc[1][1]
+    assert len(prompt_lines) == 3
+    shards, total_costs = map_utts_to_prompts.shardPrompts(prompt_lines, 2)
+    assert sorted(sum(shards, [])) == prompt_lines
+    assert total_costs[0] == map_utts_to_prompts.promptCost("a b c d e f g")
+    # The longest prompt gets a shard of its own:
+    assert [line.split(" ", 1)[1] for line in shards[0]] == ["a b c d e f g"]
+
+if __name__ == "__main__":
+    test_cksum()
+    print("cksum matches.")
+
+def test_shards_are_balanced():
+    # Longest processing time first is within 4/3 of the optimum
+    prompt_lines = [str(i) + " " + " ".join(["w"] * (i % 17 + 1)) for i in range(200)]
+    shards, total_costs = map_utts_to_prompts.shardPrompts(prompt_lines, 8)
+    assert sum(len(shard) for shard in shards) == 200
+    assert max(total_costs) <= 4. / 3 * sum(total_costs) / 8
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# Starts the prompt FST server on a Unix socket in a thread, and checks that
+# it returns the same G as the recipes, from the cache the second time.
+import sys
+import os.path
+import threading
+import pytest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "kaldi-scripts"))
+import prompt_lmfst
+import make_miscue_tolerant_lms as mtlm
+import prompt_fst_server
+import make_extended_lexicon
+import prompt_fst_client
+
+LEXICON = """<SPOKEN_NOISE> SPN
+the dh ax
+cat k ae t
+sat s ae t
+too t uw
+two t uw
+carrot k ae r ax t
+"""
+
+def test_server(tmp_path):
+    (tmp_path / "lexicon.txt").write_text(LEXICON, encoding="utf-8")
+    lexicon, lexiconstyle, lexicon_constant = make_extended_lexicon.loadLexicon(str(tmp_path))
+    assert lexiconstyle == "lexicon.txt"
+    settings = mtlm.makeSettings()
+    builder = prompt_fst_server.PromptFSTBuilder(lexicon, lexicon_constant, "<SPOKEN_NOISE>",
+            mtlm.special_labels["Truncation"], settings)
+    service = prompt_fst_server.PromptFSTService(builder, cache_size=10)
+    server = prompt_fst_server.makeServer(service, socket_path=str(tmp_path / "server.sock"))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        client = prompt_fst_client.PromptFSTClient(socket_path=str(tmp_path / "server.sock"))
+        first = client.fst("the cat sat on two too carrot")
+        second = client.fst("the  cat sat on two too carrot ")
+        for bad in [{"prompt": 5}, {"prompt": None}, {}, ["the cat"]]:
+            with pytest.raises(RuntimeError, match="Server error 400"):
+                client.request("POST", "/fst", bad)
+        metrics = client.metrics()
+        client.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+    assert not first["cached"] and second["cached"]
+    assert first["uniqued_prompt"] == "the@0 cat@1 sat@2 on@3 two@4 too@5 carrot@6"
+    assert ["too@5", "two@4"] in first["homophones"]
+    assert first["truncations"] == ["[TRUNC]:carrot@6"]
+    homophones = prompt_lmfst.homophonesFromGroups(first["homophones"])
+    expected, _ = mtlm.buildFST(None, first["uniqued_prompt"].split(), homophones,
+            set(first["truncations"]), settings)
+    assert first["fst"] == second["fst"] == expected.inText()
+    assert (metrics["requests"], metrics["hits"], metrics["misses"], metrics["errors"]) == (6, 1, 1, 4)
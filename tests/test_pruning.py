@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# Checks the pruning of the dense jumps: builds prompts with and without it, and
+# compares the arcs of the two FSTs.
+import sys
+import os.path
+import math
+from collections import Counter
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import prompt_lmfst
+import make_miscue_tolerant_lms as mtlm
+
+PROMPT = "p1 the cat sat on the mat and the dog sat on the log"
+
+def arcs(fst):
+    return [leaf for leaves in fst.states.values() for leaf in leaves if isinstance(leaf, prompt_lmfst.Arc)]
+
+def wordsJumpedOver(fst, arc):
+    # The number of words a jump goes over, from the positions of its states in the prompt,
+    # or None for arcs from or to the rubbish states. From position a, the word read
+    # is the one that ends at position b: forward over b-1-a words, backward over a-b.
+    positions = {}
+    for i, word in enumerate(fst.words):
+        positions[word.start] = i
+        positions[word.final] = i + 1
+    if arc.from_state not in positions or arc.to_state not in positions:
+        return None
+    a, b = positions[arc.from_state], positions[arc.to_state]
+    return b - 1 - a if b > a else a - b
+
+def prunedArcs(unpruned, pruned):
+    # The arcs of unpruned that are missing from pruned. Parallel arcs (a skip and
+    # the jump over one word) are told apart by the probability, the least probable are missing.
+    missing = Counter((arc.from_state, arc.to_state, arc.in_label) for arc in arcs(unpruned))
+    missing.subtract((arc.from_state, arc.to_state, arc.in_label) for arc in arcs(pruned))
+    result = []
+    for key, count in missing.items():
+        if count > 0:
+            parallel = [arc for arc in arcs(unpruned) if (arc.from_state, arc.to_state, arc.in_label) == key]
+            result.extend(sorted(parallel, key=lambda arc: arc.weight, reverse=True)[:count])
+    return result
+
+def test_pruning():
+    unpruned, num_pruned = mtlm.buildPromptFST(PROMPT, mtlm.makeSettings(kaldi_style=True))
+    assert num_pruned == 0
+    for max_jump_distance, min_arc_prob in ((2, None), (None, 0.0015), (3, 0.001)):
+        settings = mtlm.makeSettings(kaldi_style=True, max_jump_distance=max_jump_distance,
+                min_arc_prob=min_arc_prob)
+        pruned, num_pruned = mtlm.buildPromptFST(PROMPT, settings)
+        assert num_pruned > 0
+        assert num_pruned == len(arcs(unpruned)) - len(arcs(pruned))
+        assert len(prunedArcs(unpruned, pruned)) == num_pruned
+        if max_jump_distance is not None:
+            distances = [wordsJumpedOver(pruned, arc) for arc in arcs(pruned)]
+            assert max(distance for distance in distances if distance is not None) <= max_jump_distance
+            if min_arc_prob is None:
+                num_leaves = sum(len(leaves) for leaves in pruned.states.values())
+                assert mtlm.estimateNumArcs(PROMPT.split()[1:], settings) == num_leaves
+        if min_arc_prob is not None and max_jump_distance is None:
+            assert all(math.exp(-arc.weight) < min_arc_prob for arc in prunedArcs(unpruned, pruned))
+        # The lazy FSTs prune the same arcs
+        lazy, lazy_pruned = mtlm.buildPromptFST(PROMPT, dict(settings, lazy=True))
+        assert lazy.inText() == pruned.inText() and lazy_pruned == num_pruned
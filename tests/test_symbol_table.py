@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# Checks that the output with --words-table (and --eps-to-disambig) is the text
+# output mapped like utils/sym2int.pl -f 3-4 (and utils/eps2disambig.pl) would map it,
+# and the handling of OOVs with and without --map-oov.
+import sys
+import os.path
+import pytest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import prompt_lmfst
+import make_miscue_tolerant_lms as mtlm
+
+WORDS_TABLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "words_table.txt")
+
+def buildFST(prompt):
+    return mtlm.buildPromptFST(prompt, mtlm.makeSettings())[0]
+
+def mapByHand(text, table, map_oov=None, eps_to_disambig=False):
+    # Like eps2disambig.pl and then sym2int.pl -f 3-4, with the table as a dict
+    lines = []
+    for line in text.splitlines():
+        fields = line.split()
+        if len(fields) > 3:
+            if eps_to_disambig and fields[2] == "<eps>":
+                fields[2] = "#0"
+            fields[2:4] = [str(table.get(label, map_oov)) for label in fields[2:4]]
+        lines.append(" ".join(fields) + "\n")
+    return "".join(lines)
+
+def readTable():
+    with open(WORDS_TABLE, encoding="utf-8") as fi:
+        return dict((line.split()[0], int(line.split()[1])) for line in fi)
+
+def countWarnings(capsys):
+    return capsys.readouterr().err.count("Replacing")
+
+def test_words_table():
+    fst = buildFST("the cat and the dog")
+    symbols = prompt_lmfst.SymbolTable(WORDS_TABLE)
+    assert fst.inText(symbols, symbols) == mapByHand(fst.inText(), readTable())
+    disambig = symbols.relabelled(prompt_lmfst.Relabeling({"<eps>": "#0"}))
+    text = fst.inText(disambig, symbols)
+    assert text == mapByHand(fst.inText(), readTable(), eps_to_disambig=True)
+    # Only the input side is changed:
+    labels = [line.split()[2:4] for line in text.splitlines() if len(line.split()) > 3]
+    assert ["11", "0"] in labels and not any(in_label == "0" or out_label == "11" for in_label, out_label in labels)
+
+def test_oovs():
+    fst = buildFST("the cat sat on the mat")
+    with pytest.raises(KeyError):
+        fst.inText(prompt_lmfst.SymbolTable(WORDS_TABLE), prompt_lmfst.SymbolTable(WORDS_TABLE))
+    for map_oov, oov_id in (("[RUB]", 1), ("2", 2)):
+        symbols = prompt_lmfst.SymbolTable(WORDS_TABLE, map_oov=map_oov)
+        assert fst.inText(symbols, symbols) == mapByHand(fst.inText(), readTable(), oov_id)
+    with pytest.raises(KeyError):
+        prompt_lmfst.SymbolTable(WORDS_TABLE, map_oov="[NOT-IN-TABLE]")
+
+def test_oov_warnings(capsys):
+    # Each OOV in the output is warned about once, up to 20 warnings, in the text and the binary output
+    fst = buildFST("the cat sat")
+    num_oovs = mapByHand(fst.inText(), readTable()).count("None")
+    assert 0 < num_oovs < prompt_lmfst.SymbolTable.max_warnings
+    capsys.readouterr()
+    symbols = prompt_lmfst.SymbolTable(WORDS_TABLE, map_oov="[RUB]")
+    fst.inText(symbols, symbols)
+    assert countWarnings(capsys) == num_oovs
+    symbols = prompt_lmfst.SymbolTable(WORDS_TABLE, map_oov="[RUB]")
+    fst.inBinary(symbols, symbols)
+    assert countWarnings(capsys) == num_oovs
+    symbols = prompt_lmfst.SymbolTable(WORDS_TABLE, map_oov="[RUB]")
+    buildFST("sat on the mat by the door").inText(symbols, symbols)
+    assert countWarnings(capsys) == prompt_lmfst.SymbolTable.max_warnings
+    assert symbols.num_warnings > prompt_lmfst.SymbolTable.max_warnings
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+# Checks that prompts built from a cached topology template are the same
+# as the ones built with the recipes directly.
+import sys
+import os.path
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import prompt_lmfst
+import make_miscue_tolerant_lms as mtlm
+
+HOMOPHONES = prompt_lmfst.readHomophones(os.path.join(os.path.dirname(os.path.abspath(__file__)), "homophones.txt"))
+TRUNCATIONS = {"[TRUNC]:cat", "[TRUNC]:carrot", "[TRUNC]:park"}
+
+PROMPTS = ["p1 the cat sat on the mat",
+        "p2 a dog ran in the park",
+        "p3 two carat carrot too and so",
+        "p4 too carrot two carat big cat",
+        "p5 the the the the the the",
+        "p6 one"]
+
+def test_cached_prompts_are_the_same():
+    for compact in (False, True):
+        direct = mtlm.makeSettings(homophones=HOMOPHONES, truncations=TRUNCATIONS, kaldi_style=True,
+                compact=compact)
+        cached = mtlm.makeSettings(homophones=HOMOPHONES, truncations=TRUNCATIONS, kaldi_style=True,
+                compact=compact, topology_cache=mtlm.TopologyCache(10))
+        for line in PROMPTS + PROMPTS:
+            expected = mtlm.buildPromptFST(line, direct)[0].inText()
+            assert mtlm.buildPromptFST(line, cached)[0].inText() == expected, line
+        assert cached["topology_cache"].hits > 0
+
+def test_homophones_change_the_shape():
+    shape_a, _ = mtlm.promptShape("two too".split(), HOMOPHONES, TRUNCATIONS, mtlm.special_labels)
+    shape_b, _ = mtlm.promptShape("two big".split(), HOMOPHONES, TRUNCATIONS, mtlm.special_labels)
+    assert shape_a != shape_b
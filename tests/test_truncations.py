@@ -0,0 +1,15 @@
+#!/usr/bin/env python3
+# Checks that each distinct truncation of a word is added once, and the cap on them.
+import sys
+import os.path
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "kaldi-scripts"))
+import make_extended_lexicon
+
+def test_truncations():
+    lexicon = {"tomato": ["1.0 t ax m aa t ow z", "1.0 t ax m ey t ow z"], "cat": ["1.0 k ae t"]}
+    truncwords = make_extended_lexicon.addTruncations(lexicon, ["tomato", "cat"], "[TRUNC]:")
+    assert truncwords == set(["[TRUNC]:tomato"])
+    assert lexicon["[TRUNC]:tomato"] == ["1.0 t ax", "1.0 t ax m", "1.0 t ax m aa", "1.0 t ax m ey"]
+    lexicon = {"tomato": ["t ax m aa t ow z", "t ax m ey t ow z"]}
+    make_extended_lexicon.addTruncations(lexicon, ["tomato"], "[TRUNC]:", LEXICON_CONSTANT=0, max_truncations=2)
+    assert lexicon["[TRUNC]:tomato"] == ["t ax", "t ax m"]
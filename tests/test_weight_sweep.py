@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+# Checks that the FSTs of a weight sweep are the same as the ones built
+# from scratch with each weights dict.
+import sys
+import os.path
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import prompt_lmfst
+import make_miscue_tolerant_lms as mtlm
+
+HOMOPHONES = prompt_lmfst.readHomophones(os.path.join(os.path.dirname(os.path.abspath(__file__)), "homophones.txt"))
+TRUNCATIONS = {"[TRUNC]:cat", "[TRUNC]:carrot", "[TRUNC]:one"}
+
+PROMPTS = ["p1 the cat sat on the mat",
+        "p2 two carat carrot too and so on and on",
+        "p3 one"]
+
+WEIGHT_CHANGES = [{},
+        {"Correct": 500., "Skip": 20.},
+        {"LongJumpDecay": 0.5, "JumpBackward": 1., "JumpForward": 7.},
+        {"Truncation": 0.1, "PrematureEnd": 50., "FinalState": 10.}]
+
+def test_sweep_is_the_same_as_rebuilding():
+    weight_configs = [dict(mtlm.weights, **changes) for changes in WEIGHT_CHANGES]
+    for max_jump_distance in (None, 2):
+        for line in PROMPTS:
+            settings = mtlm.makeSettings(homophones=HOMOPHONES, truncations=TRUNCATIONS, kaldi_style=True,
+                    max_jump_distance=max_jump_distance)
+            template, num_pruned = mtlm.buildSweepTemplate(line, settings)
+            for weights in weight_configs:
+                expected, expected_pruned = mtlm.buildPromptFST(line, dict(settings, weights=weights))
+                assert template.normalisedFST(weights).inText() == expected.inText(), (line, weights)
+                assert template.text(weights) == expected.inText(), (line, weights)
+                assert num_pruned == expected_pruned
+
+def test_sweep_needs_dense_jumps():
+    settings = mtlm.makeSettings(homophones=HOMOPHONES, truncations=TRUNCATIONS, kaldi_style=True,
+            jump_topology="hubs")
+    try:
+        mtlm.buildSweepTemplate(PROMPTS[0], settings)
+    except ValueError:
+        return
+    assert False, "Expected a ValueError"